@@ -7,8 +7,17 @@ Implementazione sistema di persistenza del feedback utente con:
 2. API backend per persistenza lato server
 3. Sincronizzazione tra client e server
 4. Gestione conflitti e retry logic
+
+Uso:
+    python feedback_persistence.py                      # stampa tutti i template
+    python feedback_persistence.py --emit ./backend     # scrive backend Flask
+    python feedback_persistence.py --emit ./backend --variant asgi|both
 """
 
+import argparse
+import os
+from typing import Dict, List
+
 # ============================================================================
 # SERVIZIO PERSISTENZA CLIENT-SIDE: feedbackStorage.ts
 # ============================================================================
@@ -34,12 +43,15 @@ export interface FeedbackStore {
 const STORAGE_KEY = 'vantyx_feedback';
 const STORAGE_VERSION = '1.0';
 const STORAGE_VERSION_KEY = 'vantyx_feedback_version';
+// Cursori di /api/feedback/changes, per ambito di sync (sessionId o '*')
+const CURSOR_KEY = 'vantyx_feedback_cursor';
 
 /**
  * Classe per gestione storage feedback
  */
 export class FeedbackStorage {
   private inMemoryStore: FeedbackStore = {};
+  private syncCursors: { [sessionId: string]: string } = {};
   private storageAvailable: boolean = false;
 
   constructor() {
@@ -90,9 +102,14 @@ export class FeedbackStorage {
       if (stored) {
         this.inMemoryStore = JSON.parse(stored);
       }
+      const cursors = localStorage.getItem(CURSOR_KEY);
+      if (cursors) {
+        this.syncCursors = JSON.parse(cursors);
+      }
     } catch (error) {
       console.error('Error loading feedback from storage:', error);
       this.inMemoryStore = {};
+      this.syncCursors = {};
     }
   }
 
@@ -184,6 +201,47 @@ export class FeedbackStorage {
     }
   }
 
+  /**
+   * Applica feedback ricevuti dal server (sync incrementale)
+   * Le modifiche locali non ancora inviate hanno la precedenza
+   */
+  applyRemoteFeedback(remote: FeedbackData[]): number {
+    let applied = 0;
+
+    remote.forEach((feedback) => {
+      const local = this.inMemoryStore[feedback.messageId];
+      if (local && !local.synced) return;
+      this.inMemoryStore[feedback.messageId] = { ...feedback, synced: true };
+      applied++;
+    });
+
+    if (applied > 0) {
+      this.saveToStorage();
+    }
+    return applied;
+  }
+
+  /**
+   * Cursore dell'ultimo pull per sessione (null = mai sincronizzato)
+   */
+  getSyncCursor(sessionId: string): string | null {
+    return this.syncCursors[sessionId] || null;
+  }
+
+  /**
+   * Salva cursore dopo aver applicato una pagina di modifiche
+   */
+  setSyncCursor(cursor: string, sessionId: string): void {
+    this.syncCursors[sessionId] = cursor;
+    if (!this.storageAvailable) return;
+
+    try {
+      localStorage.setItem(CURSOR_KEY, JSON.stringify(this.syncCursors));
+    } catch (error) {
+      console.error('Error saving sync cursor:', error);
+    }
+  }
+
   /**
    * Rimuovi feedback
    */
@@ -197,9 +255,12 @@ export class FeedbackStorage {
    */
   clearAll(): void {
     this.inMemoryStore = {};
+    // Senza cursori il prossimo pull riscarica tutto dal server
+    this.syncCursors = {};
     if (this.storageAvailable) {
       try {
         localStorage.removeItem(STORAGE_KEY);
+        localStorage.removeItem(CURSOR_KEY);
       } catch (error) {
         console.error('Error clearing storage:', error);
       }
@@ -267,77 +328,121 @@ export const feedbackStorage = new FeedbackStorage();
 # ============================================================================
 
 FEEDBACK_API_BACKEND = """
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime, timedelta
-import sqlite3
-import json
+import click
 import os
-from typing import Dict, List, Optional
+import time
+
+import feedback_service as service
+from feedback_db import rebuild_rollups, drop_partitions, expire_partitions, partition_months
+from feedback_tracing import REQUEST_ID_HEADER, span
 
 app = Flask(__name__)
 CORS(app)
 
-# Database configuration
-DB_PATH = os.getenv('FEEDBACK_DB_PATH', 'feedback.db')
+# Inizializza DB (e coda write-behind se attiva) all'avvio
+service.start()
+
 
 # ============================================================================
-# DATABASE SETUP
+# METRICS
 # ============================================================================
 
-def init_db():
-    \"""Inizializza database SQLite per feedback\"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+@app.before_request
+def start_request_timer():
+    if service.metrics.enabled:
+        g.metrics_handler = request.endpoint or 'none'
+        g.metrics_start = time.perf_counter()
+        service.metrics.request_started(g.metrics_handler)
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id TEXT NOT NULL,
-            feedback_type TEXT NOT NULL,
-            session_id TEXT,
-            timestamp TEXT NOT NULL,
-            user_agent TEXT,
-            ip_address TEXT,
-            metadata TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(message_id)
-        )
-    ''')
 
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_message_id ON feedback(message_id)
-    ''')
+@app.after_request
+def observe_request(response):
+    \"""Latenza fino alla risposta della view; la richiesta resta in corso fino alla chiusura del body\"""
+    handler = g.pop('metrics_handler', None)
+    if handler is not None:
+        service.metrics.observe_request(handler, request.method, response.status_code,
+                                        time.perf_counter() - g.metrics_start)
+        response.call_on_close(lambda: service.metrics.request_finished(handler))
+    return response
 
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_timestamp ON feedback(timestamp)
-    ''')
 
-    cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_session_id ON feedback(session_id)
-    ''')
+@app.teardown_request
+def finish_request(exc):
+    # Solo se after_request non è stato eseguito (eccezione non gestita)
+    handler = g.pop('metrics_handler', None)
+    if handler is not None:
+        service.metrics.request_finished(handler)
 
-    conn.commit()
-    conn.close()
 
-# Inizializza DB all'avvio
-init_db()
+# ============================================================================
+# PROFILING
+# ============================================================================
+
+@app.before_request
+def start_request_profile():
+    # Profiler disattivato: un solo controllo per richiesta
+    if service.profiler.enabled and service.should_profile(request.headers):
+        service.profiler.begin(request.endpoint or 'none')
+        g.profiled = True
+
+
+@app.teardown_request
+def finish_request_profile(exc):
+    if g.pop('profiled', False):
+        service.profiler.end()
 
 
 # ============================================================================
-# UTILITY FUNCTIONS
+# TRACING
 # ============================================================================
 
-def get_db_connection():
-    \"""Crea connessione database\"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+class TracedJSONProvider(DefaultJSONProvider):
+    \"""jsonify con span serialize nelle richieste tracciate\"""
 
+    def dumps(self, obj, **kwargs) -> str:
+        with span('serialize'):
+            return super().dumps(obj, **kwargs)
 
-def validate_feedback_type(feedback_type: str) -> bool:
-    \"""Valida tipo feedback\"""
-    return feedback_type in ['positive', 'negative']
+
+app.json = TracedJSONProvider(app)
+
+
+@app.before_request
+def start_request_trace():
+    if not service.tracer.enabled or not service.traced_path(request.path):
+        return
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.trace = service.tracer.begin(
+        f'{request.method} {route}',
+        request.headers.get(REQUEST_ID_HEADER),
+        request.headers.get('traceparent'),
+        {'http.request.method': request.method, 'http.route': route}
+    )
+    if g.trace.sampled and request.method == 'POST':
+        # get_json mette in cache il body: la view non lo decodifica di nuovo
+        with span('parse'):
+            request.get_json(silent=True)
+
+
+@app.after_request
+def finish_request_trace(response):
+    \"""Correlation ID nella risposta; la traccia si chiude prima dell'invio del body\"""
+    trace = g.pop('trace', None)
+    if trace is not None:
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        service.tracer.end(trace, response.status_code)
+    return response
+
+
+@app.teardown_request
+def abort_request_trace(exc):
+    # Solo se after_request non è stato eseguito (eccezione non gestita)
+    trace = g.pop('trace', None)
+    if trace is not None:
+        service.tracer.end(trace, 500)
 
 
 # ============================================================================
@@ -358,93 +463,130 @@ def save_feedback():
     }
     \"""
     try:
-        data = request.get_json()
+        payload, status, headers = service.save_feedback(
+            request.get_json(silent=True),
+            request.headers.get('User-Agent', ''),
+            request.remote_addr
+        )
+        return jsonify(payload), status, headers
 
-        # Validazione input
-        if not data or 'messageId' not in data or 'feedbackType' not in data:
-            return jsonify({
-                'success': False,
-                'error': 'Missing required fields: messageId, feedbackType'
-            }), 400
+    except Exception as e:
+        app.logger.error(f'Error saving feedback: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
 
-        message_id = data['messageId']
-        feedback_type = data['feedbackType']
 
-        if not validate_feedback_type(feedback_type):
-            return jsonify({
-                'success': False,
-                'error': 'Invalid feedbackType. Must be "positive" or "negative"'
-            }), 400
+@app.route('/api/feedback/<message_id>', methods=['GET'])
+def get_feedback(message_id: str):
+    \"""Ottieni feedback per messaggio specifico (read-through cache)\"""
+    try:
+        status, headers, body = service.respond(*service.get_feedback(message_id), request.headers)
+        return app.response_class(body, status=status, headers=headers)
 
-        session_id = data.get('sessionId')
-        timestamp = data.get('timestamp', datetime.utcnow().isoformat())
-        metadata = json.dumps(data.get('metadata', {}))
-        user_agent = request.headers.get('User-Agent', '')
-        ip_address = request.remote_addr
+    except Exception as e:
+        app.logger.error(f'Error retrieving feedback: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
 
-        # Salva nel database
-        conn = get_db_connection()
-        cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT OR REPLACE INTO feedback
-            (message_id, feedback_type, session_id, timestamp, user_agent, ip_address, metadata)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (message_id, feedback_type, session_id, timestamp, user_agent, ip_address, metadata))
+@app.route('/api/feedback/changes', methods=['GET'])
+def get_feedback_changes():
+    \"""
+    Feedback modificati dopo un cursore (sync incrementale dei client)
 
-        conn.commit()
-        feedback_id = cursor.lastrowid
-        conn.close()
+    Query: ?since=<cursore>&sessionId=...&limit=500
+    \"""
+    try:
+        status, headers, body = service.get_feedback_changes(
+            request.args.get('since'),
+            request.args.get('sessionId'),
+            request.args.get('limit', service.CHANGES_PAGE_SIZE, type=int),
+            request.headers
+        )
+        return app.response_class(body, status=status, headers=headers)
 
+    except Exception as e:
+        app.logger.error(f'Error retrieving feedback changes: {str(e)}')
         return jsonify({
-            'success': True,
-            'feedbackId': feedback_id,
-            'messageId': message_id
-        }), 201
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/feedback/stream', methods=['GET'])
+def stream_feedback():
+    \"""
+    Feedback e contatori del giorno in tempo reale (Server-Sent Events)
+
+    Query: ?sessionId=... (solo eventi feedback della sessione)
+    Eventi: feedback, counters (totali + delta), dropped (buffer pieno: riallinearsi)
+    \"""
+    try:
+        subscription, failure = service.open_stream(request.args.get('sessionId'))
+        if failure:
+            payload, status, headers = failure
+            return jsonify(payload), status, headers
+
+        # Con gthread ogni stream aperto occupa un thread del worker
+        return app.response_class(service.stream_events(subscription), headers=service.STREAM_HEADERS)
 
     except Exception as e:
-        app.logger.error(f'Error saving feedback: {str(e)}')
+        app.logger.error(f'Error opening feedback stream: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
         }), 500
 
 
-@app.route('/api/feedback/<message_id>', methods=['GET'])
-def get_feedback(message_id: str):
-    \"""Ottieni feedback per messaggio specifico\"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+@app.route('/api/feedback/lookup', methods=['GET', 'POST'])
+def lookup_feedback():
+    \"""
+    Ottieni feedback per più messaggi in una sola richiesta
 
-        cursor.execute('''
-            SELECT message_id, feedback_type, session_id, timestamp, metadata
-            FROM feedback
-            WHERE message_id = ?
-        ''', (message_id,))
-
-        row = cursor.fetchone()
-        conn.close()
-
-        if row:
-            return jsonify({
-                'success': True,
-                'feedback': {
-                    'messageId': row['message_id'],
-                    'feedbackType': row['feedback_type'],
-                    'sessionId': row['session_id'],
-                    'timestamp': row['timestamp'],
-                    'metadata': json.loads(row['metadata']) if row['metadata'] else {}
-                }
-            }), 200
+    Body (POST): { "messageIds": ["msg_1", "msg_2", ...] }
+    Query (GET): ?messageIds=msg_1,msg_2
+    \"""
+    try:
+        if request.method == 'POST':
+            message_ids = service.lookup_ids_from_body(request.get_json(silent=True))
         else:
-            return jsonify({
-                'success': False,
-                'error': 'Feedback not found'
-            }), 404
+            message_ids = service.parse_id_list(request.args.get('messageIds', ''))
+
+        payload, status, headers = service.lookup_feedback(message_ids)
+        return jsonify(payload), status, headers
 
     except Exception as e:
-        app.logger.error(f'Error retrieving feedback: {str(e)}')
+        app.logger.error(f'Error looking up feedback: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/feedback/export', methods=['GET'])
+def export_feedback():
+    \"""
+    Esporta feedback in streaming (NDJSON o CSV, br/gzip se accettati)
+
+    Query: ?format=ndjson|csv&from=<ISO 8601>&to=<ISO 8601>&sessionId=...&meta.<chiave>=...
+    \"""
+    try:
+        status, headers, body = service.export_feedback(
+            request.args.get('format', 'ndjson'),
+            request.args.get('from'),
+            request.args.get('to'),
+            request.args.get('sessionId'),
+            request.headers.get('Accept-Encoding', ''),
+            request.args.items(multi=True)
+        )
+        return app.response_class(body, status=status, headers=headers)
+
+    except Exception as e:
+        app.logger.error(f'Error exporting feedback: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -458,44 +600,64 @@ def get_feedback_stats():
         # Parametri opzionali per filtrare
         days = request.args.get('days', 30, type=int)
         session_id = request.args.get('sessionId')
+        approx_distinct = request.args.get('approxDistinct', 'false').lower() == 'true'
 
-        start_date = (datetime.utcnow() - timedelta(days=days)).isoformat()
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        status, headers, body = service.get_feedback_stats(
+            days, session_id, approx_distinct, request.args.items(multi=True), request.headers
+        )
+        return app.response_class(body, status=status, headers=headers)
 
-        # Query base
-        query = '''
-            SELECT
-                COUNT(*) as total,
-                SUM(CASE WHEN feedback_type = 'positive' THEN 1 ELSE 0 END) as positive,
-                SUM(CASE WHEN feedback_type = 'negative' THEN 1 ELSE 0 END) as negative
-            FROM feedback
-            WHERE timestamp >= ?
-        '''
+    except Exception as e:
+        app.logger.error(f'Error retrieving stats: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
 
-        params = [start_date]
 
-        if session_id:
-            query += ' AND session_id = ?'
-            params.append(session_id)
+@app.route('/api/feedback/stats/timeseries', methods=['GET'])
+def get_feedback_timeseries():
+    \"""
+    Statistiche per bucket orari o giornalieri in una sola richiesta
 
-        cursor.execute(query, params)
-        row = cursor.fetchone()
-        conn.close()
+    Query: ?interval=hour|day&days=7&sessionId=...
+    \"""
+    try:
+        status, body = service.get_feedback_timeseries(
+            request.args.get('interval', 'day'),
+            request.args.get('days', 30, type=int),
+            request.args.get('sessionId')
+        )
+        status, headers, body = service.respond(status, body, request.headers)
+        return app.response_class(body, status=status, headers=headers)
 
+    except Exception as e:
+        app.logger.error(f'Error retrieving stats timeseries: {str(e)}')
         return jsonify({
-            'success': True,
-            'stats': {
-                'total': row['total'] or 0,
-                'positive': row['positive'] or 0,
-                'negative': row['negative'] or 0,
-                'days': days
-            }
-        }), 200
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/feedback/top', methods=['GET'])
+def get_top_feedback():
+    \"""
+    Valori di una chiave metadata con più voti negativi (o altro ordinamento)
+
+    Query: ?by=prompt&order=negative_ratio&n=20&days=30&minVotes=1
+    \"""
+    try:
+        payload, status, headers = service.get_top_feedback(
+            request.args.get('by'),
+            request.args.get('order', 'negative_ratio'),
+            request.args.get('n', 20, type=int),
+            request.args.get('days', 30, type=int),
+            request.args.get('minVotes', 1, type=int)
+        )
+        return jsonify(payload), status, headers
 
     except Exception as e:
-        app.logger.error(f'Error retrieving stats: {str(e)}')
+        app.logger.error(f'Error retrieving top feedback: {str(e)}')
         return jsonify({
             'success': False,
             'error': 'Internal server error'
@@ -519,87 +681,7687 @@ def save_feedback_batch():
     }
     \"""
     try:
-        data = request.get_json()
+        payload, status, headers = service.save_feedback_batch(
+            request.get_json(silent=True),
+            request.headers.get('User-Agent', ''),
+            request.remote_addr
+        )
+        return jsonify(payload), status, headers
+
+    except Exception as e:
+        app.logger.error(f'Error saving batch feedback: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    \"""Health check endpoint\"""
+    return jsonify(service.health()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    \"""Metriche Prometheus del worker: latenze per route e per statement SQLite, gauge\"""
+    status, headers, body = service.get_metrics()
+    return app.response_class(body, status=status, headers=headers)
+
+
+# ============================================================================
+# ADMIN ENDPOINTS
+# ============================================================================
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+def get_slow_queries():
+    \"""
+    Shape di statement SQLite più costose, con piano (Authorization: Bearer <FEEDBACK_ADMIN_TOKEN>)
+
+    Query: ?order=total|max|avg|count&limit=20
+    \"""
+    try:
+        payload, status, headers = service.get_slow_queries(
+            request.args.get('order', 'total'),
+            request.args.get('limit', 20, type=int),
+            request.headers
+        )
+        return jsonify(payload), status, headers
+
+    except Exception as e:
+        app.logger.error(f'Error retrieving slow queries: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+@app.route('/api/admin/traces', methods=['GET'])
+def get_traces():
+    \"""
+    Ultime tracce del worker in OTLP/JSON (Authorization: Bearer <FEEDBACK_ADMIN_TOKEN>)
+
+    Query: ?limit=20&requestId=<correlation ID>
+    \"""
+    try:
+        payload, status, headers = service.get_traces(
+            request.args.get('limit', 20, type=int),
+            request.args.get('requestId'),
+            request.headers
+        )
+        return jsonify(payload), status, headers
+
+    except Exception as e:
+        app.logger.error(f'Error retrieving traces: {str(e)}')
+        return jsonify({
+            'success': False,
+            'error': 'Internal server error'
+        }), 500
+
+
+# ============================================================================
+# CLI COMMANDS
+# ============================================================================
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    \"""Ricalcola le tabelle rollup dalla tabella feedback\"""
+    counts = rebuild_rollups()
+    print(f"Rollups rebuilt: {counts['days']} days, {counts['sessionDays']} session-days")
+
+
+@app.cli.command('list-partitions')
+def list_partitions_command():
+    \"""Elenca i mesi con partizione feedback\"""
+    for month in partition_months():
+        print(month)
+
+
+@app.cli.command('expire-partitions')
+@click.option('--keep', type=int, default=None, help='Mesi da conservare (default FEEDBACK_RETENTION_MONTHS)')
+@click.option('--before', default=None, help='Elimina i mesi precedenti a YYYY-MM')
+def expire_partitions_command(keep, before):
+    \"""Elimina le partizioni scadute (DROP TABLE per mese)\"""
+    if before:
+        dropped = drop_partitions(before)
+    elif keep is not None:
+        dropped = expire_partitions(keep)
+    else:
+        dropped = expire_partitions()
+    print(f"Dropped partitions: {', '.join(dropped) if dropped else 'none'}")
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    app.run(host='0.0.0.0', port=port, debug=False)
+"""
+
+
+# ============================================================================
+# API BACKEND (ASGI): feedback_api_async.py (Starlette)
+# ============================================================================
+
+FEEDBACK_API_ASYNC = """
+\"""
+Variante ASGI (Starlette) della feedback API
+Stesse route e contratti di feedback_api.py; l'accesso SQLite avviene in un
+executor dedicato, quindi l'event loop non resta mai bloccato
+
+Avvio: uvicorn feedback_api_async:app --host 0.0.0.0 --port 5000
+\"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Optional
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+
+import feedback_service as service
+from feedback_db import POOL_SIZE
+from feedback_tracing import REQUEST_ID_HEADER, span
+
+logger = logging.getLogger('feedback_api_async')
+
+# Un thread per connessione del pool: SQLite lavora solo qui
+db_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='feedback-db')
+
+# Route della richiesta in corso se profilata (impostata da ProfilingMiddleware)
+profiled_route: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('profiled_route', default=None)
+
+
+# ============================================================================
+# UTILITY FUNCTIONS
+# ============================================================================
+
+async def run_db(func, *args):
+    \"""Esegue una funzione che usa SQLite nell'executor dedicato (nel contesto della richiesta: traccia corrente)\"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    route = profiled_route.get()
+    if route is not None:
+        func = partial(profiled_call, route, func)
+    return await loop.run_in_executor(db_executor, partial(context.run, func, *args))
+
+
+def profiled_call(route: str, func, *args):
+    \"""Nel thread dell'executor: campionato dal profiler per la durata della chiamata\"""
+    service.profiler.begin(route)
+    try:
+        return func(*args)
+    finally:
+        service.profiler.end()
+
+
+async def iterate_db(iterator):
+    \"""Consuma un iteratore sincrono che usa SQLite un elemento alla volta nell'executor\"""
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await run_db(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+async def stream_events(subscription):
+    \"""
+    Corpo SSE sull'event loop: nessun thread per connessione. Il thread che
+    pubblica sveglia il loop con call_soon_threadsafe; la disconnessione
+    cancella il generatore e chiude la sottoscrizione.
+    \"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription.wakeup = lambda: loop.call_soon_threadsafe(ready.set)
+    try:
+        yield service.STREAM_RETRY
+        while not subscription.closed:
+            ready.clear()
+            events = subscription.drain()
+            if events:
+                yield b''.join(events)
+                continue
+            try:
+                await asyncio.wait_for(ready.wait(), service.STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Eventuale query dei contatori fuori dall'event loop
+                await run_db(service.broadcaster.refresh)
+                yield service.KEEPALIVE
+    finally:
+        service.broadcaster.unsubscribe(subscription)
+
+
+async def read_json(request: Request):
+    \"""Body JSON o None se assente/non valido (come get_json(silent=True))\"""
+    try:
+        with span('parse'):
+            return await request.json()
+    except ValueError:
+        return None
+
+
+def client_ip(request: Request):
+    return request.client.host if request.client else None
+
+
+def int_arg(request: Request, name: str, default: int) -> int:
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+class JSONResponse(StarletteJSONResponse):
+    \"""JSONResponse con span serialize nelle richieste tracciate\"""
+
+    def render(self, content) -> bytes:
+        with span('serialize'):
+            return super().render(content)
+
+
+def internal_error() -> JSONResponse:
+    return JSONResponse({
+        'success': False,
+        'error': 'Internal server error'
+    }, status_code=500)
+
+
+# ============================================================================
+# API ENDPOINTS
+# ============================================================================
+
+async def save_feedback(request: Request):
+    \"""Salva feedback utente (stesso body di POST /api/feedback Flask)\"""
+    try:
+        data = await read_json(request)
+        args = (data, request.headers.get('user-agent', ''), client_ip(request))
+
+        # In modalità queue/log il salvataggio è un put_nowait o un append: niente executor
+        if service.nonblocking_ingest():
+            payload, status, headers = service.save_feedback(*args)
+        else:
+            payload, status, headers = await run_db(service.save_feedback, *args)
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error saving feedback: {str(e)}')
+        return internal_error()
+
+
+async def get_feedback(request: Request):
+    \"""Ottieni feedback per messaggio specifico (read-through cache)\"""
+    try:
+        message_id = request.path_params['message_id']
+
+        # Hit di cache servite direttamente dall'event loop; il contatore
+        # condiviso (lettura DB) viene riletto nell'executor, al più ogni secondo
+        if service.response_cache.version_due():
+            await run_db(service.response_cache.check_version)
+        cached = service.response_cache.get(message_id)
+        if cached is None:
+            cached = await run_db(service.load_feedback, message_id)
+
+        # ETag dal body in cache; compressione solo oltre soglia (di rado per un feedback)
+        status, headers, body = service.respond(*cached, request.headers)
+        return Response(body, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving feedback: {str(e)}')
+        return internal_error()
+
+
+async def lookup_feedback(request: Request):
+    \"""Ottieni feedback per più messaggi in una sola richiesta\"""
+    try:
+        if request.method == 'POST':
+            message_ids = service.lookup_ids_from_body(await read_json(request))
+        else:
+            message_ids = service.parse_id_list(request.query_params.get('messageIds', ''))
+
+        payload, status, headers = await run_db(service.lookup_feedback, message_ids)
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error looking up feedback: {str(e)}')
+        return internal_error()
+
+
+async def get_feedback_changes(request: Request):
+    \"""Feedback modificati dopo un cursore (sync incrementale dei client)\"""
+    try:
+        status, headers, body = await run_db(
+            service.get_feedback_changes,
+            request.query_params.get('since'),
+            request.query_params.get('sessionId'),
+            int_arg(request, 'limit', service.CHANGES_PAGE_SIZE),
+            request.headers
+        )
+        return Response(body, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving feedback changes: {str(e)}')
+        return internal_error()
+
+
+async def stream_feedback(request: Request):
+    \"""Feedback e contatori del giorno in tempo reale (Server-Sent Events)\"""
+    try:
+        # subscribe legge i contatori dal DB: nell'executor
+        subscription, failure = await run_db(service.open_stream, request.query_params.get('sessionId'))
+        if failure:
+            payload, status, headers = failure
+            return JSONResponse(payload, status_code=status, headers=headers)
+
+        return StreamingResponse(stream_events(subscription), headers=service.STREAM_HEADERS)
+
+    except Exception as e:
+        logger.error(f'Error opening feedback stream: {str(e)}')
+        return internal_error()
+
+
+async def get_feedback_stats(request: Request):
+    \"""Ottieni statistiche aggregate feedback\"""
+    try:
+        days = int_arg(request, 'days', 30)
+        session_id = request.query_params.get('sessionId')
+        approx_distinct = request.query_params.get('approxDistinct', 'false').lower() == 'true'
+
+        status, headers, body = await run_db(
+            service.get_feedback_stats, days, session_id, approx_distinct,
+            request.query_params.multi_items(), request.headers
+        )
+        return Response(body, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving stats: {str(e)}')
+        return internal_error()
+
+
+async def get_feedback_timeseries(request: Request):
+    \"""Statistiche per bucket orari o giornalieri in una sola richiesta\"""
+    try:
+        status, body = await run_db(
+            service.get_feedback_timeseries,
+            request.query_params.get('interval', 'day'),
+            int_arg(request, 'days', 30),
+            request.query_params.get('sessionId')
+        )
+        # Serie lunghe: la compressione gira nell'executor, non sull'event loop
+        status, headers, body = await run_db(service.respond, status, body, request.headers)
+        return Response(body, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving stats timeseries: {str(e)}')
+        return internal_error()
+
+
+async def get_top_feedback(request: Request):
+    \"""Valori di una chiave metadata con più voti negativi (o altro ordinamento)\"""
+    try:
+        payload, status, headers = await run_db(
+            service.get_top_feedback,
+            request.query_params.get('by'),
+            request.query_params.get('order', 'negative_ratio'),
+            int_arg(request, 'n', 20),
+            int_arg(request, 'days', 30),
+            int_arg(request, 'minVotes', 1)
+        )
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving top feedback: {str(e)}')
+        return internal_error()
+
+
+async def export_feedback(request: Request):
+    \"""Esporta feedback in streaming (NDJSON o CSV, br/gzip se accettati)\"""
+    try:
+        params = request.query_params
+        status, headers, body = service.export_feedback(
+            params.get('format', 'ndjson'),
+            params.get('from'),
+            params.get('to'),
+            params.get('sessionId'),
+            request.headers.get('accept-encoding', ''),
+            params.multi_items()
+        )
+        return StreamingResponse(iterate_db(body), status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error exporting feedback: {str(e)}')
+        return internal_error()
+
+
+async def save_feedback_batch(request: Request):
+    \"""Salva multipli feedback in batch (per sincronizzazione)\"""
+    try:
+        data = await read_json(request)
+        payload, status, headers = await run_db(
+            service.save_feedback_batch,
+            data,
+            request.headers.get('user-agent', ''),
+            client_ip(request)
+        )
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error saving batch feedback: {str(e)}')
+        return internal_error()
+
+
+async def health_check(request: Request):
+    \"""Health check endpoint (schema e partizioni letti da SQLite: nell'executor)\"""
+    try:
+        return JSONResponse(await run_db(service.health), status_code=200)
+
+    except Exception as e:
+        logger.error(f'Error retrieving health: {str(e)}')
+        return internal_error()
+
+
+async def get_metrics(request: Request):
+    \"""Metriche Prometheus del worker: latenze per route e per statement SQLite, gauge\"""
+    status, headers, body = service.get_metrics()
+    return Response(body, status_code=status, headers=headers)
+
+
+async def get_slow_queries(request: Request):
+    \"""Shape di statement SQLite più costose, con piano (solo admin)\"""
+    try:
+        # Solo memoria del processo: nessun accesso al DB, niente executor
+        payload, status, headers = service.get_slow_queries(
+            request.query_params.get('order', 'total'),
+            int_arg(request, 'limit', 20),
+            request.headers
+        )
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving slow queries: {str(e)}')
+        return internal_error()
+
+
+async def get_traces(request: Request):
+    \"""Ultime tracce del worker in OTLP/JSON (solo admin)\"""
+    try:
+        # Solo memoria del processo: nessun accesso al DB, niente executor
+        payload, status, headers = service.get_traces(
+            int_arg(request, 'limit', 20),
+            request.query_params.get('requestId'),
+            request.headers
+        )
+        return JSONResponse(payload, status_code=status, headers=headers)
+
+    except Exception as e:
+        logger.error(f'Error retrieving traces: {str(e)}')
+        return internal_error()
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+class MetricsMiddleware:
+    \"""
+    Middleware ASGI: latenza fino a http.response.start per handler/metodo/status.
+
+    L'handler è il nome dell'endpoint della route (come request.endpoint in
+    Flask, 'none' senza route); la richiesta resta in corso fino alla fine
+    del body, stream inclusi.
+    \"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not service.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        handler = route_name(scope)
+        method = scope['method']
+        start = time.perf_counter()
+        observed = False
+
+        async def send_observed(message):
+            nonlocal observed
+            if message['type'] == 'http.response.start' and not observed:
+                observed = True
+                service.metrics.observe_request(handler, method, message['status'], time.perf_counter() - start)
+            await send(message)
+
+        service.metrics.request_started(handler)
+        try:
+            await self.app(scope, receive, send_observed)
+        except Exception:
+            if not observed:
+                service.metrics.observe_request(handler, method, 500, time.perf_counter() - start)
+            raise
+        finally:
+            service.metrics.request_finished(handler)
+
+
+# ============================================================================
+# PROFILING
+# ============================================================================
+
+class ProfilingMiddleware:
+    \"""
+    Middleware ASGI: richieste scelte da service.should_profile.
+
+    Gli handler sono coroutine sullo stesso event loop, il cui stack non è
+    attribuibile a una richiesta: viene campionato il thread dell'executor
+    mentre esegue il lavoro della richiesta in run_db (query e
+    serializzazione), con la route come in Flask.
+    \"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Profiler disattivato: un solo controllo per richiesta
+        if (scope['type'] != 'http' or not service.profiler.enabled
+                or not service.should_profile(Headers(scope=scope))):
+            await self.app(scope, receive, send)
+            return
+
+        token = profiled_route.set(route_name(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiled_route.reset(token)
+
+
+def match_route(scope) -> Optional[Route]:
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match is Match.FULL:
+            return route
+    return None
+
+
+def route_name(scope) -> str:
+    route = match_route(scope)
+    return route.name if route else 'none'
+
+
+# ============================================================================
+# TRACING
+# ============================================================================
+
+class TracingMiddleware:
+    \"""
+    Middleware ASGI: traccia delle richieste /api/feedback* e correlation ID
+    in X-Request-ID. La traccia è corrente nel task della richiesta (e, via
+    run_db, nei thread dell'executor) e si chiude a http.response.start.
+    \"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not service.tracer.enabled or not service.traced_path(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        route = match_route(scope)
+        path = route.path if route else scope['path']
+        method = scope['method']
+        trace = service.tracer.begin(
+            f'{method} {path}',
+            headers.get(REQUEST_ID_HEADER),
+            headers.get('traceparent'),
+            {'http.request.method': method, 'http.route': path}
+        )
+
+        async def send_traced(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, trace.request_id)
+                service.tracer.end(trace, message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            # Nessuna risposta inviata (eccezione): end è idempotente
+            service.tracer.end(trace, 500)
+
+
+# ============================================================================
+# APP
+# ============================================================================
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    await run_db(service.start)
+    yield
+    # Flush coda write-behind prima di chiudere l'executor
+    await run_db(service.stop)
+    db_executor.shutdown(wait=True)
+
+
+# L'ordine conta: le route statiche precedono /api/feedback/{message_id}
+routes = [
+    Route('/api/feedback', save_feedback, methods=['POST']),
+    Route('/api/feedback/batch', save_feedback_batch, methods=['POST']),
+    Route('/api/feedback/stats', get_feedback_stats, methods=['GET']),
+    Route('/api/feedback/stats/timeseries', get_feedback_timeseries, methods=['GET']),
+    Route('/api/feedback/top', get_top_feedback, methods=['GET']),
+    Route('/api/feedback/lookup', lookup_feedback, methods=['GET', 'POST']),
+    Route('/api/feedback/changes', get_feedback_changes, methods=['GET']),
+    Route('/api/feedback/stream', stream_feedback, methods=['GET']),
+    Route('/api/feedback/export', export_feedback, methods=['GET']),
+    Route('/api/feedback/{message_id}', get_feedback, methods=['GET']),
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/metrics', get_metrics, methods=['GET']),
+    Route('/api/admin/slow-queries', get_slow_queries, methods=['GET']),
+    Route('/api/admin/traces', get_traces, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(MetricsMiddleware),
+        Middleware(ProfilingMiddleware),
+        Middleware(TracingMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+    ],
+    lifespan=lifespan,
+)
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 5000))
+    uvicorn.run(app, host='0.0.0.0', port=port)
+"""
+
+
+# ============================================================================
+# ROUTE LOGIC: feedback_service.py (condivisa tra variante Flask e ASGI)
+# ============================================================================
+
+FEEDBACK_SERVICE = """
+\"""
+Logica delle route feedback API indipendente dal framework
+Ogni funzione restituisce (payload, status, headers): feedback_api.py (Flask)
+e feedback_api_async.py (ASGI) si limitano a serializzare il risultato
+\"""
+
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import logging
+import math
+import os
+import random
+import time
+import zlib
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from feedback_db import (
+    BUCKET_MS, INDEXED_KEYS, SLOW_QUERY_ORDERS, add_statement_observer, encode_timestamp, format_timestamp,
+    now_ms, pool, slow_queries
+)
+from feedback_storage import StorageError, create_storage
+from feedback_ingest import WriteBehindQueue
+from feedback_log import AppendOnlyLog
+from feedback_cache import ResponseCache
+from feedback_stream import KEEPALIVE, Broadcaster, Subscription
+from feedback_metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Metrics
+from feedback_profiler import SamplingProfiler
+from feedback_tracing import Tracer, span
+from feedback_logging import LogPipeline
+
+Result = Tuple[Dict, int, Dict[str, str]]
+
+logger = logging.getLogger(__name__)
+
+# Modalità scrittura: 'sync' (commit nella richiesta), 'queue' (write-behind
+# in memoria) o 'log' (append-only log su disco + compactor)
+INGEST_MODE = os.getenv('FEEDBACK_INGEST_MODE', 'sync')
+
+# Limiti batch: dimensione massima richiesta e righe per commit
+BATCH_MAX_ITEMS = int(os.getenv('FEEDBACK_BATCH_MAX_ITEMS', 5000))
+BATCH_CHUNK_SIZE = int(os.getenv('FEEDBACK_BATCH_CHUNK_SIZE', 250))
+
+# Numero massimo di messageIds per /api/feedback/lookup
+LOOKUP_MAX_IDS = int(os.getenv('FEEDBACK_LOOKUP_MAX_IDS', 1000))
+
+# Righe per pagina keyset (e per chunk di risposta) di /api/feedback/export
+EXPORT_PAGE_SIZE = int(os.getenv('FEEDBACK_EXPORT_PAGE_SIZE', 1000))
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+EXPORT_CSV_FIELDS = ['id', 'messageId', 'feedbackType', 'sessionId', 'timestamp', 'metadata']
+
+# Backend di storage (FEEDBACK_STORAGE: sqlite | memory)
+storage = create_storage()
+
+# Cache risposte GET /api/feedback/<message_id>, invalidata dalle scritture;
+# svuotata quando il contatore modifiche nel DB segnala scritture di altri worker
+response_cache = ResponseCache.from_env(version=lambda: storage.version()[0])
+
+# Serie temporali: cache per (interval, days, sessionId, bucket corrente), solo TTL
+timeseries_cache = ResponseCache(
+    max_entries=int(os.getenv('FEEDBACK_TIMESERIES_CACHE_SIZE', 256)),
+    ttl=float(os.getenv('FEEDBACK_TIMESERIES_CACHE_TTL', 10)),
+)
+TIMESERIES_MAX_BUCKETS = int(os.getenv('FEEDBACK_TIMESERIES_MAX_BUCKETS', 2000))
+
+# Righe massime per risposta di /api/feedback/changes
+CHANGES_PAGE_SIZE = int(os.getenv('FEEDBACK_CHANGES_PAGE_SIZE', 500))
+
+# Compressione risposte JSON (gzip, br se brotli è installato) da questa dimensione in byte
+COMPRESS_MIN_BYTES = int(os.getenv('FEEDBACK_COMPRESS_MIN_BYTES', 1024))
+COMPRESS_GZIP_LEVEL = int(os.getenv('FEEDBACK_COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('FEEDBACK_COMPRESS_BROTLI_QUALITY', 4))
+
+# Secondi di validità dell'ETag stats senza scritture (la finestra days scorre)
+STATS_ETAG_WINDOW = max(1, int(os.getenv('FEEDBACK_STATS_ETAG_WINDOW', 300)))
+
+# Top-N per valore metadata: n massimo e z del limite inferiore di Wilson (1.96 = 95%)
+TOP_MAX_N = int(os.getenv('FEEDBACK_TOP_MAX_N', 100))
+TOP_Z = float(os.getenv('FEEDBACK_TOP_Z', 1.96))
+
+# Stream SSE: fan-out delle scritture del processo, contatori del giorno dallo storage
+broadcaster = Broadcaster.from_env(counters=storage.stats)
+
+# Secondi senza eventi prima di un commento keep-alive; attesa di riconnessione del client
+STREAM_KEEPALIVE = float(os.getenv('FEEDBACK_STREAM_KEEPALIVE', 15))
+STREAM_RETRY = f'retry: {int(os.getenv("FEEDBACK_STREAM_RETRY_MS", 3000))}\\n\\n'.encode('utf-8')
+STREAM_HEADERS = {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    # nginx: niente buffering della risposta, gli eventi escono subito
+    'X-Accel-Buffering': 'no',
+}
+
+# Istogrammi per route/status e per statement SQLite, esposti su /metrics
+metrics = Metrics.from_env()
+
+# Token delle route /api/admin/* (Authorization: Bearer ...); vuoto = route admin disattivate
+ADMIN_TOKEN = os.getenv('FEEDBACK_ADMIN_TOKEN', '')
+
+# Shape massime per risposta di /api/admin/slow-queries
+SLOW_QUERY_MAX_LIMIT = 100
+
+# Profiler a campionamento: frazione FEEDBACK_PROFILE_RATE delle richieste e,
+# con FEEDBACK_ADMIN_TOKEN impostato, le richieste admin con questo header
+PROFILE_HEADER = 'X-Feedback-Profile'
+profiler = SamplingProfiler.from_env(on_demand=bool(ADMIN_TOKEN))
+
+# Tracing delle richieste /api/feedback*: span OTLP/JSON in memoria e su file
+tracer = Tracer.from_env()
+
+# Tracce massime per risposta di /api/admin/traces
+TRACE_MAX_LIMIT = 100
+
+# Log non bloccanti: i thread delle richieste accodano, un listener thread scrive
+log_pipeline = LogPipeline.from_env()
+
+ingest_queue: Optional[WriteBehindQueue] = None
+ingest_log: Optional[AppendOnlyLog] = None
+
+
+# ============================================================================
+# LIFECYCLE
+# ============================================================================
+
+def start() -> None:
+    \"""Avvia i log su coda, inizializza lo storage e avvia il writer thread (queue) o recovery + compactor (log)\"""
+    global ingest_queue, ingest_log
+
+    log_pipeline.start()
+    storage.init()
+
+    # Per primo: la fine dello span db.* è presa alla notifica
+    if tracer.enabled:
+        add_statement_observer(tracer.observe_statement)
+        tracer.start()
+    if metrics.enabled:
+        add_statement_observer(observe_statement)
+    if slow_queries.enabled:
+        add_statement_observer(slow_queries.observe)
+
+    if INGEST_MODE == 'queue' and ingest_queue is None:
+        ingest_queue = WriteBehindQueue.from_env(storage, on_commit=committed)
+        ingest_queue.start()
+
+    if INGEST_MODE == 'log' and ingest_log is None:
+        ingest_log = AppendOnlyLog.from_env(storage, on_commit=committed)
+        ingest_log.start()
+
+
+def stop() -> None:
+    \"""Ferma writer thread o compactor (flush di coda/log se configurato), chiude gli stream, scrive profili, tracce e log\"""
+    if ingest_queue is not None:
+        ingest_queue.stop()
+    if ingest_log is not None:
+        ingest_log.stop()
+    broadcaster.close()
+    profiler.stop()
+    tracer.stop()
+    # Per ultimo: i log dello shutdown escono prima della chiusura del listener
+    log_pipeline.stop()
+
+
+def committed(rows: List[Tuple]) -> None:
+    \"""Dopo ogni commit (sync, writer thread o compactor): invalida la cache e pubblica sullo stream\"""
+    response_cache.invalidate_many([row[0] for row in rows])
+    broadcaster.publish(rows)
+
+
+def observe_statement(conn, operation: str, sql: str, parameters, seconds: float) -> None:
+    \"""Observer feedback_db: durata di ogni statement SQLite negli istogrammi\"""
+    metrics.observe_statement(operation, seconds)
+
+
+def nonblocking_ingest() -> bool:
+    \"""True se save_feedback non tocca SQLite né fa fsync (eseguibile sull'event loop)\"""
+    return ingest_queue is not None or (ingest_log is not None and not ingest_log.fsync)
+
+
+# ============================================================================
+# UTILITY FUNCTIONS
+# ============================================================================
+
+def validate_feedback_type(feedback_type: str) -> bool:
+    \"""Valida tipo feedback\"""
+    return feedback_type in ['positive', 'negative']
+
+
+def invalid_feedback_field(feedback: Dict) -> Optional[str]:
+    \"""Errore sui tipi di messageId (stringa non vuota) e sessionId (stringa o null); None se validi\"""
+    message_id = feedback.get('messageId')
+    if not isinstance(message_id, str) or not message_id:
+        return 'Invalid messageId. Must be a non-empty string'
+    if not isinstance(feedback.get('sessionId'), (str, type(None))):
+        return 'Invalid sessionId. Must be a string or null'
+    return None
+
+
+def parse_id_list(raw: str) -> List[str]:
+    \"""Lista di id separati da virgola (query string)\"""
+    return [m for m in raw.split(',') if m]
+
+
+def parse_metadata_filters(params: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+    \"""
+    Parametri ?meta.<chiave>=<valore> -> filtri {chiave: valore}.
+
+    Solo le chiavi in FEEDBACK_INDEXED_KEYS (colonna generata + indice):
+    le altre sarebbero una scansione completa con parse JSON, ValueError.
+    \"""
+    filters = {}
+    for name, value in params:
+        if not name.startswith('meta.'):
+            continue
+        key = name[len('meta.'):]
+        if key not in INDEXED_KEYS:
+            indexed = ', '.join(INDEXED_KEYS) or 'none'
+            raise ValueError(f'Invalid filter "{name}". Indexed metadata keys: {indexed}')
+        filters[key] = value
+    return filters
+
+
+CURSOR_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Massimo INTEGER SQLite: oltre la query fallirebbe con un 500
+MAX_CURSOR = 2 ** 63 - 1
+
+
+def encode_cursor(value: int) -> str:
+    \"""Cursore di /api/feedback/changes: id in base 36\"""
+    digits = ''
+    while True:
+        value, remainder = divmod(value, 36)
+        digits = CURSOR_DIGITS[remainder] + digits
+        if not value:
+            return digits
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    \"""Cursore -> id (assente = 0, dall'inizio); None se non valido\"""
+    if not cursor:
+        return 0
+    try:
+        value = int(cursor, 36)
+    except ValueError:
+        return None
+    return value if 0 <= value <= MAX_CURSOR else None
+
+
+def error(message: str, status: int, headers: Optional[Dict[str, str]] = None) -> Result:
+    return {'success': False, 'error': message}, status, headers or {}
+
+
+def dump_json(payload: Dict) -> bytes:
+    with span('serialize'):
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def is_admin(request_headers) -> bool:
+    \"""Authorization: Bearer <FEEDBACK_ADMIN_TOKEN> (confronto a tempo costante)\"""
+    scheme, _, token = (request_headers.get('Authorization') or '').partition(' ')
+    return bool(ADMIN_TOKEN) and scheme.lower() == 'bearer' and \\
+        hmac.compare_digest(token.strip().encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+
+def should_profile(request_headers) -> bool:
+    \"""Richiesta da profilare: frazione FEEDBACK_PROFILE_RATE o header X-Feedback-Profile: 1 da admin\"""
+    if profiler.rate and random.random() < profiler.rate:
+        return True
+    return profiler.on_demand and request_headers.get(PROFILE_HEADER) == '1' and is_admin(request_headers)
+
+
+def traced_path(path: str) -> bool:
+    \"""Richieste tracciate: /api/feedback* tranne lo stream SSE (connessione di lunga durata)\"""
+    return path.startswith('/api/feedback') and path != '/api/feedback/stream'
+
+
+def write_chunks(rows: List[Tuple], chunk_size: int) -> List[Dict]:
+    \"""
+    Scrive righe a blocchi con storage.upsert_many, un commit per blocco.
+
+    Tra un blocco e l'altro il write lock viene rilasciato, così un batch
+    grande non blocca gli altri writer. Un blocco fallito non interrompe
+    i successivi: viene riportato con la chiave 'error'.
+    \"""
+    chunks = []
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        start = time.perf_counter()
+        info = {'offset': offset, 'size': len(chunk)}
+        try:
+            storage.upsert_many(chunk)
+        except StorageError as e:
+            info['error'] = str(e)
+        else:
+            committed(chunk)
+        info['ms'] = round((time.perf_counter() - start) * 1000, 3)
+        chunks.append(info)
+    return chunks
+
+
+# ============================================================================
+# CONDITIONAL GET / COMPRESSION
+# ============================================================================
+
+# Le risposte di lettura portano un ETag (debole: il body può essere compresso)
+# e Cache-Control: no-cache, quindi il browser rivalida con If-None-Match e
+# riceve 304 senza body se nulla è cambiato. Per stats l'ETag deriva dal
+# contatore modifiche del DB ed è confrontato prima di eseguire le query.
+
+def etag_of(body: bytes) -> str:
+    \"""ETag debole dal contenuto (risposte già serializzate o in cache)\"""
+    return 'W/"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+
+def not_modified(request_headers, etag: str, last_modified_ms: Optional[int] = None) -> bool:
+    \"""If-None-Match (confronto debole) o, in sua assenza, If-Modified-Since\"""
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or etag.removeprefix('W/') in tags
+
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if if_modified_since and last_modified_ms:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return last_modified_ms // 1000 <= since
+    return False
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    \"""'br' (se brotli è installato) o 'gzip' secondo Accept-Encoding, q=0 escluso\"""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, param = part.partition(';')
+        quality = 1.0
+        param = param.strip()
+        if param.startswith('q='):
+            try:
+                quality = float(param[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def respond(status: int, body: bytes, request_headers, etag: Optional[str] = None,
+            last_modified_ms: Optional[int] = None) -> Tuple[int, Dict[str, str], bytes]:
+    \"""
+    Risposta JSON: (status, headers, body) con validatori e compressione.
+
+    Solo i 200 hanno ETag (default: dal contenuto) e possono diventare 304.
+    Il body viene compresso da COMPRESS_MIN_BYTES in su: sotto la soglia gli
+    header di Content-Encoding costano più del risparmio.
+    \"""
+    headers = {'Vary': 'Accept-Encoding'}
+    if status == 200:
+        etag = etag or etag_of(body)
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'no-cache'
+        if last_modified_ms:
+            headers['Last-Modified'] = formatdate(last_modified_ms / 1000, usegmt=True)
+        if not_modified(request_headers, etag, last_modified_ms):
+            return 304, headers, b''
+
+    headers['Content-Type'] = 'application/json'
+    encoding = choose_encoding(request_headers.get('Accept-Encoding', '')) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding == 'br':
+        body = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return status, headers, body
+
+
+# ============================================================================
+# ROUTES
+# ============================================================================
+
+def save_feedback(data: Optional[Dict], user_agent: str, ip_address: Optional[str]) -> Result:
+    \"""POST /api/feedback\"""
+    with span('validate'):
+        # Validazione input
+        if not isinstance(data, dict) or 'messageId' not in data or 'feedbackType' not in data:
+            return error('Missing required fields: messageId, feedbackType', 400)
+
+        # Tipi controllati prima di accodare: in queue/log un errore di scrittura
+        # arriverebbe dopo il 202, senza modo di riportarlo al client
+        invalid = invalid_feedback_field(data)
+        if invalid:
+            return error(invalid, 400)
+
+        message_id = data['messageId']
+        feedback_type = data['feedbackType']
+
+        if not validate_feedback_type(feedback_type):
+            return error('Invalid feedbackType. Must be "positive" or "negative"', 400)
+
+        session_id = data.get('sessionId')
+        ts = encode_timestamp(data['timestamp']) if 'timestamp' in data else now_ms()
+        metadata = json.dumps(data.get('metadata', {}))
+
+        if ts is None:
+            return error('Invalid timestamp. Must be ISO 8601', 400)
+
+        row = (message_id, feedback_type, session_id, ts, user_agent, ip_address, metadata)
+
+    # Write-behind: accoda e rispondi subito, il commit avviene in gruppo
+    if ingest_queue is not None:
+        if not ingest_queue.submit(row):
+            return error('Feedback queue full, retry later', 503, {'Retry-After': '1'})
+
+        return {
+            'success': True,
+            'queued': True,
+            'messageId': message_id
+        }, 202, {}
+
+    # Append-only log: nessun lock SQLite nella richiesta
+    if ingest_log is not None:
+        if not ingest_log.append([row]):
+            return error('Feedback log unavailable, retry later', 503, {'Retry-After': '1'})
+
+        return {
+            'success': True,
+            'queued': True,
+            'messageId': message_id
+        }, 202, {}
+
+    # Salva nel database
+    feedback_id = storage.upsert(row)
+
+    committed([row])
+
+    return {
+        'success': True,
+        'feedbackId': feedback_id,
+        'messageId': message_id
+    }, 201, {}
+
+
+def get_feedback(message_id: str) -> Tuple[int, bytes]:
+    \"""GET /api/feedback/<message_id>: (status, body JSON) dalla cache o dal DB\"""
+    response_cache.check_version()
+    cached = response_cache.get(message_id)
+    if cached is not None:
+        return cached
+    return load_feedback(message_id)
+
+
+def load_feedback(message_id: str) -> Tuple[int, bytes]:
+    \"""Cache miss: legge dal DB e popola la cache\"""
+    generation = response_cache.generation()
+    feedback = storage.get(message_id)
+
+    if feedback:
+        status = 200
+        body = dump_json({
+            'success': True,
+            'feedback': feedback
+        })
+    else:
+        status = 404
+        body = dump_json({
+            'success': False,
+            'error': 'Feedback not found'
+        })
+
+    # Anche i 404 vengono memorizzati (con TTL più breve)
+    response_cache.put(message_id, status, body, generation)
+    return status, body
+
+
+def get_feedback_changes(since: Optional[str], session_id: Optional[str], limit: int,
+                         request_headers=None) -> Tuple[int, Dict[str, str], bytes]:
+    \"""
+    GET /api/feedback/changes: (status, headers, body).
+
+    Feedback scritti dopo il cursore since (assente = dall'inizio), in
+    ordine di scrittura; un cambio voto ricompare con la nuova versione. Il
+    client passa il cursore restituito alla richiesta successiva: hasMore
+    indica che un'altra pagina è già disponibile. Le righe eliminate dalla
+    retention non vengono segnalate.
+    \"""
+    request_headers = request_headers or {}
+    after_id = decode_cursor(since)
+    if after_id is None:
+        return respond(400, dump_json(error('Invalid cursor', 400)[0]), request_headers)
+    if not 1 <= limit <= CHANGES_PAGE_SIZE:
+        return respond(400, dump_json(error(f'Invalid limit. Must be between 1 and {CHANGES_PAGE_SIZE}', 400)[0]),
+                       request_headers)
+
+    changes = storage.changes(after_id, session_id, limit)
+
+    body = dump_json({
+        'success': True,
+        'changes': [feedback for _, feedback in changes],
+        'cursor': encode_cursor(changes[-1][0] if changes else after_id),
+        'hasMore': len(changes) == limit
+    })
+    return respond(200, body, request_headers)
+
+
+def open_stream(session_id: Optional[str]) -> Tuple[Optional[Subscription], Optional[Result]]:
+    \"""GET /api/feedback/stream: (sottoscrizione, None), oppure (None, 503) oltre FEEDBACK_STREAM_MAX_SUBSCRIBERS\"""
+    subscription = broadcaster.subscribe(session_id or None)
+    if subscription is None:
+        return None, error('Too many stream subscribers, retry later', 503, {'Retry-After': '5'})
+    return subscription, None
+
+
+def stream_events(subscription: Subscription) -> Iterator[bytes]:
+    \"""
+    Corpo SSE per server WSGI: il thread della richiesta attende gli eventi
+    e scrive un keep-alive ogni STREAM_KEEPALIVE secondi di silenzio (e, se
+    dovuto, riallinea i contatori). La disconnessione del client (o stop())
+    chiude la sottoscrizione.
+    \"""
+    try:
+        yield STREAM_RETRY
+        while not subscription.closed:
+            events = subscription.get(STREAM_KEEPALIVE)
+            if events:
+                yield b''.join(events)
+            else:
+                broadcaster.refresh()
+                yield KEEPALIVE
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+def get_metrics() -> Tuple[int, Dict[str, str], bytes]:
+    \"""GET /metrics: (status, headers, body) in formato testo Prometheus\"""
+    if not metrics.enabled:
+        return 404, {'Content-Type': 'application/json'}, dump_json(error('Metrics disabled', 404)[0])
+
+    gauges = {}
+    if storage.name == 'sqlite':
+        db = pool.stats()
+        gauges['feedback_db_pool_connections'] = ('gauge', 'Connessioni SQLite aperte nel pool', db['size'])
+        gauges['feedback_db_pool_in_use'] = ('gauge', 'Connessioni SQLite in uso', db['inUse'])
+        gauges['feedback_db_pool_waits_total'] = ('counter', 'Acquisizioni in attesa di una connessione libera', db['waits'])
+        gauges['feedback_db_pool_timeouts_total'] = ('counter', 'Acquisizioni scadute (PoolTimeout)', db['timeouts'])
+    if ingest_queue is not None:
+        gauges['feedback_ingest_queue_depth'] = ('gauge', 'Feedback in coda write-behind', ingest_queue.stats()['depth'])
+    if ingest_log is not None:
+        gauges['feedback_ingest_log_pending_rows'] = ('gauge', 'Righe nel log non ancora in SQLite', ingest_log.stats()['pendingRows'])
+    stream = broadcaster.stats()
+    gauges['feedback_stream_subscribers'] = ('gauge', 'Client SSE connessi', stream['subscribers'])
+    gauges['feedback_stream_dropped_total'] = ('counter', 'Eventi SSE scartati da buffer pieni', stream['dropped'])
+    if log_pipeline.enabled:
+        logs = log_pipeline.stats()
+        gauges['feedback_log_queue_depth'] = ('gauge', 'Record di log in coda per il listener', logs['depth'])
+        gauges['feedback_log_dropped_total'] = ('counter', 'Record di log scartati a coda piena', logs['dropped'])
+        gauges['feedback_log_suppressed_total'] = ('counter', 'Record di log identici soppressi dal rate limit', logs['suppressed'])
+
+    return 200, {'Content-Type': METRICS_CONTENT_TYPE}, metrics.render(gauges)
+
+
+def get_slow_queries(order: str, limit: int, request_headers) -> Result:
+    \"""GET /api/admin/slow-queries: shape di statement SQLite più costose (finestra mobile)\"""
+    if not ADMIN_TOKEN:
+        return error('Admin endpoints disabled', 404)
+    if not is_admin(request_headers):
+        return error('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+    if order not in SLOW_QUERY_ORDERS:
+        return error(f'Invalid order. Must be one of: {", ".join(SLOW_QUERY_ORDERS)}', 400)
+    if not 1 <= limit <= SLOW_QUERY_MAX_LIMIT:
+        return error(f'Invalid limit. Must be between 1 and {SLOW_QUERY_MAX_LIMIT}', 400)
+
+    return {
+        'success': True,
+        'enabled': slow_queries.enabled and storage.name == 'sqlite',
+        'order': order,
+        **slow_queries.stats(),
+        'queries': slow_queries.top(limit, order)
+    }, 200, {'Cache-Control': 'no-store'}
+
+
+def get_traces(limit: int, request_id: Optional[str], request_headers) -> Result:
+    \"""GET /api/admin/traces: ultime tracce del worker come ExportTraceServiceRequest OTLP/JSON\"""
+    if not ADMIN_TOKEN:
+        return error('Admin endpoints disabled', 404)
+    if not is_admin(request_headers):
+        return error('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+    if not tracer.enabled:
+        return error('Tracing disabled', 404)
+    if not 1 <= limit <= TRACE_MAX_LIMIT:
+        return error(f'Invalid limit. Must be between 1 and {TRACE_MAX_LIMIT}', 400)
+
+    # Documento OTLP puro (nessun campo success): importabile così com'è nei viewer
+    return tracer.recent(limit, request_id or None), 200, {'Cache-Control': 'no-store'}
+
+
+def lookup_ids_from_body(data) -> Optional[List]:
+    \"""messageIds dal body JSON di POST /api/feedback/lookup; None se il body non è un oggetto\"""
+    return data.get('messageIds') if isinstance(data, dict) else None
+
+
+def lookup_feedback(message_ids) -> Result:
+    \"""POST|GET /api/feedback/lookup (message_ids None o non lista: 400)\"""
+    if not isinstance(message_ids, list) or not all(isinstance(m, str) and m for m in message_ids):
+        return error('Invalid request. Expected {"messageIds": ["..."]}', 400)
+
+    # Deduplica mantenendo l'ordine
+    message_ids = list(dict.fromkeys(message_ids))
+
+    if len(message_ids) > LOOKUP_MAX_IDS:
+        return error(f'Too many messageIds. Maximum {LOOKUP_MAX_IDS} per request', 413)
+
+    found = storage.get_many(message_ids)
+
+    return {
+        'success': True,
+        'feedbacks': {m: found[m] for m in message_ids if m in found},
+        'missing': [m for m in message_ids if m not in found]
+    }, 200, {}
+
+
+def get_feedback_stats(days: int, session_id: Optional[str], approx_distinct: bool = False,
+                       params: Iterable[Tuple[str, str]] = (),
+                       request_headers=None) -> Tuple[int, Dict[str, str], bytes]:
+    \"""
+    GET /api/feedback/stats: (status, headers, body).
+
+    params: query string (filtri ?meta.<chiave>=). L'ETag combina contatore
+    modifiche, parametri e finestra di STATS_ETAG_WINDOW secondi (le righe
+    escono dalla finestra days anche senza scritture): se il client ha già
+    questa versione risponde 304 senza eseguire le aggregazioni.
+    \"""
+    request_headers = request_headers or {}
+    try:
+        filters = parse_metadata_filters(params)
+    except ValueError as e:
+        return respond(400, dump_json(error(str(e), 400)[0]), request_headers)
+
+    version, changed_at = storage.version()
+    window_ms = STATS_ETAG_WINDOW * 1000
+    window = now_ms() // window_ms
+    query = hashlib.blake2b(dump_json([days, session_id, approx_distinct, sorted(filters.items())]), digest_size=6)
+    etag = f'W/"{version}-{window}-{query.hexdigest()}"'
+    last_modified_ms = max(changed_at, window * window_ms)
+    if not_modified(request_headers, etag, last_modified_ms):
+        return respond(200, b'', request_headers, etag, last_modified_ms)
+
+    start_ms = now_ms() - days * 86400000
+
+    stats = storage.stats(start_ms, session_id, filters)
+    stats['days'] = days
+    if filters:
+        stats['filters'] = filters
+
+    # Sketch giornalieri globali: con sessionId o filtri non si applicano
+    if approx_distinct and not session_id and not filters:
+        stats['approxDistinct'] = storage.distinct(start_ms)
+
+    body = dump_json({
+        'success': True,
+        'stats': stats
+    })
+    return respond(200, body, request_headers, etag, last_modified_ms)
+
+
+def get_feedback_timeseries(interval: str, days: int, session_id: Optional[str]) -> Tuple[int, bytes]:
+    \"""
+    GET /api/feedback/stats/timeseries: (status, body JSON).
+
+    Bucket allineati all'intervallo, dal bucket che contiene (ora - days)
+    a quello corrente incluso; i bucket senza feedback valgono zero. Il
+    bucket corrente fa parte della chiave di cache: allo scoccare dell'ora
+    (o del giorno) la serie viene ricalcolata.
+    \"""
+    if interval not in BUCKET_MS:
+        return 400, dump_json(error(f'Invalid interval. Must be one of: {", ".join(BUCKET_MS)}', 400)[0])
+
+    size = BUCKET_MS[interval]
+    count = days * 86400000 // size
+    if days < 1 or count > TIMESERIES_MAX_BUCKETS:
+        return 400, dump_json(error(f'Invalid days. Must be between 1 and {TIMESERIES_MAX_BUCKETS * size // 86400000}', 400)[0])
+
+    end_bucket = now_ms() // size
+    key = f'{interval}:{days}:{session_id or ""}:{end_bucket}'
+    cached = timeseries_cache.get(key)
+    if cached is not None:
+        return cached
+
+    start_ms = (end_bucket - count) * size
+    counts = storage.buckets(interval, start_ms, session_id)
+
+    series = []
+    for bucket in range(end_bucket - count, end_bucket + 1):
+        total, positive, negative = counts.get(bucket * size, (0, 0, 0))
+        series.append({
+            'start': format_timestamp(bucket * size),
+            'total': total,
+            'positive': positive,
+            'negative': negative
+        })
+
+    body = dump_json({
+        'success': True,
+        'interval': interval,
+        'days': days,
+        'sessionId': session_id,
+        'buckets': series
+    })
+    timeseries_cache.put(key, 200, body)
+    return 200, body
+
+
+def wilson_lower_bound(successes: int, total: int, z: float = TOP_Z) -> float:
+    \"""Limite inferiore dell'intervallo di Wilson: pochi voti -> punteggio prudente\"""
+    if total == 0:
+        return 0.0
+    p = successes / total
+    z2 = z * z
+    centre = p + z2 / (2 * total)
+    margin = z * math.sqrt((p * (1 - p) + z2 / (4 * total)) / total)
+    return (centre - margin) / (1 + z2 / total)
+
+
+# order -> punteggio da (positive, negative); il top-N prende i punteggi più alti
+TOP_ORDERS = {
+    'negative_ratio': lambda positive, negative: wilson_lower_bound(negative, positive + negative),
+    'positive_ratio': lambda positive, negative: wilson_lower_bound(positive, positive + negative),
+    'negative': lambda positive, negative: negative,
+    'total': lambda positive, negative: positive + negative,
+}
+
+
+def get_top_feedback(by: Optional[str], order: str, n: int, days: int, min_votes: int) -> Result:
+    \"""
+    GET /api/feedback/top: valori della chiave metadata by ordinati per order.
+
+    Gli aggregati arrivano dallo storage già raggruppati per valore (più
+    righe per valore da partizioni diverse vengono sommate qui); la
+    selezione usa un heap di dimensione n invece di ordinare tutti i valori.
+    \"""
+    if not by:
+        return error('Missing required parameter: by', 400)
+    if order not in TOP_ORDERS:
+        return error(f'Invalid order. Must be one of: {", ".join(TOP_ORDERS)}', 400)
+    if not 1 <= n <= TOP_MAX_N:
+        return error(f'Invalid n. Must be between 1 and {TOP_MAX_N}', 400)
+    if days < 1 or min_votes < 1:
+        return error('Invalid days or minVotes. Must be positive', 400)
+
+    try:
+        groups = storage.vote_groups(by, now_ms() - days * 86400000)
+    except ValueError as e:
+        return error(str(e), 400)
+
+    totals: Dict = {}
+    for value, positive, negative in groups:
+        counts = totals.setdefault(value, [0, 0])
+        counts[0] += positive
+        counts[1] += negative
+
+    score = TOP_ORDERS[order]
+    candidates = ((value, p, q) for value, (p, q) in totals.items() if p + q >= min_votes)
+    top = heapq.nlargest(n, candidates, key=lambda group: score(group[1], group[2]))
+
+    return {
+        'success': True,
+        'by': by,
+        'order': order,
+        'days': days,
+        'n': n,
+        'groups': len(totals),
+        'items': [{
+            'value': value,
+            'total': positive + negative,
+            'positive': positive,
+            'negative': negative,
+            'negativeRatio': round(negative / (positive + negative), 4),
+            'score': round(score(positive, negative), 4)
+        } for value, positive, negative in top]
+    }, 200, {}
+
+
+def save_feedback_batch(data: Optional[Dict], user_agent: str, ip_address: Optional[str]) -> Result:
+    \"""POST /api/feedback/batch\"""
+    if not isinstance(data, dict) or not isinstance(data.get('feedbacks'), list):
+        return error('Invalid request body. Expected {"feedbacks": [...]}', 400)
+
+    feedbacks = data['feedbacks']
+
+    if len(feedbacks) > BATCH_MAX_ITEMS:
+        return error(f'Batch too large. Maximum {BATCH_MAX_ITEMS} feedbacks per request', 413)
+
+    errors = []
+    rows = []
+    row_indices = []
+    now = now_ms()
+
+    # Validazione completa prima di toccare il database
+    with span('validate'):
+        for idx, feedback in enumerate(feedbacks):
+            if not isinstance(feedback, dict):
+                errors.append({'index': idx, 'error': 'Invalid feedback data'})
+                continue
+
+            # Tipi per elemento: un elemento non valido non deve far fallire il suo blocco
+            invalid = invalid_feedback_field(feedback)
+            if invalid:
+                errors.append({'index': idx, 'error': invalid})
+                continue
+
+            message_id = feedback.get('messageId')
+            feedback_type = feedback.get('feedbackType')
+            ts = encode_timestamp(feedback['timestamp']) if 'timestamp' in feedback else now
+
+            if not message_id or not validate_feedback_type(feedback_type) or ts is None:
+                errors.append({'index': idx, 'error': 'Invalid feedback data'})
+                continue
+
+            rows.append((
+                message_id,
+                feedback_type,
+                feedback.get('sessionId'),
+                ts,
+                user_agent,
+                ip_address,
+                json.dumps(feedback.get('metadata', {}))
+            ))
+            row_indices.append(idx)
+
+    # Append-only log: il batch valido è un solo record, riversato dal compactor
+    if ingest_log is not None:
+        if rows and not ingest_log.append(rows):
+            return error('Feedback log unavailable, retry later', 503, {'Retry-After': '1'})
+
+        return {
+            'success': True,
+            'queued': True,
+            'savedCount': len(rows),
+            'totalCount': len(feedbacks),
+            'errors': errors
+        }, 202, {}
+
+    # Scrittura set-based: un commit per blocco, il lock non resta occupato
+    chunks = write_chunks(rows, BATCH_CHUNK_SIZE)
+
+    saved_count = 0
+    for chunk in chunks:
+        if 'error' in chunk:
+            for idx in row_indices[chunk['offset']:chunk['offset'] + chunk['size']]:
+                errors.append({'index': idx, 'error': 'Database error'})
+        else:
+            saved_count += chunk['size']
+
+    errors.sort(key=lambda e: e['index'])
+
+    return {
+        'success': True,
+        'savedCount': saved_count,
+        'totalCount': len(feedbacks),
+        'errors': errors,
+        'chunkSize': BATCH_CHUNK_SIZE,
+        'chunks': chunks
+    }, 200, {}
+
+
+def export_feedback(fmt: str, since: Optional[str], until: Optional[str], session_id: Optional[str],
+                    accept_encoding: str, params: Iterable[Tuple[str, str]] = ()) -> Tuple[int, Dict[str, str], Iterable[bytes]]:
+    \"""
+    GET /api/feedback/export: (status, headers, chunk del body).
+
+    Il body è un generatore: nessuna query finché il server non inizia a
+    leggerlo, poi una pagina keyset alla volta (storage.iterate), serializzata
+    e compressa al volo con la codifica scelta da choose_encoding.
+    \"""
+    if fmt not in EXPORT_FORMATS:
+        return json_error(f'Invalid format. Must be one of: {", ".join(EXPORT_FORMATS)}', 400)
+
+    start_ms = encode_timestamp(since) if since else None
+    end_ms = encode_timestamp(until) if until else None
+    if (since and start_ms is None) or (until and end_ms is None):
+        return json_error('Invalid from/to. Must be ISO 8601', 400)
+
+    # Validati prima di rispondere: il body viene letto dopo l'invio degli header
+    try:
+        filters = parse_metadata_filters(params)
+    except ValueError as e:
+        return json_error(str(e), 400)
+
+    content_type, extension = EXPORT_FORMATS[fmt]
+    headers = {
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename="feedback-export.{extension}"',
+        'Cache-Control': 'no-store',
+        'Vary': 'Accept-Encoding',
+    }
+
+    body = export_chunks(fmt, start_ms, end_ms, session_id, filters)
+    encoding = choose_encoding(accept_encoding)
+    if encoding == 'br':
+        body = brotli_chunks(body)
+    elif encoding == 'gzip':
+        body = gzip_chunks(body, COMPRESS_GZIP_LEVEL)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return 200, headers, body
+
+
+def json_error(message: str, status: int) -> Tuple[int, Dict[str, str], Iterable[bytes]]:
+    \"""error() per route in streaming\"""
+    payload, status, _ = error(message, status)
+    return status, {'Content-Type': 'application/json'}, [dump_json(payload)]
+
+
+def export_chunks(fmt: str, start_ms: Optional[int], end_ms: Optional[int],
+                  session_id: Optional[str], filters: Optional[Dict[str, str]] = None) -> Iterator[bytes]:
+    \"""Un chunk per pagina: in memoria al più EXPORT_PAGE_SIZE righe\"""
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(buffer, lineterminator='\\n')
+        writer.writerow(EXPORT_CSV_FIELDS)
+
+    count = 0
+    try:
+        for (_, row_id), feedback in storage.iterate(start_ms, end_ms, session_id,
+                                                     page_size=EXPORT_PAGE_SIZE, filters=filters):
+            if writer is not None:
+                writer.writerow([
+                    row_id, feedback['messageId'], feedback['feedbackType'], feedback['sessionId'] or '',
+                    feedback['timestamp'], json.dumps(feedback['metadata'], separators=(',', ':'))
+                ])
+            else:
+                buffer.write(json.dumps({'id': row_id, **feedback}, separators=(',', ':')))
+                buffer.write('\\n')
+
+            count += 1
+            if count % EXPORT_PAGE_SIZE == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    except Exception as e:
+        # Header già inviati: il client vede una risposta troncata
+        logger.error(f'Export interrupted after {count} rows: {str(e)}')
+        raise
+
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    \"""Comprime uno stream di chunk in formato gzip\"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    \"""Comprime uno stream di chunk in formato br (solo se brotli è installato)\"""
+    compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+    for chunk in chunks:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def health() -> Dict:
+    \"""GET /api/health\"""
+    ingest = ingest_queue or ingest_log
+    return {
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'storage': storage.name,
+        **storage.health(),
+        'ingest': ingest.stats() if ingest else {'mode': INGEST_MODE},
+        'cache': response_cache.stats(),
+        'timeseriesCache': timeseries_cache.stats(),
+        'stream': broadcaster.stats(),
+        'profiler': profiler.stats(),
+        'tracing': tracer.stats(),
+        'logging': log_pipeline.stats()
+    }
+"""
+
+
+# ============================================================================
+# DATABASE LAYER: feedback_db.py (SQLite connection pool)
+# ============================================================================
+
+FEEDBACK_DB_LAYER = """
+\"""
+Connection layer SQLite per feedback API
+Pool di connessioni per worker, WAL mode e PRAGMA da profilo prestazioni
+\"""
+
+import heapq
+import ipaddress
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from queue import LifoQueue, Empty
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from feedback_sketch import HyperLogLog, SKETCH_PRECISION
+
+# Database configuration
+DB_PATH = os.getenv('FEEDBACK_DB_PATH', 'feedback.db')
+DB_PROFILE = os.getenv('FEEDBACK_DB_PROFILE', 'balanced')
+POOL_SIZE = int(os.getenv('FEEDBACK_DB_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.getenv('FEEDBACK_DB_POOL_TIMEOUT', 5))
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# PERFORMANCE PROFILES
+# ============================================================================
+
+# PRAGMA applicati a ogni nuova connessione.
+# cache_size negativo = KiB, mmap_size in byte, busy_timeout in ms.
+PERFORMANCE_PROFILES: Dict[str, Dict] = {
+    # Massima durabilità: fsync a ogni commit
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'busy_timeout': 5000,
+    },
+    # Default: con WAL, NORMAL esegue fsync solo ai checkpoint
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -32000,
+        'mmap_size': 128 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+    # Picchi di traffico: cache e mmap più grandi, attesa lock più lunga
+    'throughput': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -128000,
+        'mmap_size': 512 * 1024 * 1024,
+        'busy_timeout': 15000,
+    },
+    # Comportamento precedente (rollback journal), utile per confronti
+    'legacy': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'busy_timeout': 5000,
+    },
+}
+
+
+def get_profile(name: str) -> Dict:
+    \"""Restituisce profilo prestazioni per nome\"""
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(
+            f'Unknown performance profile "{name}". '
+            f'Available: {", ".join(sorted(PERFORMANCE_PROFILES))}'
+        )
+    return PERFORMANCE_PROFILES[name]
+
+
+def apply_pragmas(conn: sqlite3.Connection, profile: Dict) -> None:
+    \"""Applica i PRAGMA del profilo a una connessione\"""
+    conn.execute(f"PRAGMA journal_mode = {profile['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+
+
+# ============================================================================
+# STATEMENT OBSERVERS
+# ============================================================================
+
+# Callback (conn, operazione, sql, parametri, secondi) chiamati dopo ogni
+# execute, executemany e commit delle connessioni del pool (metriche, ...).
+# Tupla sostituita a ogni registrazione: letta senza lock a ogni statement.
+_observers: Tuple[Callable, ...] = ()
+
+
+def add_statement_observer(observer: Callable[[sqlite3.Connection, str, str, object, float], None]) -> None:
+    \"""Registra un observer (idempotente)\"""
+    global _observers
+    if observer not in _observers:
+        _observers += (observer,)
+
+
+def _notify(conn: sqlite3.Connection, operation: str, sql: str, parameters, seconds: float) -> None:
+    for observer in _observers:
+        try:
+            observer(conn, operation, sql, parameters, seconds)
+        except Exception as e:
+            # Un observer non deve mai far fallire lo statement
+            logger.warning(f'Statement observer failed: {str(e)}')
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    \"""
+    Connessione del pool che cronometra execute/executemany/commit.
+
+    Senza observer registrati il costo è un controllo sulla tupla. Per una
+    SELECT execute misura fino alla prima riga (le aggregazioni del modulo
+    sono quindi misurate per intero), non il fetch delle successive.
+    \"""
+
+    def execute(self, sql, parameters=()):
+        if not _observers:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify(self, 'execute', sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not _observers:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify(self, 'executemany', sql, seq_of_parameters, time.perf_counter() - start)
+
+    def commit(self):
+        if not _observers:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _notify(self, 'commit', 'COMMIT', (), time.perf_counter() - start)
+
+
+# ============================================================================
+# SLOW QUERY LOG
+# ============================================================================
+
+# Shape di uno statement: spazi compattati, partizioni mensili unificate
+# (feedback_p202601 -> feedback_p*) e liste IN di placeholder ridotte, così
+# le query per partizione e le IN (?, ?, ...) di lunghezza diversa si sommano
+_WHITESPACE = re.compile(r'\\s+')
+_PARTITION_NAME = re.compile(r'feedback_p\\d{6}')
+_IN_LIST = re.compile(r'\\bIN \\(\\?(?:\\s*,\\s*\\?)*\\)', re.IGNORECASE)
+
+# Statement per cui EXPLAIN QUERY PLAN ha senso (non BEGIN, PRAGMA, DDL)
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+SLOW_QUERY_ORDERS = ('total', 'max', 'avg', 'count')
+
+
+def statement_shape(sql: str) -> str:
+    shape = _WHITESPACE.sub(' ', sql).strip()
+    shape = _PARTITION_NAME.sub('feedback_p*', shape)
+    return _IN_LIST.sub('IN (...)', shape)
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, parameters) -> Optional[List[str]]:
+    \"""Righe di EXPLAIN QUERY PLAN (colonna detail); None se lo statement non è spiegabile\"""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    try:
+        # execute della classe base: l'EXPLAIN non passa dagli observer
+        rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f'unavailable: {str(e)}']
+    return [row[3] for row in rows]
+
+
+class SlowQueryLog:
+    \"""
+    Tempo per shape di statement su una finestra mobile + log degli statement lenti.
+
+    Ogni statement aggiorna count/totale/massimo della sua shape; quelli da
+    threshold_ms in su vengono loggati con l'EXPLAIN QUERY PLAN, calcolato
+    una volta per shape e finestra. Due finestre (corrente e precedente)
+    coprono gli ultimi window..2*window secondi senza tenere i singoli
+    statement; oltre max_shapes le shape nuove non vengono tracciate.
+    \"""
+
+    def __init__(self, threshold_ms: float = 100.0, window: float = 300.0,
+                 max_shapes: int = 500, enabled: bool = True):
+        self.threshold_ms = threshold_ms
+        self.window = window
+        self.max_shapes = max_shapes
+        self.enabled = enabled
+        self._threshold = threshold_ms / 1000
+        # sql -> shape: la normalizzazione con regex avviene una volta per testo SQL
+        self._shapes: Dict[str, str] = {}
+        # shape -> [count, secondi totali, secondi massimi, lenti, piano]
+        self._current: Dict[str, List] = {}
+        self._previous: Dict[str, List] = {}
+        self._rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._slow = 0
+        self._untracked = 0
+
+    @classmethod
+    def from_env(cls) -> 'SlowQueryLog':
+        \"""Crea log da variabili d'ambiente FEEDBACK_SLOW_QUERY_*\"""
+        return cls(
+            threshold_ms=float(os.getenv('FEEDBACK_SLOW_QUERY_MS', 100)),
+            window=float(os.getenv('FEEDBACK_SLOW_QUERY_WINDOW', 300)),
+            max_shapes=int(os.getenv('FEEDBACK_SLOW_QUERY_MAX_SHAPES', 500)),
+            enabled=os.getenv('FEEDBACK_SLOW_QUERY_LOG', 'true').lower() == 'true',
+        )
+
+    def observe(self, conn: sqlite3.Connection, operation: str, sql: str, parameters, seconds: float) -> None:
+        \"""Observer per add_statement_observer\"""
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = statement_shape(sql)
+            if len(self._shapes) < 4 * self.max_shapes:
+                self._shapes[sql] = shape
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._rotated_at >= self.window:
+                self._previous, self._current = self._current, {}
+                self._rotated_at = now
+
+            entry = self._current.get(shape)
+            if entry is None:
+                if len(self._current) >= self.max_shapes:
+                    self._untracked += 1
+                    return
+                entry = self._current[shape] = [0, 0.0, 0.0, 0, None]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if seconds < self._threshold:
+                return
+            entry[3] += 1
+            self._slow += 1
+            plan = entry[4]
+
+        if plan is None and operation != 'commit':
+            if operation == 'executemany':
+                # Piano della prima riga (le altre usano lo stesso statement)
+                parameters = parameters[0] if isinstance(parameters, (list, tuple)) and parameters else ()
+            plan = explain_query_plan(conn, sql, parameters) or []
+            entry[4] = plan
+
+        logger.warning(
+            f'Slow query: {seconds * 1000:.1f} ms ({operation}) {shape}'
+            + (f' | plan: {"; ".join(plan)}' if plan else '')
+        )
+
+    def top(self, limit: int = 20, order: str = 'total') -> List[Dict]:
+        \"""Shape più costose delle ultime due finestre per order ('total', 'max', 'avg', 'count')\"""
+        with self._lock:
+            merged: Dict[str, List] = {shape: list(entry) for shape, entry in self._previous.items()}
+            for shape, entry in self._current.items():
+                if shape in merged:
+                    previous = merged[shape]
+                    merged[shape] = [previous[0] + entry[0], previous[1] + entry[1],
+                                     max(previous[2], entry[2]), previous[3] + entry[3], entry[4] or previous[4]]
+                else:
+                    merged[shape] = list(entry)
+
+        sort_keys = {
+            'total': lambda e: e[1],
+            'max': lambda e: e[2],
+            'avg': lambda e: e[1] / e[0],
+            'count': lambda e: e[0],
+        }
+        ranked = heapq.nlargest(limit, merged.items(), key=lambda item: sort_keys[order](item[1]))
+        return [{
+            'shape': shape,
+            'count': count,
+            'totalMs': round(total * 1000, 3),
+            'avgMs': round(total / count * 1000, 3),
+            'maxMs': round(longest * 1000, 3),
+            'slowCount': slow,
+            'plan': plan,
+        } for shape, (count, total, longest, slow, plan) in ranked]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'thresholdMs': self.threshold_ms,
+                'windowSeconds': self.window,
+                'shapes': len(self._current),
+                'slow': self._slow,
+                'untracked': self._untracked,
+            }
+
+
+slow_queries = SlowQueryLog.from_env()
+
+
+# ============================================================================
+# CONNECTION POOL
+# ============================================================================
+
+class PoolTimeout(Exception):
+    \"""Nessuna connessione disponibile entro il timeout\"""
+
+
+class ConnectionPool:
+    \"""
+    Pool di connessioni SQLite per processo worker.
+
+    Le connessioni vengono create on-demand fino a max_size e riutilizzate
+    (LIFO, così le connessioni calde restano in uso). Dopo un fork il pool
+    si azzera: le connessioni del processo padre non vengono mai condivise.
+    \"""
+
+    def __init__(self, db_path: str, profile: str = 'balanced',
+                 max_size: int = 8, timeout: float = 5.0):
+        self.db_path = db_path
+        self.profile_name = profile
+        self.profile = get_profile(profile)
+        self.max_size = max_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle: LifoQueue = LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._errors = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.profile['busy_timeout'] / 1000,
+            check_same_thread=False,
+            factory=InstrumentedConnection,
+        )
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.profile)
+        # Necessario perché INSERT OR REPLACE attivi i trigger DELETE dei rollup
+        conn.execute('PRAGMA recursive_triggers = ON')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        \"""Ottieni connessione dal pool (crea o attende se necessario)\"""
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+
+        conn: Optional[sqlite3.Connection] = None
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            create = False
+            with self._lock:
+                if self._created < self.max_size:
+                    self._created += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                start = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(
+                        f'No database connection available after {self.timeout}s'
+                    )
+                finally:
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_time += time.perf_counter() - start
+
+        with self._lock:
+            self._acquired += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        \"""Restituisci connessione al pool\"""
+        with self._lock:
+            self._in_use -= 1
+
+        if not broken:
+            try:
+                # Transazioni lasciate aperte non devono passare al prossimo utilizzo
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                broken = True
+
+        if broken:
+            with self._lock:
+                self._created -= 1
+                self._errors += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        \"""Context manager: acquisisce e rilascia automaticamente\"""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError as e:
+            # Errori di lock/busy non invalidano la connessione
+            broken = not isinstance(e, sqlite3.OperationalError)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close_all(self) -> None:
+        \"""Chiudi tutte le connessioni inattive\"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> Dict:
+        \"""Statistiche pool per dimensionamento\"""
+        with self._lock:
+            return {
+                'profile': self.profile_name,
+                'journalMode': self.profile['journal_mode'],
+                'maxSize': self.max_size,
+                'size': self._created,
+                'inUse': self._in_use,
+                'idle': self._idle.qsize(),
+                'peakInUse': self._peak_in_use,
+                'acquired': self._acquired,
+                'waits': self._waits,
+                'avgWaitMs': round(self._wait_time / self._waits * 1000, 3) if self._waits else 0.0,
+                'timeouts': self._timeouts,
+                'discarded': self._errors,
+            }
+
+
+pool = ConnectionPool(DB_PATH, DB_PROFILE, POOL_SIZE, POOL_TIMEOUT)
+
+
+def get_db_connection():
+    \"""Ottieni connessione dal pool (usare con `with`)\"""
+    return pool.connection()
+
+
+FEEDBACK_COLUMNS = 'message_id, vote, session_id, ts, metadata'
+
+# Ordine colonne nelle partizioni (layout compatto, schema v2)
+PARTITION_COLUMNS = 'id, message_id, vote, session_id, ts, user_agent_id, ip, metadata'
+
+# Mesi da conservare con expire_partitions (0 = nessuna scadenza)
+RETENTION_MONTHS = int(os.getenv('FEEDBACK_RETENTION_MONTHS', 0))
+
+# Chiave metadata: segmenti alfanumerici separati da punti ('prompt', 'context.model')
+METADATA_KEY_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}(\\.[A-Za-z0-9_-]{1,64}){0,7}')
+
+
+def metadata_path(key: str) -> str:
+    \"""Chiave metadata -> path JSON1 ('$.prompt'); ValueError se non valida\"""
+    if not isinstance(key, str) or not METADATA_KEY_PATTERN.fullmatch(key):
+        raise ValueError(f'Invalid metadata key "{key}"')
+    return '$.' + key
+
+
+def parse_metadata_keys(raw: str) -> List[str]:
+    \"""Lista di chiavi metadata separate da virgola (configurazione)\"""
+    keys = list(dict.fromkeys(k.strip() for k in raw.split(',') if k.strip()))
+    for key in keys:
+        metadata_path(key)
+    return keys
+
+
+# Chiavi metadata con voti per valore materializzati (top-N), mantenuti da trigger
+TOP_KEYS = parse_metadata_keys(os.getenv('FEEDBACK_TOP_KEYS', ''))
+
+# Chiavi metadata filtrabili in stats ed export: colonna generata + indice per partizione
+INDEXED_KEYS = parse_metadata_keys(os.getenv('FEEDBACK_INDEXED_KEYS', ''))
+
+
+def metadata_column(key: str) -> str:
+    \"""Colonna generata di una chiave metadata (identificatore quotato, es. "meta.prompt")\"""
+    metadata_path(key)
+    return f'"meta.{key}"'
+
+
+# ============================================================================
+# COMPACT ENCODING
+# ============================================================================
+
+# timestamp -> millisecondi epoch UTC (INTEGER, 6 byte invece di ~26 di testo),
+# feedback_type -> codice voto 1/2 (1 byte nel record), user agent -> id nel
+# dizionario feedback_user_agents, IP -> 4/16 byte. L'API continua a esporre
+# stringhe: la conversione avviene solo ai bordi (upsert_rows, serialize_feedback).
+
+VOTE_CODES = {'positive': 1, 'negative': 2}
+VOTE_NAMES = {code: name for name, code in VOTE_CODES.items()}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_timestamp(value) -> Optional[int]:
+    \"""ISO 8601 -> millisecondi epoch UTC (senza fuso = UTC); None se non valido\"""
+    if not isinstance(value, str):
+        return None
+    text = value.strip()
+    if text[-1:] in ('Z', 'z'):
+        text = text[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return (parsed - EPOCH) // timedelta(milliseconds=1)
+
+
+def format_timestamp(ts: int) -> str:
+    \"""Millisecondi epoch -> ISO 8601 UTC, stesso formato di Date.toISOString()\"""
+    return (EPOCH + timedelta(milliseconds=ts)).isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def now_ms() -> int:
+    return (datetime.now(timezone.utc) - EPOCH) // timedelta(milliseconds=1)
+
+
+def encode_ip(value: Optional[str]) -> Optional[bytes]:
+    \"""IP testuale -> 4 (IPv4) o 16 (IPv6) byte; None se assente o non valido\"""
+    if not value:
+        return None
+    try:
+        return ipaddress.ip_address(value.strip()).packed
+    except ValueError:
+        return None
+
+
+def decode_ip(value: Optional[bytes]) -> Optional[str]:
+    return str(ipaddress.ip_address(value)) if value else None
+
+
+def user_agent_ids(conn: sqlite3.Connection, user_agents: List[Optional[str]]) -> Dict[str, int]:
+    \"""
+    Id dizionario dei user agent, inseriti se nuovi nella transazione corrente.
+
+    Nessuna cache in processo: un id visto in una transazione poi annullata
+    potrebbe essere riassegnato a un altro user agent.
+    \"""
+    distinct = list({ua for ua in user_agents if ua})
+    if not distinct:
+        return {}
+
+    conn.executemany(
+        'INSERT OR IGNORE INTO feedback_user_agents (user_agent) VALUES (?)',
+        [(ua,) for ua in distinct]
+    )
+    ids = {}
+    for offset in range(0, len(distinct), 500):
+        chunk = distinct[offset:offset + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor = conn.execute(
+            f'SELECT id, user_agent FROM feedback_user_agents WHERE user_agent IN ({placeholders})',
+            chunk
+        )
+        for row in cursor:
+            ids[row[1]] = row[0]
+    return ids
+
+
+# ============================================================================
+# MONTHLY PARTITIONS
+# ============================================================================
+
+# Una tabella per mese (feedback_pYYYYMM), scelta dal mese del timestamp.
+# Ogni partizione ha indici e trigger rollup propri: la retention elimina un
+# mese intero con DROP TABLE invece di un DELETE riga per riga. La view
+# `feedback` (UNION ALL delle partizioni) resta disponibile per query ad hoc.
+
+def current_month() -> str:
+    return datetime.utcnow().strftime('%Y-%m')
+
+
+def partition_month(ts: int) -> str:
+    \"""Mese 'YYYY-MM' (UTC) di un timestamp in millisecondi epoch\"""
+    return format_timestamp(ts)[:7]
+
+
+def shift_month(month: str, delta: int) -> str:
+    \"""Mese 'YYYY-MM' spostato di delta mesi\"""
+    index = int(month[:4]) * 12 + int(month[5:7]) - 1 + delta
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def partition_table(month: str) -> str:
+    return 'feedback_p' + month.replace('-', '')
+
+
+def partition_table_ddl(table: str) -> str:
+    \"""CREATE TABLE di una partizione (layout compatto + colonne generate di INDEXED_KEYS)\"""
+    generated = ''.join(f'\\n            {metadata_column_ddl(key)},' for key in INDEXED_KEYS)
+    return f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            message_id TEXT NOT NULL,
+            vote INTEGER NOT NULL CHECK (vote IN (1, 2)),
+            session_id TEXT,
+            ts INTEGER NOT NULL,
+            user_agent_id INTEGER,
+            ip BLOB,
+            metadata TEXT,
+            created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),{generated}
+            UNIQUE(message_id)
+        )
+    '''
+
+
+def partition_schema(table: str) -> List[str]:
+    \"""Tabella, indici e trigger rollup di una partizione\"""
+    return [
+        partition_table_ddl(table),
+        f'CREATE INDEX IF NOT EXISTS idx_{table}_ts ON {table}(ts)',
+        f'CREATE INDEX IF NOT EXISTS idx_{table}_session_id ON {table}(session_id)',
+        *(metadata_index_ddl(table, key) for key in INDEXED_KEYS),
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            {''.join(_rollup_delta('+', 'NEW'))}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            {''.join(_rollup_delta('-', 'OLD'))}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_update
+        AFTER UPDATE OF vote, session_id, ts ON {table}
+        BEGIN
+            {''.join(_rollup_delta('-', 'OLD'))}
+            {''.join(_rollup_delta('+', 'NEW'))}
+        END
+        ''',
+    ] + top_triggers(table, TOP_KEYS)
+
+
+# Registro partizioni, sequenza id e dizionario user agent (non partizionati)
+SHARED_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_partitions (
+        month TEXT PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''',
+    # Sequenza globale: gli id restano univoci tra le partizioni
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_sequence (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    "INSERT OR IGNORE INTO feedback_sequence (name, value) VALUES ('feedback', 0)",
+    # Contatore modifiche e ms dell'ultima modifica: validatori HTTP (ETag/Last-Modified)
+    "INSERT OR IGNORE INTO feedback_sequence (name, value) VALUES ('changes', 0), ('changed_at', 0)",
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_user_agents (
+        id INTEGER PRIMARY KEY,
+        user_agent TEXT NOT NULL UNIQUE
+    )
+    ''',
+    # Mese della partizione di ogni message_id: un voto ripetuto in un altro
+    # mese viene cancellato solo dalla sua partizione, non da tutte
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_locations (
+        message_id TEXT PRIMARY KEY,
+        month TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_feedback_locations_month ON feedback_locations(month)',
+]
+
+
+def refresh_feedback_view(conn: sqlite3.Connection) -> None:
+    \"""Ricrea la view `feedback`: UNION ALL delle partizioni con colonne decodificate\"""
+    tables = [row[0] for row in conn.execute('SELECT table_name FROM feedback_partitions ORDER BY month')]
+    conn.execute('DROP VIEW IF EXISTS feedback')
+    if not tables:
+        return
+
+    branches = [
+        f'''
+        SELECT p.id, p.message_id,
+               CASE p.vote WHEN 1 THEN 'positive' WHEN 2 THEN 'negative' END AS feedback_type,
+               p.session_id,
+               strftime('%Y-%m-%dT%H:%M:%fZ', p.ts / 1000.0, 'unixepoch') AS timestamp,
+               u.user_agent, p.ip, p.metadata, p.created_at
+        FROM {table} p LEFT JOIN feedback_user_agents u ON u.id = p.user_agent_id
+        '''
+        for table in tables
+    ]
+    conn.execute('CREATE VIEW feedback AS ' + ' UNION ALL '.join(branches))
+
+
+class PartitionRouter:
+    \"""
+    Instrada letture e scritture verso le partizioni mensili.
+
+    L'elenco dei mesi è in cache per processo e viene ricaricato dal registro
+    feedback_partitions solo quando cambia PRAGMA schema_version, cioè quando
+    questo o un altro worker crea o elimina una partizione.
+    \"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._months: List[str] = []
+        self._schema_version: Optional[int] = None
+
+    def months(self, conn: sqlite3.Connection) -> List[str]:
+        \"""Mesi con partizione, dal più vecchio al più recente\"""
+        version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        with self._lock:
+            if version == self._schema_version:
+                return self._months
+
+        months = [row[0] for row in conn.execute('SELECT month FROM feedback_partitions ORDER BY month')]
+        with self._lock:
+            self._months = months
+            self._schema_version = version
+        return months
+
+    def tables(self, conn: sqlite3.Connection, start_month: Optional[str] = None) -> List[str]:
+        \"""Partizioni da start_month in poi, dalla più recente (i lookup trovano prima i dati nuovi)\"""
+        return [
+            partition_table(month) for month in reversed(self.months(conn))
+            if start_month is None or month >= start_month
+        ]
+
+    def ensure(self, conn: sqlite3.Connection, month: str) -> str:
+        \"""Tabella del mese, creata nella transazione corrente se non esiste\"""
+        table = partition_table(month)
+        if month in self.months(conn):
+            return table
+
+        for statement in partition_schema(table):
+            conn.execute(statement)
+        conn.execute(
+            'INSERT OR IGNORE INTO feedback_partitions (month, table_name) VALUES (?, ?)',
+            (month, table)
+        )
+        refresh_feedback_view(conn)
+        # Se la transazione viene annullata la cache non deve ricordare il mese
+        self.invalidate()
+        return table
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._schema_version = None
+
+
+router = PartitionRouter()
+
+
+def allocate_ids(conn: sqlite3.Connection, count: int) -> int:
+    \"""Riserva count id consecutivi (nella transazione di scrittura) e ritorna il primo\"""
+    conn.execute("UPDATE feedback_sequence SET value = value + ? WHERE name = 'feedback'", (count,))
+    last = conn.execute("SELECT value FROM feedback_sequence WHERE name = 'feedback'").fetchone()[0]
+    return last - count + 1
+
+
+def record_change(conn: sqlite3.Connection) -> None:
+    \"""Avanza il contatore modifiche, nella transazione di scrittura corrente\"""
+    conn.execute(
+        "UPDATE feedback_sequence SET value = CASE name WHEN 'changes' THEN value + 1 ELSE ? END "
+        "WHERE name IN ('changes', 'changed_at')",
+        (now_ms(),)
+    )
+
+
+def change_version() -> Tuple[int, int]:
+    \"""
+    (contatore modifiche, ms epoch dell'ultima modifica).
+
+    Una lettura di due righe: le route la confrontano con l'ETag del client
+    prima di calcolare la risposta. Condiviso tra worker e processi.
+    \"""
+    with get_db_connection() as conn:
+        values = dict(conn.execute(
+            "SELECT name, value FROM feedback_sequence WHERE name IN ('changes', 'changed_at')"
+        ).fetchall())
+    return values.get('changes', 0), values.get('changed_at', 0)
+
+
+def message_months(conn: sqlite3.Connection, message_ids: List[str], chunk_size: int = 500) -> Dict[str, str]:
+    \"""Mese della partizione che contiene ciascun message_id già scritto\"""
+    months: Dict[str, str] = {}
+    for offset in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[offset:offset + chunk_size]
+        placeholders = ', '.join('?' * len(chunk))
+        for row in conn.execute(
+            f'SELECT message_id, month FROM feedback_locations WHERE message_id IN ({placeholders})',
+            chunk
+        ):
+            months[row[0]] = row[1]
+    return months
+
+
+def upsert_rows(conn: sqlite3.Connection, rows: List[Tuple]) -> List[int]:
+    \"""
+    Scrive righe nella partizione del loro mese, senza commit.
+
+    Ordine colonne: message_id, feedback_type, session_id, ts (millisecondi
+    epoch), user_agent, ip_address, metadata; la codifica compatta avviene
+    qui. Per message_id ripetuti vale l'ultima
+    riga; la versione precedente in un altro mese (voto ripetuto) viene
+    cancellata dalla sola partizione indicata da feedback_locations, e i
+    trigger DELETE correggono i rollup.
+    Ritorna gli id assegnati, nell'ordine delle righe deduplicate.
+    \"""
+    latest: Dict[str, Tuple] = {}
+    for row in rows:
+        latest.pop(row[0], None)
+        latest[row[0]] = row
+    if not latest:
+        return []
+
+    first_id = allocate_ids(conn, len(latest))
+    ua_ids = user_agent_ids(conn, [row[4] for row in latest.values()])
+    by_table: Dict[str, List[Tuple]] = {}
+    months: Dict[str, str] = {}
+    for offset, row in enumerate(latest.values()):
+        message_id, feedback_type, session_id, ts, user_agent, ip_address, metadata = row
+        months[message_id] = partition_month(ts)
+        table = router.ensure(conn, months[message_id])
+        by_table.setdefault(table, []).append((
+            first_id + offset, message_id, VOTE_CODES[feedback_type], session_id, ts,
+            ua_ids.get(user_agent), encode_ip(ip_address), metadata
+        ))
+
+    existing = set(router.months(conn))
+    moved: Dict[str, List[Tuple]] = {}
+    for message_id, month in message_months(conn, list(latest)).items():
+        if month != months[message_id] and month in existing:
+            moved.setdefault(partition_table(month), []).append((message_id,))
+    for table, message_ids in moved.items():
+        conn.executemany(f'DELETE FROM {table} WHERE message_id = ?', message_ids)
+
+    for table, table_rows in by_table.items():
+        conn.executemany(
+            f'INSERT OR REPLACE INTO {table} ({PARTITION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            table_rows
+        )
+    conn.executemany(
+        'INSERT OR REPLACE INTO feedback_locations (message_id, month) VALUES (?, ?)',
+        months.items()
+    )
+
+    update_sketches(conn, [(row[3], row[2], row[0]) for row in latest.values()])
+    record_change(conn)
+
+    return list(range(first_id, first_id + len(latest)))
+
+
+def drop_partitions(before_month: str) -> List[str]:
+    \"""
+    Elimina le partizioni dei mesi precedenti a before_month.
+
+    DROP TABLE libera le pagine senza eseguire trigger per riga; i rollup
+    dei mesi eliminati vengono rimossi per giorno.
+    \"""
+    with get_db_connection() as conn:
+        if not [month for month in router.months(conn) if month < before_month]:
+            return []
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            dropped = [month for month in router.months(conn) if month < before_month]
+            for month in dropped:
+                next_month = shift_month(month, 1)
+                conn.execute(f'DROP TABLE IF EXISTS {partition_table(month)}')
+                conn.execute('DELETE FROM feedback_partitions WHERE month = ?', (month,))
+                conn.execute('DELETE FROM feedback_locations WHERE month = ?', (month,))
+                conn.execute('DELETE FROM feedback_daily WHERE day >= ? AND day < ?', (month, next_month))
+                conn.execute('DELETE FROM feedback_session_daily WHERE day >= ? AND day < ?', (month, next_month))
+                conn.execute('DELETE FROM feedback_sketches WHERE day >= ? AND day < ?', (month, next_month))
+                conn.execute('DELETE FROM feedback_top_daily WHERE day >= ? AND day < ?', (month, next_month))
+            refresh_feedback_view(conn)
+            record_change(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            router.invalidate()
+
+    return dropped
+
+
+def expire_partitions(keep_months: int = RETENTION_MONTHS) -> List[str]:
+    \"""Retention: conserva il mese corrente e i keep_months - 1 precedenti\"""
+    if keep_months <= 0:
+        return []
+    return drop_partitions(shift_month(current_month(), -(keep_months - 1)))
+
+
+def partition_months() -> List[str]:
+    \"""Mesi con partizione (per health e CLI)\"""
+    with get_db_connection() as conn:
+        return list(router.months(conn))
+
+
+# ============================================================================
+# READ / WRITE HELPERS
+# ============================================================================
+
+def fetch_feedback(message_id: str) -> Optional[sqlite3.Row]:
+    \"""Leggi feedback per message_id, dalla partizione più recente\"""
+    with get_db_connection() as conn:
+        for table in router.tables(conn):
+            row = conn.execute(
+                f'SELECT {FEEDBACK_COLUMNS} FROM {table} WHERE message_id = ?',
+                (message_id,)
+            ).fetchone()
+            if row:
+                return row
+    return None
+
+
+def fetch_feedback_many(message_ids: List[str], chunk_size: int = 500) -> Dict[str, sqlite3.Row]:
+    \"""
+    Leggi più feedback con query IN a blocchi (sotto il limite di parametri SQLite).
+
+    Le partizioni vengono visitate dalla più recente; ci si ferma quando
+    tutti gli id sono stati trovati.
+    \"""
+    rows = {}
+    remaining = list(message_ids)
+    with get_db_connection() as conn:
+        for table in router.tables(conn):
+            for offset in range(0, len(remaining), chunk_size):
+                chunk = remaining[offset:offset + chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(
+                    f'SELECT {FEEDBACK_COLUMNS} FROM {table} WHERE message_id IN ({placeholders})',
+                    chunk
+                )
+                for row in cursor:
+                    rows[row['message_id']] = row
+            remaining = [message_id for message_id in remaining if message_id not in rows]
+            if not remaining:
+                break
+    return rows
+
+
+def serialize_feedback(row: sqlite3.Row) -> Dict:
+    \"""Converte riga database nel formato JSON dell'API\"""
+    return {
+        'messageId': row['message_id'],
+        'feedbackType': VOTE_NAMES[row['vote']],
+        'sessionId': row['session_id'],
+        'timestamp': format_timestamp(row['ts']),
+        'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+    }
+
+
+def iter_feedback(start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                  session_id: Optional[str] = None, after: Optional[Tuple[int, int]] = None,
+                  page_size: int = 500, filters: Optional[Dict[str, str]] = None) -> Iterator[sqlite3.Row]:
+    \"""
+    Righe in ordine (ts, id) con paginazione keyset, una pagina alla volta.
+
+    Ogni pagina usa una connessione presa e subito restituita al pool: il
+    consumatore può essere lento senza tenere aperta una transazione di
+    lettura. Le partizioni sono mensili per ts, quindi visitarle in ordine
+    di mese mantiene l'ordinamento globale. after = (ts, id) esclusivo.
+    filters = {chiave indicizzata: valore} (ValueError se non indicizzata).
+    \"""
+    metadata_where, metadata_params = metadata_conditions(filters)
+
+    with get_db_connection() as conn:
+        months = list(router.months(conn))
+
+    start_month = partition_month(start_ms) if start_ms is not None else None
+    end_month = partition_month(end_ms - 1) if end_ms is not None else None
+    if after is not None:
+        start_month = max(start_month or '', partition_month(after[0]))
+
+    for month in months:
+        if (start_month and month < start_month) or (end_month and month > end_month):
+            continue
+
+        conditions = []
+        params: List = []
+        if start_ms is not None:
+            conditions.append('ts >= ?')
+            params.append(start_ms)
+        if end_ms is not None:
+            conditions.append('ts < ?')
+            params.append(end_ms)
+        if session_id is not None:
+            conditions.append('session_id = ?')
+            params.append(session_id)
+        conditions.extend(metadata_where)
+        params.extend(metadata_params)
+
+        cursor_key = after
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if cursor_key is not None:
+                page_conditions.append('(ts, id) > (?, ?)')
+                page_params.extend(cursor_key)
+            where = ' AND '.join(page_conditions) or 'true'
+
+            with get_db_connection() as conn:
+                rows = conn.execute(
+                    f'SELECT id, {FEEDBACK_COLUMNS} FROM {partition_table(month)} '
+                    f'WHERE {where} ORDER BY ts, id LIMIT ?',
+                    page_params + [page_size]
+                ).fetchall()
+
+            yield from rows
+            if len(rows) < page_size:
+                break
+            cursor_key = (rows[-1]['ts'], rows[-1]['id'])
+
+
+def query_changes(after_id: int, session_id: Optional[str] = None, limit: int = 500) -> List[sqlite3.Row]:
+    \"""
+    Righe con id > after_id in ordine di id, al più limit.
+
+    Ogni scrittura assegna un id nuovo dalla sequenza globale (anche un
+    cambio voto), nella transazione che lo committa: l'id è quindi un
+    cursore monotono delle modifiche. Una query per partizione (range sulla
+    chiave primaria, o sull'indice session_id che include l'id) e merge dei
+    risultati già ordinati, tutto nello stesso snapshot di lettura: una
+    scrittura committata tra due partizioni non può far saltare un id.
+    \"""
+    if session_id:
+        where, params = 'session_id = ? AND id > ?', (session_id, after_id, limit)
+    else:
+        where, params = 'id > ?', (after_id, limit)
+
+    with get_db_connection() as conn:
+        conn.execute('BEGIN')
+        try:
+            pages = [
+                conn.execute(
+                    f'SELECT id, {FEEDBACK_COLUMNS} FROM {table} WHERE {where} ORDER BY id LIMIT ?', params
+                ).fetchall()
+                for table in router.tables(conn)
+            ]
+        finally:
+            conn.rollback()
+
+    return list(islice(heapq.merge(*pages, key=lambda row: row['id']), limit))
+
+
+# ============================================================================
+# DATABASE SETUP
+# ============================================================================
+
+def init_db():
+    \"""Inizializza database SQLite per feedback: schema condiviso, migrazioni, partizione del mese\"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            tables = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+            for statement in SHARED_SCHEMA + ROLLUP_SCHEMA:
+                cursor.execute(statement)
+
+            # Database nuovo: nasce direttamente all'ultima versione
+            if not tables & {'feedback', 'feedback_partitions'}:
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        applied = run_migrations(conn)
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            router.ensure(conn, current_month())
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            router.invalidate()
+            raise
+
+        # FEEDBACK_TOP_KEYS cambiata: trigger e aggregati ricreati
+        sync_top_keys(conn)
+        # FEEDBACK_INDEXED_KEYS cambiata: colonne generate e indici allineati
+        sync_indexed_keys(conn)
+
+        # Database esistente senza rollup, o righe riscritte da una migrazione
+        if 'feedback_daily' not in tables or applied:
+            rebuild_rollups(conn)
+        elif 'feedback_sketches' not in tables or conn.execute(
+            'SELECT 1 FROM feedback_sketches WHERE length(registers) != ? LIMIT 1', (1 << SKETCH_PRECISION,)
+        ).fetchone():
+            # Sketch assenti o creati con un altro FEEDBACK_HLL_ERROR
+            rebuild_sketches(conn)
+
+
+# ============================================================================
+# SCHEMA MIGRATIONS
+# ============================================================================
+
+# La versione applicata è in PRAGMA user_version. Ogni migrazione gestisce le
+# proprie transazioni ed è ripetibile: se il processo si interrompe, al riavvio
+# riprende dal punto in cui era rimasta. user_version avanza solo a fine
+# migrazione; più worker che la eseguono insieme si serializzano sul write lock.
+
+def schema_version(conn: Optional[sqlite3.Connection] = None) -> int:
+    \"""Versione schema applicata\"""
+    if conn is None:
+        with get_db_connection() as conn:
+            return schema_version(conn)
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+TEXT_LAYOUT_COLUMNS = ('id, message_id, feedback_type, session_id, timestamp, user_agent, '
+                       'ip_address, metadata, created_at')
+
+
+def encode_vote(feedback_type) -> Optional[int]:
+    \"""Voto del layout testuale -> codice (maiuscole e spazi ignorati); None se sconosciuto\"""
+    if not isinstance(feedback_type, str):
+        return None
+    return VOTE_CODES.get(feedback_type.strip().lower())
+
+
+def copy_text_rows(conn: sqlite3.Connection, rows: List[sqlite3.Row], target: Optional[str] = None,
+                   conflict: str = 'ABORT') -> int:
+    \"""
+    Inserisce righe del layout testuale (schema v0/v1) codificate nel layout compatto.
+
+    target None = partizione del mese di ogni riga. Gli id vengono mantenuti;
+    le righe con feedback_type sconosciuto vengono scartate. Ritorna quante.
+    \"""
+    ua_ids = user_agent_ids(conn, [row['user_agent'] for row in rows])
+    by_table: Dict[str, List[Tuple]] = {}
+    skipped = 0
+    for row in rows:
+        vote = encode_vote(row['feedback_type'])
+        if vote is None:
+            skipped += 1
+            continue
+        created = encode_timestamp(row['created_at'])
+        ts = encode_timestamp(row['timestamp'])
+        if ts is None:
+            ts = created or 0
+        table = target or router.ensure(conn, partition_month(ts))
+        by_table.setdefault(table, []).append((
+            row['id'], row['message_id'], vote, row['session_id'], ts,
+            ua_ids.get(row['user_agent']), encode_ip(row['ip_address']), row['metadata'],
+            created // 1000 if created is not None else None
+        ))
+
+    for table, table_rows in by_table.items():
+        conn.executemany(
+            f'INSERT OR {conflict} INTO {table} ({PARTITION_COLUMNS}, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            table_rows
+        )
+    return skipped
+
+
+def copy_text_layout(conn: sqlite3.Connection, source: str, target: Optional[str] = None,
+                     chunk_size: int = 1000) -> int:
+    \"""Copia tutte le righe di source (vedi copy_text_rows); ritorna le righe scartate\"""
+    last_id = 0
+    skipped = 0
+    while True:
+        rows = conn.execute(
+            f'SELECT {TEXT_LAYOUT_COLUMNS} FROM {source} WHERE id > ? ORDER BY id LIMIT ?',
+            (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            return skipped
+        skipped += copy_text_rows(conn, rows, target)
+        last_id = rows[-1]['id']
+
+
+def migrate_to_partitions(conn: sqlite3.Connection, chunk_size: int = 1000) -> None:
+    \"""
+    v1: tabella `feedback` unica -> partizioni mensili (id originali mantenuti).
+
+    Una transazione breve per blocco di chunk_size righe, che cancella dalla
+    tabella di origine il blocco copiato: i writer attendono al più un blocco
+    e dopo un'interruzione si riprende dal primo blocco non copiato. La
+    sequenza degli id viene portata oltre l'id legacy massimo prima della
+    copia, così le scritture nel frattempo non collidono; una riga legacy
+    con lo stesso message_id di una scrittura successiva viene ignorata.
+    \"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'feedback' in tables:
+            # Rinomina prima: il nome `feedback` serve alla view
+            conn.execute('ALTER TABLE feedback RENAME TO feedback_unpartitioned')
+            tables.add('feedback_unpartitioned')
+        if 'feedback_unpartitioned' in tables:
+            conn.execute(
+                "UPDATE feedback_sequence SET value = MAX(value, "
+                "(SELECT COALESCE(MAX(id), 0) FROM feedback_unpartitioned)) WHERE name = 'feedback'"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        router.invalidate()
+        raise
+    if 'feedback_unpartitioned' not in tables:
+        return
+
+    skipped = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                f'SELECT {TEXT_LAYOUT_COLUMNS} FROM feedback_unpartitioned ORDER BY id LIMIT ?',
+                (chunk_size,)
+            ).fetchall()
+            if rows:
+                skipped += copy_text_rows(conn, rows, conflict='IGNORE')
+                conn.execute('DELETE FROM feedback_unpartitioned WHERE id <= ?', (rows[-1]['id'],))
+            else:
+                conn.execute('DROP TABLE feedback_unpartitioned')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            router.invalidate()
+            raise
+        if not rows:
+            break
+
+    if skipped:
+        logger.warning(f'Schema migration 1: skipped {skipped} legacy rows with unknown feedback_type')
+
+
+def migrate_to_compact_encoding(conn: sqlite3.Connection) -> None:
+    \"""
+    v2: partizioni con layout testuale -> layout compatto.
+
+    Una transazione per partizione: i lettori WAL non si bloccano e i writer
+    attendono al più la copia di un mese. Le partizioni già convertite
+    (colonna ts presente) vengono saltate.
+    \"""
+    # La view referenzia le colonne testuali: viene ricreata alla fine
+    conn.execute('DROP VIEW IF EXISTS feedback')
+
+    for table in router.tables(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if columns and 'ts' not in columns:
+                compact = f'{table}_compact'
+                conn.execute(f'DROP TABLE IF EXISTS {compact}')
+                conn.execute(partition_table_ddl(compact))
+                skipped = copy_text_layout(conn, table, compact)
+                if skipped:
+                    logger.warning(f'Schema migration 2: skipped {skipped} rows of {table} '
+                                   'with unknown feedback_type')
+                # DROP elimina anche indici e trigger testuali della partizione
+                conn.execute(f'DROP TABLE {table}')
+                conn.execute(f'ALTER TABLE {compact} RENAME TO {table}')
+                for statement in partition_schema(table)[1:]:
+                    conn.execute(statement)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    conn.execute('BEGIN IMMEDIATE')
+    refresh_feedback_view(conn)
+    conn.commit()
+
+
+def migrate_to_location_index(conn: sqlite3.Connection) -> None:
+    \"""
+    v3: indice feedback_locations (message_id -> mese) dalle partizioni.
+
+    Una transazione per partizione, dalla più recente: con INSERT OR IGNORE
+    vincono il mese più recente e le righe scritte nel frattempo.
+    \"""
+    for month in reversed(router.months(conn)):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR IGNORE INTO feedback_locations (message_id, month) '
+                f'SELECT message_id, ? FROM {partition_table(month)}',
+                (month,)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# (versione, descrizione, funzione): solo in coda, mai riordinare
+MIGRATIONS = [
+    (1, 'monthly partitions', migrate_to_partitions),
+    (2, 'compact column encoding', migrate_to_compact_encoding),
+    (3, 'message partition index', migrate_to_location_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn: sqlite3.Connection) -> List[int]:
+    \"""Applica in ordine le migrazioni oltre user_version; ritorna le versioni applicate\"""
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        start = time.perf_counter()
+        migrate(conn)
+        conn.execute(f'PRAGMA user_version = {version}')
+        logger.info(f'Schema migration {version} ({description}) applied in {time.perf_counter() - start:.2f}s')
+        applied.append(version)
+    return applied
+
+
+# ============================================================================
+# ROLLUPS
+# ============================================================================
+
+# Contatori per giorno e per (sessione, giorno), mantenuti dai trigger di
+# ogni partizione nella stessa transazione della scrittura. INSERT OR REPLACE cancella la riga
+# precedente (trigger DELETE, con recursive_triggers) e inserisce la nuova
+# (trigger INSERT): un cambio voto sposta il conteggio senza doppi conteggi.
+
+def _rollup_delta(sign: str, ref: str) -> List[str]:
+    \"""Statement trigger che applicano +1/-1 ai rollup per la riga ref\"""
+    day = f"date({ref}.ts / 1000, 'unixepoch')"
+    positive = f'({ref}.vote = 1)'
+    negative = f'({ref}.vote = 2)'
+    return [
+        f'''
+        INSERT INTO feedback_daily (day, total, positive, negative)
+        VALUES ({day}, {sign}1, {sign}{positive}, {sign}{negative})
+        ON CONFLICT(day) DO UPDATE SET
+            total = total + excluded.total,
+            positive = positive + excluded.positive,
+            negative = negative + excluded.negative;
+        ''',
+        f'''
+        INSERT INTO feedback_session_daily (session_id, day, total, positive, negative)
+        SELECT {ref}.session_id, {day}, {sign}1, {sign}{positive}, {sign}{negative}
+        WHERE {ref}.session_id IS NOT NULL
+        ON CONFLICT(session_id, day) DO UPDATE SET
+            total = total + excluded.total,
+            positive = positive + excluded.positive,
+            negative = negative + excluded.negative;
+        ''',
+    ]
+
+
+ROLLUP_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_daily (
+        day TEXT PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        positive INTEGER NOT NULL DEFAULT 0,
+        negative INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_session_daily (
+        session_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        positive INTEGER NOT NULL DEFAULT 0,
+        negative INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (session_id, day)
+    ) WITHOUT ROWID
+    ''',
+    # Retention: i rollup di un mese eliminato vengono cancellati per giorno
+    'CREATE INDEX IF NOT EXISTS idx_session_daily_day ON feedback_session_daily(day)',
+    # Voti per (chiave metadata, giorno, valore) delle chiavi in FEEDBACK_TOP_KEYS
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_top_daily (
+        key TEXT NOT NULL,
+        day TEXT NOT NULL,
+        value NOT NULL,
+        positive INTEGER NOT NULL DEFAULT 0,
+        negative INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (key, day, value)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_top_keys (
+        key TEXT PRIMARY KEY
+    ) WITHOUT ROWID
+    ''',
+    # Sketch HyperLogLog per giorno: kind = 'session' | 'message'
+    '''
+    CREATE TABLE IF NOT EXISTS feedback_sketches (
+        day TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        registers BLOB NOT NULL,
+        PRIMARY KEY (day, kind)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def rebuild_rollups(conn: Optional[sqlite3.Connection] = None) -> Dict:
+    \"""Ricalcola i rollup dalle partizioni in una transazione\"""
+    if conn is None:
+        with get_db_connection() as conn:
+            return rebuild_rollups(conn)
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        cursor.execute('DELETE FROM feedback_daily')
+        cursor.execute('DELETE FROM feedback_session_daily')
+        # Un giorno appartiene a una sola partizione, salvo righe migrate con
+        # timestamp non riconoscibile: da qui l'UPSERT
+        for table in router.tables(conn):
+            cursor.execute(f'''
+                INSERT INTO feedback_daily (day, total, positive, negative)
+                SELECT date(ts / 1000, 'unixepoch'), COUNT(*), SUM(vote = 1), SUM(vote = 2)
+                FROM {table}
+                WHERE true
+                GROUP BY 1
+                ON CONFLICT(day) DO UPDATE SET
+                    total = total + excluded.total,
+                    positive = positive + excluded.positive,
+                    negative = negative + excluded.negative
+            ''')
+            cursor.execute(f'''
+                INSERT INTO feedback_session_daily (session_id, day, total, positive, negative)
+                SELECT session_id, date(ts / 1000, 'unixepoch'), COUNT(*), SUM(vote = 1), SUM(vote = 2)
+                FROM {table}
+                WHERE session_id IS NOT NULL
+                GROUP BY 1, 2
+                ON CONFLICT(session_id, day) DO UPDATE SET
+                    total = total + excluded.total,
+                    positive = positive + excluded.positive,
+                    negative = negative + excluded.negative
+            ''')
+        rebuild_top(conn)
+        days = cursor.execute('SELECT COUNT(*) FROM feedback_daily').fetchone()[0]
+        session_days = cursor.execute('SELECT COUNT(*) FROM feedback_session_daily').fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    rebuild_sketches(conn)
+    return {'days': days, 'sessionDays': session_days}
+
+
+# ============================================================================
+# DISTINCT SKETCHES
+# ============================================================================
+
+# Uno sketch HyperLogLog per giorno e tipo (sessioni, messaggi), aggiornato da
+# upsert_rows nella transazione della scrittura. Gli sketch accettano solo
+# inserimenti: un messaggio rivotato in un altro giorno resta in entrambi.
+
+def update_sketches(conn: sqlite3.Connection, items: List[Tuple[int, Optional[str], str]]) -> None:
+    \"""Aggiunge (ts, session_id, message_id) agli sketch del loro giorno, senza commit\"""
+    values: Dict[Tuple[str, str], List[str]] = {}
+    for ts, session_id, message_id in items:
+        day = format_timestamp(ts)[:10]
+        values.setdefault((day, 'message'), []).append(message_id)
+        if session_id:
+            values.setdefault((day, 'session'), []).append(session_id)
+
+    for (day, kind), day_values in values.items():
+        row = conn.execute(
+            'SELECT registers FROM feedback_sketches WHERE day = ? AND kind = ?', (day, kind)
+        ).fetchone()
+        sketch = HyperLogLog(SKETCH_PRECISION, row[0] if row else None)
+        # Valori già visti (caso comune: stessa sessione) non cambiano i registri
+        if sketch.add_all(day_values):
+            conn.execute(
+                'INSERT OR REPLACE INTO feedback_sketches (day, kind, registers) VALUES (?, ?, ?)',
+                (day, kind, sketch.to_bytes())
+            )
+
+
+def rebuild_sketches(conn: sqlite3.Connection) -> int:
+    \"""Ricalcola gli sketch dalle partizioni in una transazione; ritorna il numero di sketch\"""
+    sketches: Dict[Tuple[str, str], HyperLogLog] = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table in router.tables(conn):
+            cursor = conn.execute(f"SELECT date(ts / 1000, 'unixepoch'), session_id, message_id FROM {table}")
+            for day, session_id, message_id in cursor:
+                key = (day, 'message')
+                if key not in sketches:
+                    sketches[key] = HyperLogLog(SKETCH_PRECISION)
+                sketches[key].add(message_id)
+                if session_id:
+                    key = (day, 'session')
+                    if key not in sketches:
+                        sketches[key] = HyperLogLog(SKETCH_PRECISION)
+                    sketches[key].add(session_id)
+
+        conn.execute('DELETE FROM feedback_sketches')
+        conn.executemany(
+            'INSERT INTO feedback_sketches (day, kind, registers) VALUES (?, ?, ?)',
+            [(day, kind, sketch.to_bytes()) for (day, kind), sketch in sketches.items()]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(sketches)
+
+
+def query_distinct(start_ms: int) -> Dict:
+    \"""
+    Sessioni e messaggi distinti (approssimati) dal giorno di start_ms in poi.
+
+    Granularità giornaliera: il giorno di inizio è contato per intero.
+    \"""
+    start_day = format_timestamp(start_ms)[:10]
+    merged = {'session': HyperLogLog(SKETCH_PRECISION), 'message': HyperLogLog(SKETCH_PRECISION)}
+
+    with get_db_connection() as conn:
+        cursor = conn.execute('SELECT kind, registers FROM feedback_sketches WHERE day >= ?', (start_day,))
+        for kind, registers in cursor:
+            merged[kind].merge(HyperLogLog(SKETCH_PRECISION, registers))
+
+    return {
+        'sessions': merged['session'].count(),
+        'messages': merged['message'].count(),
+        'relativeError': round(merged['session'].relative_error, 4),
+    }
+
+
+def query_stats(start_ms: int, session_id: Optional[str] = None,
+                filters: Optional[Dict[str, str]] = None) -> Dict:
+    \"""
+    Totali feedback con ts >= start_ms (millisecondi epoch).
+
+    I giorni interi dopo quello di start_ms vengono dai rollup; solo il
+    giorno di inizio (parziale) viene letto dalla sua partizione, con un
+    range scan sull'indice intero di ts. Se start_ms è a mezzanotte UTC
+    (es. contatori del giorno dello stream) anche il primo giorno viene dai
+    rollup. Con filtri metadata vedi query_filtered_stats.
+    \"""
+    if filters:
+        return query_filtered_stats(start_ms, session_id, filters)
+
+    start_day = format_timestamp(start_ms)[:10]
+    next_day_ms = (start_ms // 86400000 + 1) * 86400000
+    aligned = start_ms % 86400000 == 0
+    day_op = '>=' if aligned else '>'
+
+    if session_id:
+        rollup_query = f'''
+            SELECT SUM(total), SUM(positive), SUM(negative)
+            FROM feedback_session_daily
+            WHERE session_id = ? AND day {day_op} ?
+        '''
+        rollup_params = (session_id, start_day)
+        partial_filter = ' AND session_id = ?'
+        partial_params = (start_ms, next_day_ms, session_id)
+    else:
+        rollup_query = f'''
+            SELECT SUM(total), SUM(positive), SUM(negative)
+            FROM feedback_daily
+            WHERE day {day_op} ?
+        '''
+        rollup_params = (start_day,)
+        partial_filter = ''
+        partial_params = (start_ms, next_day_ms)
+
+    with get_db_connection() as conn:
+        rollup = conn.execute(rollup_query, rollup_params).fetchone()
+
+        partial = (0, 0, 0)
+        start_month = start_day[:7]
+        if not aligned and start_month in router.months(conn):
+            partial = conn.execute(f'''
+                SELECT COUNT(*), SUM(vote = 1), SUM(vote = 2)
+                FROM {partition_table(start_month)}
+                WHERE ts >= ? AND ts < ?
+            ''' + partial_filter, partial_params).fetchone()
+
+    return {
+        'total': (rollup[0] or 0) + (partial[0] or 0),
+        'positive': (rollup[1] or 0) + (partial[1] or 0),
+        'negative': (rollup[2] or 0) + (partial[2] or 0),
+    }
+
+
+BUCKET_MS = {'hour': 3600000, 'day': 86400000}
+
+
+def query_buckets(interval: str, start_ms: int, session_id: Optional[str] = None) -> Dict[int, Tuple[int, int, int]]:
+    \"""
+    Conteggi (total, positive, negative) per bucket con ts >= start_ms.
+
+    Chiave: inizio del bucket in millisecondi epoch; start_ms deve essere
+    allineato all'intervallo. 'day' legge solo i rollup giornalieri; 'hour'
+    esegue un'unica GROUP BY per partizione con range scan sull'indice di ts.
+    Solo i bucket non vuoti.
+    \"""
+    size = BUCKET_MS[interval]
+    buckets: Dict[int, Tuple[int, int, int]] = {}
+
+    with get_db_connection() as conn:
+        if interval == 'day':
+            start_day = format_timestamp(start_ms)[:10]
+            if session_id:
+                cursor = conn.execute('''
+                    SELECT day, total, positive, negative FROM feedback_session_daily
+                    WHERE session_id = ? AND day >= ?
+                ''', (session_id, start_day))
+            else:
+                cursor = conn.execute('''
+                    SELECT day, total, positive, negative FROM feedback_daily
+                    WHERE day >= ?
+                ''', (start_day,))
+            for day, total, positive, negative in cursor:
+                if total:
+                    buckets[encode_timestamp(day)] = (total, positive, negative)
+            return buckets
+
+        session_filter = ' AND session_id = ?' if session_id else ''
+        params = (size, start_ms, session_id) if session_id else (size, start_ms)
+        for table in router.tables(conn, partition_month(start_ms)):
+            cursor = conn.execute(f'''
+                SELECT ts / ? AS bucket, COUNT(*), SUM(vote = 1), SUM(vote = 2)
+                FROM {table}
+                WHERE ts >= ?{session_filter}
+                GROUP BY bucket
+            ''', params)
+            for bucket, total, positive, negative in cursor:
+                buckets[bucket * size] = (total, positive, negative)
+
+    return buckets
+
+
+# ============================================================================
+# METADATA VOTES (TOP-N)
+# ============================================================================
+
+# Per le chiavi in FEEDBACK_TOP_KEYS i trigger di ogni partizione mantengono
+# feedback_top_daily come i rollup (cambio voto = -1 sul vecchio, +1 sul nuovo).
+# Le altre chiavi vengono aggregate al momento con json_extract sulle partizioni.
+
+def _top_delta(sign: str, ref: str, key: str) -> str:
+    \"""Statement trigger che applica +1/-1 al valore di una chiave metadata\"""
+    value = f"json_extract({ref}.metadata, '{metadata_path(key)}')"
+    return f'''
+        INSERT INTO feedback_top_daily (key, day, value, positive, negative)
+        SELECT '{key}', date({ref}.ts / 1000, 'unixepoch'), {value}, {sign}({ref}.vote = 1), {sign}({ref}.vote = 2)
+        WHERE {value} IS NOT NULL
+        ON CONFLICT(key, day, value) DO UPDATE SET
+            positive = positive + excluded.positive,
+            negative = negative + excluded.negative;
+    '''
+
+
+def top_triggers(table: str, keys: List[str]) -> List[str]:
+    \"""Trigger top-N di una partizione per le chiavi date (nessuno se vuote)\"""
+    if not keys:
+        return []
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_top_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            {''.join(_top_delta('+', 'NEW', key) for key in keys)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_top_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            {''.join(_top_delta('-', 'OLD', key) for key in keys)}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_top_update
+        AFTER UPDATE OF vote, ts, metadata ON {table}
+        BEGIN
+            {''.join(_top_delta('-', 'OLD', key) for key in keys)}
+            {''.join(_top_delta('+', 'NEW', key) for key in keys)}
+        END
+        ''',
+    ]
+
+
+def rebuild_top(conn: sqlite3.Connection) -> None:
+    \"""Ricalcola feedback_top_daily dalle partizioni, nella transazione corrente\"""
+    conn.execute('DELETE FROM feedback_top_daily')
+    for table in router.tables(conn):
+        for key in TOP_KEYS:
+            conn.execute(f'''
+                INSERT INTO feedback_top_daily (key, day, value, positive, negative)
+                SELECT ?, date(ts / 1000, 'unixepoch'), json_extract(metadata, ?) AS value,
+                       SUM(vote = 1), SUM(vote = 2)
+                FROM {table}
+                WHERE value IS NOT NULL
+                GROUP BY 2, 3
+                ON CONFLICT(key, day, value) DO UPDATE SET
+                    positive = positive + excluded.positive,
+                    negative = negative + excluded.negative
+            ''', (key, metadata_path(key)))
+
+
+def sync_top_keys(conn: sqlite3.Connection) -> bool:
+    \"""Allinea trigger e aggregati top-N a FEEDBACK_TOP_KEYS; True se sono stati ricreati\"""
+    stored = [row[0] for row in conn.execute('SELECT key FROM feedback_top_keys ORDER BY key')]
+    if stored == sorted(TOP_KEYS):
+        return False
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table in router.tables(conn):
+            for event in ('insert', 'delete', 'update'):
+                conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_top_{event}')
+            for statement in top_triggers(table, TOP_KEYS):
+                conn.execute(statement)
+        conn.execute('DELETE FROM feedback_top_keys')
+        conn.executemany('INSERT INTO feedback_top_keys (key) VALUES (?)', [(key,) for key in TOP_KEYS])
+        rebuild_top(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info(f"Top-N metadata keys: {', '.join(TOP_KEYS) or 'none'}")
+    return True
+
+
+def query_vote_groups(key: str, start_ms: int) -> List[Tuple]:
+    \"""
+    (valore, positive, negative) per valore della chiave metadata, ts >= start_ms.
+
+    Un valore può comparire più volte (una per partizione o sorgente): il
+    chiamante somma. Chiavi materializzate: giorni interi da feedback_top_daily
+    più il solo giorno di inizio dalla sua partizione; altre chiavi: una
+    GROUP BY per partizione sul range di ts.
+    \"""
+    path = metadata_path(key)
+    start_day = format_timestamp(start_ms)[:10]
+    next_day_ms = (start_ms // 86400000 + 1) * 86400000
+    groups: List[Tuple] = []
+
+    with get_db_connection() as conn:
+        if key in TOP_KEYS:
+            groups.extend(conn.execute('''
+                SELECT value, SUM(positive), SUM(negative)
+                FROM feedback_top_daily
+                WHERE key = ? AND day > ?
+                GROUP BY value
+            ''', (key, start_day)))
+            tables = [partition_table(start_day[:7])] if start_day[:7] in router.months(conn) else []
+            upper = ' AND ts < ?'
+            params = (path, start_ms, next_day_ms)
+        else:
+            tables = router.tables(conn, start_day[:7])
+            upper = ''
+            params = (path, start_ms)
+
+        for table in tables:
+            groups.extend(conn.execute(f'''
+                SELECT json_extract(metadata, ?) AS value, SUM(vote = 1), SUM(vote = 2)
+                FROM {table}
+                WHERE ts >= ?{upper}
+                GROUP BY value
+                HAVING value IS NOT NULL
+            ''', params))
+
+    return [tuple(group) for group in groups if group[1] or group[2]]
+
+
+# ============================================================================
+# METADATA INDEXES
+# ============================================================================
+
+# Per ogni chiave in FEEDBACK_INDEXED_KEYS le partizioni hanno una colonna
+# generata VIRTUAL (json_extract calcolato dall'indice a ogni scrittura, nessun
+# byte in più nel record) e un indice (colonna, ts): i filtri ?meta.<chiave>=
+# di stats ed export diventano range scan invece di parse JSON riga per riga.
+# I valori sono confrontati come testo (affinità TEXT: 5 -> '5', true -> '1').
+
+def metadata_column_ddl(key: str) -> str:
+    \"""Definizione della colonna generata di una chiave indicizzata\"""
+    return f"{metadata_column(key)} TEXT GENERATED ALWAYS AS (json_extract(metadata, '{metadata_path(key)}')) VIRTUAL"
+
+
+def metadata_index_ddl(table: str, key: str) -> str:
+    return f'CREATE INDEX IF NOT EXISTS "idx_{table}_meta.{key}" ON {table}({metadata_column(key)}, ts)'
+
+
+def _indexed_key_changes(conn: sqlite3.Connection) -> List[str]:
+    \"""Statement che allineano colonne generate e indici delle partizioni a INDEXED_KEYS\"""
+    wanted = {f'meta.{key}': key for key in INDEXED_KEYS}
+    statements = []
+    for table in router.tables(conn):
+        present = {row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})') if row[1].startswith('meta.')}
+        for column in sorted(present - wanted.keys()):
+            statements.append(f'DROP INDEX IF EXISTS "idx_{table}_{column}"')
+            statements.append(f'ALTER TABLE {table} DROP COLUMN "{column}"')
+        for column in sorted(wanted.keys() - present):
+            statements.append(f'ALTER TABLE {table} ADD COLUMN {metadata_column_ddl(wanted[column])}')
+            statements.append(metadata_index_ddl(table, wanted[column]))
+    return statements
+
+
+def sync_indexed_keys(conn: sqlite3.Connection) -> bool:
+    \"""Aggiunge/rimuove colonne generate e indici secondo FEEDBACK_INDEXED_KEYS; True se modificati\"""
+    if not _indexed_key_changes(conn):
+        return False
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Ricalcolate sotto write lock: un altro worker può averle già applicate
+        for statement in _indexed_key_changes(conn):
+            conn.execute(statement)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        router.invalidate()
+
+    logger.info(f"Indexed metadata keys: {', '.join(INDEXED_KEYS) or 'none'}")
+    return True
+
+
+def metadata_conditions(filters: Optional[Dict[str, str]]) -> Tuple[List[str], List]:
+    \"""Condizioni WHERE per filtri {chiave: valore}; ValueError se la chiave non è indicizzata\"""
+    conditions, params = [], []
+    for key, value in (filters or {}).items():
+        if key not in INDEXED_KEYS:
+            raise ValueError(f'Metadata key "{key}" is not indexed')
+        conditions.append(f'{metadata_column(key)} = ?')
+        params.append(value)
+    return conditions, params
+
+
+def query_filtered_stats(start_ms: int, session_id: Optional[str], filters: Dict[str, str]) -> Dict:
+    \"""
+    Totali con filtri metadata: i rollup non distinguono i valori, quindi
+    una query per partizione da start_ms sull'indice (colonna, ts).
+    \"""
+    conditions, params = metadata_conditions(filters)
+    conditions.append('ts >= ?')
+    params.append(start_ms)
+    if session_id:
+        conditions.append('session_id = ?')
+        params.append(session_id)
+    where = ' AND '.join(conditions)
+
+    totals = [0, 0, 0]
+    with get_db_connection() as conn:
+        for table in router.tables(conn, partition_month(start_ms)):
+            row = conn.execute(
+                f'SELECT COUNT(*), SUM(vote = 1), SUM(vote = 2) FROM {table} WHERE {where}',
+                params
+            ).fetchone()
+            for i in range(3):
+                totals[i] += row[i] or 0
+
+    return {'total': totals[0], 'positive': totals[1], 'negative': totals[2]}
+"""
+
+
+# ============================================================================
+# SKETCHES: feedback_sketch.py (HyperLogLog)
+# ============================================================================
+
+FEEDBACK_SKETCH = """
+\"""
+HyperLogLog per conteggi distinti approssimati (sessioni, messaggi)
+Memoria fissa per sketch (2^precision byte), errore relativo ~1.04/sqrt(2^precision);
+due sketch si uniscono prendendo il massimo registro per registro
+\"""
+
+import math
+import os
+from hashlib import blake2b
+from typing import Iterable, Optional
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+def precision_for_error(error: float) -> int:
+    \"""Precisione minima per un errore relativo (deviazione standard) atteso\"""
+    precision = math.ceil(math.log2((1.04 / error) ** 2))
+    return max(MIN_PRECISION, min(MAX_PRECISION, precision))
+
+
+# Default 2%: precisione 12, 4 KiB per sketch
+SKETCH_PRECISION = precision_for_error(float(os.getenv('FEEDBACK_HLL_ERROR', 0.02)))
+
+
+class HyperLogLog:
+    \"""Registri da 1 byte; hash 64 bit (blake2b), nessuna correzione large-range necessaria\"""
+
+    def __init__(self, precision: int = SKETCH_PRECISION, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is not None and len(registers) != self.size:
+            raise ValueError(f'Sketch has {len(registers)} registers, expected {self.size}')
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value: str) -> bool:
+        \"""Aggiunge un valore; True se un registro è cambiato\"""
+        h = int.from_bytes(blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def add_all(self, values: Iterable[str]) -> bool:
+        changed = False
+        for value in values:
+            changed = self.add(value) or changed
+        return changed
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        if other.size != self.size:
+            raise ValueError('Cannot merge sketches with different precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.size
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        # Small range: linear counting finché ci sono registri vuoti
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+"""
+
+
+# ============================================================================
+# STORAGE BACKENDS: feedback_storage.py (SQLite / in-memoria)
+# ============================================================================
+
+FEEDBACK_STORAGE_BACKENDS = """
+\"""
+Backend di storage intercambiabili per feedback API
+Le route (feedback_service.py) parlano solo con FeedbackStorage: SQLite in
+produzione, dizionari in memoria per benchmark e test. Selezione con
+FEEDBACK_STORAGE (sqlite | memory)
+\"""
+
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Protocol, Set, Tuple
+
+from feedback_db import (
+    init_db, get_db_connection, pool, PoolTimeout, upsert_rows, fetch_feedback, fetch_feedback_many,
+    iter_feedback, serialize_feedback, query_stats, query_buckets, query_distinct,
+    query_vote_groups, query_changes, metadata_path, change_version, expire_partitions, partition_months,
+    schema_version, format_timestamp, now_ms, BUCKET_MS
+)
+from feedback_sketch import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+# Riga in scrittura: message_id, feedback_type, session_id, ts (millisecondi
+# epoch), user_agent, ip_address, metadata (JSON). Le letture restituiscono
+# il formato dell'API (serialize_feedback).
+Row = Tuple
+Key = Tuple[int, int]
+
+DAY_MS = 86400000
+
+
+class StorageError(Exception):
+    \"""Scrittura non riuscita (il chiamante può riprovare o riportare l'errore)\"""
+
+
+class FeedbackStorage(Protocol):
+    \"""Operazioni richieste da feedback_service a un backend\"""
+
+    name: str
+
+    def init(self) -> None:
+        \"""Schema, migrazioni e retention; chiamato una volta all'avvio\"""
+
+    def upsert(self, row: Row) -> int:
+        \"""Scrive una riga e committa; ritorna l'id assegnato\"""
+
+    def upsert_many(self, rows: List[Row]) -> List[int]:
+        \"""Scrive le righe in una sola transazione (vince l'ultima per message_id)\"""
+
+    def get(self, message_id: str) -> Optional[Dict]:
+        \"""Feedback nel formato dell'API, None se assente\"""
+
+    def get_many(self, message_ids: List[str]) -> Dict[str, Dict]:
+        \"""Feedback trovati, per message_id\"""
+
+    def stats(self, start_ms: int, session_id: Optional[str] = None,
+              filters: Optional[Dict[str, str]] = None) -> Dict:
+        \"""Totali total/positive/negative con ts >= start_ms; filters = {chiave metadata: valore}\"""
+
+    def buckets(self, interval: str, start_ms: int,
+                session_id: Optional[str] = None) -> Dict[int, Tuple[int, int, int]]:
+        \"""(total, positive, negative) per bucket 'hour'|'day' non vuoto, da start_ms (allineato)\"""
+
+    def distinct(self, start_ms: int) -> Dict:
+        \"""Sessioni e messaggi distinti approssimati (HyperLogLog) dal giorno di start_ms\"""
+
+    def vote_groups(self, key: str, start_ms: int) -> List[Tuple]:
+        \"""(valore, positive, negative) per valore della chiave metadata, ts >= start_ms (valori ripetibili)\"""
+
+    def iterate(self, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                session_id: Optional[str] = None, after: Optional[Key] = None,
+                page_size: int = 500, filters: Optional[Dict[str, str]] = None) -> Iterator[Tuple[Key, Dict]]:
+        \"""Coppie ((ts, id), feedback) in ordine (ts, id), dopo la chiave after\"""
+
+    def version(self) -> Tuple[int, int]:
+        \"""(contatore modifiche, ms epoch dell'ultima modifica) per ETag/Last-Modified\"""
+
+    def changes(self, after_id: int, session_id: Optional[str] = None,
+                limit: int = 500) -> List[Tuple[int, Dict]]:
+        \"""Coppie (id, feedback) scritte dopo after_id, in ordine di id (ogni scrittura ha un id nuovo)\"""
+
+    def health(self) -> Dict:
+        \"""Campi aggiunti a GET /api/health\"""
+
+
+# ============================================================================
+# SQLITE
+# ============================================================================
+
+class SQLiteStorage:
+    \"""Backend SQLite: partizioni mensili, rollup e pool di feedback_db\"""
+
+    name = 'sqlite'
+
+    def init(self) -> None:
+        init_db()
+
+        # Retention (FEEDBACK_RETENTION_MONTHS): no-op se non ci sono mesi scaduti
+        expired = expire_partitions()
+        if expired:
+            logger.info(f"Expired feedback partitions: {', '.join(expired)}")
+
+    def upsert(self, row: Row) -> int:
+        return self.upsert_many([row])[-1]
+
+    def upsert_many(self, rows: List[Row]) -> List[int]:
+        try:
+            # Senza commit, il rilascio al pool annulla la transazione
+            with get_db_connection() as conn:
+                ids = upsert_rows(conn, rows)
+                conn.commit()
+        except (sqlite3.Error, PoolTimeout) as e:
+            # Pool esaurito come DB occupato: il chiamante riprova o riporta il blocco
+            raise StorageError(str(e)) from e
+        return ids
+
+    def get(self, message_id: str) -> Optional[Dict]:
+        row = fetch_feedback(message_id)
+        return serialize_feedback(row) if row else None
+
+    def get_many(self, message_ids: List[str]) -> Dict[str, Dict]:
+        return {m: serialize_feedback(row) for m, row in fetch_feedback_many(message_ids).items()}
+
+    def stats(self, start_ms: int, session_id: Optional[str] = None,
+              filters: Optional[Dict[str, str]] = None) -> Dict:
+        # Somma rollup giornalieri (+ scan parziale del solo giorno di inizio);
+        # con filtri metadata, indici sulle colonne generate
+        return query_stats(start_ms, session_id, filters)
+
+    def buckets(self, interval: str, start_ms: int,
+                session_id: Optional[str] = None) -> Dict[int, Tuple[int, int, int]]:
+        return query_buckets(interval, start_ms, session_id)
+
+    def distinct(self, start_ms: int) -> Dict:
+        return query_distinct(start_ms)
+
+    def vote_groups(self, key: str, start_ms: int) -> List[Tuple]:
+        # Chiavi in FEEDBACK_TOP_KEYS da feedback_top_daily, le altre con json_extract
+        return query_vote_groups(key, start_ms)
+
+    def iterate(self, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                session_id: Optional[str] = None, after: Optional[Key] = None,
+                page_size: int = 500, filters: Optional[Dict[str, str]] = None) -> Iterator[Tuple[Key, Dict]]:
+        for row in iter_feedback(start_ms, end_ms, session_id, after, page_size, filters):
+            yield (row['ts'], row['id']), serialize_feedback(row)
+
+    def version(self) -> Tuple[int, int]:
+        return change_version()
+
+    def changes(self, after_id: int, session_id: Optional[str] = None,
+                limit: int = 500) -> List[Tuple[int, Dict]]:
+        return [(row['id'], serialize_feedback(row)) for row in query_changes(after_id, session_id, limit)]
+
+    def health(self) -> Dict:
+        return {
+            'db': pool.stats(),
+            'schemaVersion': schema_version(),
+            'partitions': partition_months()
+        }
+
+
+# ============================================================================
+# IN-MEMORY
+# ============================================================================
+
+class MemoryStorage:
+    \"""
+    Backend in memoria: dizionario per message_id e contatori per giorno.
+
+    I contatori giornalieri (totali e per sessione) hanno lo stesso ruolo dei
+    rollup SQLite; il giorno di inizio di stats() viene contato dalle sole
+    righe di quel giorno. Nessuna persistenza e dati per processo: usare un
+    solo worker.
+    \"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # message_id -> (id, message_id, feedback_type, session_id, ts, user_agent, ip_address, metadata)
+        self._records: Dict[str, Tuple] = {}
+        # giorno (ts // DAY_MS) -> message_id del giorno
+        self._day_members: Dict[int, Set[str]] = {}
+        # giorno -> [total, positive, negative]
+        self._daily: Dict[int, List[int]] = {}
+        self._session_daily: Dict[Tuple[str, int], List[int]] = {}
+        # (giorno, 'session' | 'message') -> sketch HyperLogLog
+        self._sketches: Dict[Tuple[int, str], HyperLogLog] = {}
+        self._changes = 0
+        self._changed_at = 0
+
+    def init(self) -> None:
+        pass
+
+    def _count(self, record: Tuple, sign: int) -> None:
+        \"""Applica +1/-1 ai contatori del giorno della riga\"""
+        _, message_id, feedback_type, session_id, ts = record[:5]
+        day = ts // DAY_MS
+        delta = (sign, sign * (feedback_type == 'positive'), sign * (feedback_type == 'negative'))
+
+        targets = [self._daily.setdefault(day, [0, 0, 0])]
+        if session_id is not None:
+            targets.append(self._session_daily.setdefault((session_id, day), [0, 0, 0]))
+        for counters in targets:
+            for i, value in enumerate(delta):
+                counters[i] += value
+
+        if sign > 0:
+            self._day_members.setdefault(day, set()).add(message_id)
+            self._sketch(day, 'message').add(message_id)
+            if session_id is not None:
+                self._sketch(day, 'session').add(session_id)
+        else:
+            self._day_members[day].discard(message_id)
+
+    def _sketch(self, day: int, kind: str) -> HyperLogLog:
+        sketch = self._sketches.get((day, kind))
+        if sketch is None:
+            sketch = self._sketches[(day, kind)] = HyperLogLog()
+        return sketch
+
+    def upsert(self, row: Row) -> int:
+        return self.upsert_many([row])[-1]
+
+    def upsert_many(self, rows: List[Row]) -> List[int]:
+        latest: Dict[str, Row] = {}
+        for row in rows:
+            latest.pop(row[0], None)
+            latest[row[0]] = row
+
+        ids = []
+        with self._lock:
+            for message_id, row in latest.items():
+                previous = self._records.get(message_id)
+                if previous is not None:
+                    self._count(previous, -1)
+                record = (self._next_id,) + tuple(row)
+                self._next_id += 1
+                self._records[message_id] = record
+                self._count(record, +1)
+                ids.append(record[0])
+            if ids:
+                self._changes += 1
+                self._changed_at = now_ms()
+        return ids
+
+    @staticmethod
+    def _serialize(record: Tuple) -> Dict:
+        _, message_id, feedback_type, session_id, ts, _, _, metadata = record
+        return {
+            'messageId': message_id,
+            'feedbackType': feedback_type,
+            'sessionId': session_id,
+            'timestamp': format_timestamp(ts),
+            'metadata': json.loads(metadata) if metadata else {}
+        }
+
+    def get(self, message_id: str) -> Optional[Dict]:
+        record = self._records.get(message_id)
+        return self._serialize(record) if record else None
+
+    def get_many(self, message_ids: List[str]) -> Dict[str, Dict]:
+        records = self._records
+        return {m: self._serialize(records[m]) for m in message_ids if m in records}
+
+    def stats(self, start_ms: int, session_id: Optional[str] = None,
+              filters: Optional[Dict[str, str]] = None) -> Dict:
+        if filters:
+            # Nessun contatore per valore metadata: scansione delle righe
+            totals = [0, 0, 0]
+            for _, record in self._select(start_ms, None, session_id, None, filters):
+                totals[0] += 1
+                totals[1] += record[2] == 'positive'
+                totals[2] += record[2] == 'negative'
+            return {'total': totals[0], 'positive': totals[1], 'negative': totals[2]}
+
+        # A mezzanotte UTC anche il giorno di inizio viene dai contatori giornalieri
+        aligned = start_ms % DAY_MS == 0
+        first_day = start_ms // DAY_MS if aligned else start_ms // DAY_MS + 1
+        start_day = start_ms // DAY_MS
+        totals = [0, 0, 0]
+        with self._lock:
+            if session_id:
+                counters = (c for (s, day), c in self._session_daily.items() if s == session_id and day >= first_day)
+            else:
+                counters = (c for day, c in self._daily.items() if day >= first_day)
+            for c in counters:
+                for i in range(3):
+                    totals[i] += c[i]
+
+            # Giorno di inizio parziale: solo le sue righe
+            for message_id in () if aligned else self._day_members.get(start_day, ()):
+                _, _, feedback_type, row_session, ts = self._records[message_id][:5]
+                if ts < start_ms or (session_id and row_session != session_id):
+                    continue
+                totals[0] += 1
+                totals[1] += feedback_type == 'positive'
+                totals[2] += feedback_type == 'negative'
+
+        return {'total': totals[0], 'positive': totals[1], 'negative': totals[2]}
+
+    def buckets(self, interval: str, start_ms: int,
+                session_id: Optional[str] = None) -> Dict[int, Tuple[int, int, int]]:
+        start_day = start_ms // DAY_MS
+        result: Dict[int, Tuple[int, int, int]] = {}
+        with self._lock:
+            if interval == 'day':
+                if session_id:
+                    days = ((day, c) for (s, day), c in self._session_daily.items() if s == session_id)
+                else:
+                    days = self._daily.items()
+                for day, c in days:
+                    if day >= start_day and c[0]:
+                        result[day * DAY_MS] = tuple(c)
+                return result
+
+            size = BUCKET_MS[interval]
+            counts: Dict[int, List[int]] = {}
+            for day, members in self._day_members.items():
+                if day < start_day:
+                    continue
+                for message_id in members:
+                    _, _, feedback_type, row_session, ts = self._records[message_id][:5]
+                    if ts < start_ms or (session_id and row_session != session_id):
+                        continue
+                    c = counts.setdefault(ts // size * size, [0, 0, 0])
+                    c[0] += 1
+                    c[1] += feedback_type == 'positive'
+                    c[2] += feedback_type == 'negative'
+        return {bucket: tuple(c) for bucket, c in counts.items()}
+
+    def distinct(self, start_ms: int) -> Dict:
+        start_day = start_ms // DAY_MS
+        merged = {'session': HyperLogLog(), 'message': HyperLogLog()}
+        with self._lock:
+            for (day, kind), sketch in self._sketches.items():
+                if day >= start_day:
+                    merged[kind].merge(sketch)
+        return {
+            'sessions': merged['session'].count(),
+            'messages': merged['message'].count(),
+            'relativeError': round(merged['session'].relative_error, 4),
+        }
+
+    @staticmethod
+    def _metadata_value(metadata: Optional[str], path: List[str]):
+        \"""Valore come json_extract: oggetti/array in JSON compatto, booleani 0/1\"""
+        value = json.loads(metadata) if metadata else None
+        for part in path:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, separators=(',', ':'))
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    def vote_groups(self, key: str, start_ms: int) -> List[Tuple]:
+        path = metadata_path(key)[2:].split('.')
+        groups: Dict = {}
+        with self._lock:
+            for record in self._records.values():
+                if record[4] < start_ms:
+                    continue
+                value = self._metadata_value(record[7], path)
+                if value is None:
+                    continue
+                counts = groups.setdefault(value, [0, 0])
+                counts[0] += record[2] == 'positive'
+                counts[1] += record[2] == 'negative'
+        return [(value, positive, negative) for value, (positive, negative) in groups.items()]
+
+    def iterate(self, start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                session_id: Optional[str] = None, after: Optional[Key] = None,
+                page_size: int = 500, filters: Optional[Dict[str, str]] = None) -> Iterator[Tuple[Key, Dict]]:
+        for key, record in self._select(start_ms, end_ms, session_id, after, filters):
+            yield key, self._serialize(record)
+
+    def _select(self, start_ms: Optional[int], end_ms: Optional[int], session_id: Optional[str],
+                after: Optional[Key], filters: Optional[Dict[str, str]]) -> List[Tuple[Key, Tuple]]:
+        \"""Record filtrati in ordine (ts, id); metadata confrontati come testo, come con l'affinità TEXT SQLite\"""
+        paths = [(metadata_path(key)[2:].split('.'), value) for key, value in (filters or {}).items()]
+        with self._lock:
+            selected = sorted(
+                ((record[4], record[0]), record) for record in self._records.values()
+                if (start_ms is None or record[4] >= start_ms)
+                and (end_ms is None or record[4] < end_ms)
+                and (session_id is None or record[3] == session_id)
+                and (after is None or (record[4], record[0]) > after)
+                and all(self._metadata_text(record[7], path) == value for path, value in paths)
+            )
+        return selected
+
+    @classmethod
+    def _metadata_text(cls, metadata: Optional[str], path: List[str]) -> Optional[str]:
+        value = cls._metadata_value(metadata, path)
+        return None if value is None else str(value)
+
+    def version(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._changes, self._changed_at
+
+    def changes(self, after_id: int, session_id: Optional[str] = None,
+                limit: int = 500) -> List[Tuple[int, Dict]]:
+        with self._lock:
+            selected = heapq.nsmallest(limit, (
+                record for record in self._records.values()
+                if record[0] > after_id and (session_id is None or record[3] == session_id)
+            ))
+        return [(record[0], self._serialize(record)) for record in selected]
+
+    def health(self) -> Dict:
+        with self._lock:
+            return {'memory': {'rows': len(self._records), 'days': len(self._daily)}}
+
+
+# ============================================================================
+# FACTORY
+# ============================================================================
+
+BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage,
+}
+
+
+def create_storage(name: Optional[str] = None) -> FeedbackStorage:
+    \"""Backend per nome (default FEEDBACK_STORAGE, poi 'sqlite')\"""
+    name = name or os.getenv('FEEDBACK_STORAGE', 'sqlite')
+    if name not in BACKENDS:
+        raise ValueError(
+            f'Unknown storage backend "{name}". '
+            f'Available: {", ".join(sorted(BACKENDS))}'
+        )
+    return BACKENDS[name]()
+"""
+
+
+# ============================================================================
+# TEST FIXTURES: conftest.py (storage e righe condivisi dai moduli di test)
+# ============================================================================
+
+FEEDBACK_CONFTEST = """
+\"""
+Fixture condivise dai moduli di test del backend
+storage su un database nuovo per ogni test e row() nel formato di
+feedback_storage.Row
+\"""
+
+import json
+
+import pytest
+
+import feedback_db
+import feedback_storage
+from feedback_db import ConnectionPool, encode_timestamp
+from feedback_storage import BACKENDS, FeedbackStorage, create_storage
+
+BASE = encode_timestamp('2026-01-31T22:00:00Z')
+HOUR = 3600000
+
+
+def open_storage(name, tmp_path, monkeypatch) -> FeedbackStorage:
+    \"""Backend inizializzato; SQLite su tmp_path/feedback.db con pool dedicato e cache partizioni azzerata\"""
+    if name == 'sqlite':
+        pool = ConnectionPool(str(tmp_path / 'feedback.db'), 'balanced', 4, 5.0)
+        monkeypatch.setattr(feedback_db, 'pool', pool)
+        monkeypatch.setattr(feedback_storage, 'pool', pool)
+        feedback_db.router.invalidate()
+
+    backend = create_storage(name)
+    backend.init()
+    return backend
+
+
+def close_storage(name) -> None:
+    if name == 'sqlite':
+        feedback_db.pool.close_all()
+        feedback_db.router.invalidate()
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def storage(request, tmp_path, monkeypatch):
+    \"""Un test per ogni backend registrato in feedback_storage.BACKENDS\"""
+    yield open_storage(request.param, tmp_path, monkeypatch)
+    close_storage(request.param)
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path, monkeypatch):
+    \"""Solo SQLite: partizioni, migrazioni e pool\"""
+    yield open_storage('sqlite', tmp_path, monkeypatch)
+    close_storage('sqlite')
+
+
+def row(message_id, vote='positive', session_id='s1', ts=BASE, metadata=None):
+    \"""Riga in scrittura; ts in ms epoch o ISO 8601\"""
+    if isinstance(ts, str):
+        ts = encode_timestamp(ts)
+    return (message_id, vote, session_id, ts, 'pytest', '127.0.0.1', json.dumps(metadata or {}))
+"""
+
+
+# ============================================================================
+# STORAGE TESTS: test_feedback_storage.py (conformance + benchmark)
+# ============================================================================
+
+FEEDBACK_STORAGE_TESTS = """
+\"""
+Conformance e benchmark dei backend di storage feedback
+Ogni test gira su tutti i backend registrati in feedback_storage.BACKENDS
+
+Avvio:
+    pytest test_feedback_storage.py
+    FEEDBACK_BENCH=1 pytest test_feedback_storage.py -s -k bench
+\"""
+
+import os
+import time
+
+import pytest
+
+import feedback_db
+import feedback_storage
+from conftest import BASE, HOUR, row
+from feedback_db import encode_timestamp
+
+bench = pytest.mark.skipif(not os.getenv('FEEDBACK_BENCH'), reason='FEEDBACK_BENCH non impostata')
+
+
+# ============================================================================
+# CONFORMANCE
+# ============================================================================
+
+def test_upsert_and_get(storage):
+    storage.upsert(row('m1', metadata={'prompt': 'p1'}))
+
+    assert storage.get('m1') == {
+        'messageId': 'm1',
+        'feedbackType': 'positive',
+        'sessionId': 's1',
+        'timestamp': '2026-01-31T22:00:00.000Z',
+        'metadata': {'prompt': 'p1'}
+    }
+    assert storage.get('missing') is None
+
+
+def test_ids_are_unique_and_increasing(storage):
+    first = storage.upsert(row('m1'))
+    second = storage.upsert_many([row('m2'), row('m3')])
+
+    assert len(second) == 2
+    assert first < second[0] < second[1]
+
+
+def test_upsert_many_last_write_wins(storage):
+    ids = storage.upsert_many([row('m1', 'positive'), row('m2'), row('m1', 'negative')])
+
+    assert len(ids) == 2
+    assert storage.get('m1')['feedbackType'] == 'negative'
+    assert storage.stats(BASE - HOUR) == {'total': 2, 'positive': 1, 'negative': 1}
+
+
+def test_revote_moves_counters(storage):
+    storage.upsert(row('m1', 'positive'))
+    storage.upsert(row('m1', 'negative'))
+
+    assert storage.stats(BASE - HOUR) == {'total': 1, 'positive': 0, 'negative': 1}
+    assert storage.stats(BASE - HOUR, 's1') == {'total': 1, 'positive': 0, 'negative': 1}
+
+
+def test_revote_in_another_month(storage):
+    storage.upsert(row('m1', 'positive', ts=BASE))
+    storage.upsert(row('m1', 'negative', ts=BASE + 4 * HOUR))
+
+    assert storage.get('m1')['timestamp'] == '2026-02-01T02:00:00.000Z'
+    assert storage.stats(BASE - HOUR) == {'total': 1, 'positive': 0, 'negative': 1}
+    assert [key[0] for key, _ in storage.iterate()] == [BASE + 4 * HOUR]
+
+
+def test_version_advances_on_writes_only(storage):
+    before = storage.version()
+    storage.get('m1')
+    storage.stats(BASE - HOUR)
+    assert storage.version() == before
+
+    storage.upsert(row('m1'))
+    after = storage.version()
+    assert after[0] > before[0] and after[1] >= before[1]
+
+    storage.upsert_many([row('m2'), row('m1', 'negative')])
+    assert storage.version()[0] > after[0]
+
+
+def test_changes_feed(storage):
+    storage.upsert_many([
+        row('m1', ts=BASE),
+        row('m2', ts=BASE + 4 * HOUR, session_id='s2'),
+        row('m3', ts=BASE - 3 * HOUR),
+    ])
+    first = storage.changes(0)
+    assert [feedback['messageId'] for _, feedback in first] == ['m1', 'm2', 'm3']
+    cursor = first[-1][0]
+    assert storage.changes(cursor) == []
+
+    # Cambio voto in un altro mese: ricompare dopo il cursore, con la nuova versione
+    storage.upsert(row('m1', 'negative', ts=BASE + 5 * HOUR))
+    storage.upsert(row('m4', session_id='s2'))
+    changed = storage.changes(cursor)
+    assert [(f['messageId'], f['feedbackType']) for _, f in changed] == [('m1', 'negative'), ('m4', 'positive')]
+    assert [f['messageId'] for _, f in storage.changes(0)] == ['m2', 'm3', 'm1', 'm4']
+
+    # Paginazione e filtro sessione
+    page = storage.changes(0, limit=2)
+    assert [f['messageId'] for _, f in page] == ['m2', 'm3']
+    assert [f['messageId'] for _, f in storage.changes(page[-1][0], limit=2)] == ['m1', 'm4']
+    assert [f['messageId'] for _, f in storage.changes(0, 's2')] == ['m2', 'm4']
+
+
+def test_get_many(storage):
+    storage.upsert_many([row('m1'), row('m2', 'negative')])
+
+    found = storage.get_many(['m1', 'm2', 'missing'])
+
+    assert set(found) == {'m1', 'm2'}
+    assert found['m2']['feedbackType'] == 'negative'
+
+
+def test_stats_window_is_exact_on_partial_day(storage):
+    start = BASE - 2 * HOUR
+    storage.upsert_many([
+        row('before', ts=start - 1),
+        row('at-start', 'negative', ts=start),
+        row('same-day', ts=start + HOUR),
+        row('next-day', 'negative', ts=BASE + 3 * HOUR),
+        row('later', ts=BASE + 72 * HOUR, session_id='s2'),
+    ])
+
+    assert storage.stats(start) == {'total': 4, 'positive': 2, 'negative': 2}
+    assert storage.stats(start, 's1') == {'total': 3, 'positive': 1, 'negative': 2}
+    assert storage.stats(start, 's2') == {'total': 1, 'positive': 1, 'negative': 0}
+    assert storage.stats(start, 'unknown') == {'total': 0, 'positive': 0, 'negative': 0}
+
+
+def test_stats_from_midnight(storage):
+    midnight = BASE + 2 * HOUR
+    storage.upsert_many([
+        row('before', ts=midnight - 1),
+        row('at-midnight', 'negative', ts=midnight),
+        row('next-day', ts=midnight + 30 * HOUR, session_id='s2'),
+    ])
+
+    assert storage.stats(midnight) == {'total': 2, 'positive': 1, 'negative': 1}
+    assert storage.stats(midnight, 's1') == {'total': 1, 'positive': 0, 'negative': 1}
+
+
+def test_buckets(storage):
+    storage.upsert_many([
+        row('a', ts=BASE - 3 * HOUR, session_id='s1'),
+        row('b', 'negative', ts=BASE + 10, session_id='s1'),
+        row('c', ts=BASE + HOUR // 2, session_id='s2'),
+        row('d', 'negative', ts=BASE + 3 * HOUR, session_id='s1'),
+    ])
+    day = encode_timestamp('2026-01-31T00:00:00Z')
+
+    assert storage.buckets('hour', BASE) == {
+        BASE: (2, 1, 1),
+        BASE + 3 * HOUR: (1, 0, 1),
+    }
+    assert storage.buckets('hour', BASE - 3 * HOUR, 's1') == {
+        BASE - 3 * HOUR: (1, 1, 0),
+        BASE: (1, 0, 1),
+        BASE + 3 * HOUR: (1, 0, 1),
+    }
+    assert storage.buckets('day', day) == {day: (3, 2, 1), day + 24 * HOUR: (1, 0, 1)}
+    assert storage.buckets('day', day + 24 * HOUR, 's1') == {day + 24 * HOUR: (1, 0, 1)}
+
+
+def test_distinct_is_approximate_within_error(storage):
+    rows = [
+        row(f'm{i}', session_id=f's{i % 300}', ts=BASE - (i % 48) * HOUR)
+        for i in range(3000)
+    ]
+    storage.upsert_many(rows)
+    # Rivoti: non aumentano i distinti
+    storage.upsert_many(rows[:500])
+
+    distinct = storage.distinct(BASE - 47 * HOUR)
+
+    tolerance = 4 * distinct['relativeError']
+    assert abs(distinct['messages'] - 3000) <= 3000 * tolerance
+    assert abs(distinct['sessions'] - 300) <= 300 * tolerance
+    assert storage.distinct(BASE + 48 * HOUR) == {
+        'sessions': 0, 'messages': 0, 'relativeError': distinct['relativeError']
+    }
+
+
+def vote_totals(storage, key, start_ms):
+    totals = {}
+    for value, positive, negative in storage.vote_groups(key, start_ms):
+        counts = totals.setdefault(value, [0, 0])
+        counts[0] += positive
+        counts[1] += negative
+    return {value: tuple(counts) for value, counts in totals.items()}
+
+
+def test_vote_groups_by_metadata_key(storage, monkeypatch):
+    start = BASE - 2 * HOUR
+    storage.upsert_many([
+        row('before', 'negative', ts=start - 1, metadata={'prompt': 'p1'}),
+        row('a', 'negative', ts=start, metadata={'prompt': 'p1', 'ctx': {'model': 'x'}}),
+        row('b', ts=start + HOUR, metadata={'prompt': 'p1'}),
+        row('c', 'negative', ts=BASE + 3 * HOUR, metadata={'prompt': 'p2', 'ctx': {'model': 'x'}}),
+        row('d', ts=BASE + 72 * HOUR, metadata={'prompt': 2, 'flag': True}),
+        row('e', ts=BASE + 72 * HOUR),
+    ])
+    # Cambio voto: sposta il conteggio, non lo duplica
+    storage.upsert(row('b', 'negative', ts=start + HOUR, metadata={'prompt': 'p1'}))
+
+    expected = {'p1': (0, 2), 'p2': (0, 1), 2: (1, 0)}
+    assert vote_totals(storage, 'prompt', start) == expected
+    assert vote_totals(storage, 'ctx.model', start) == {'x': (0, 2)}
+    assert vote_totals(storage, 'flag', start) == {1: (1, 0)}
+    assert vote_totals(storage, 'missing', start) == {}
+    with pytest.raises(ValueError):
+        storage.vote_groups("x') OR 1=1 --", start)
+
+    if storage.name == 'sqlite':
+        # Chiave materializzata: stessi risultati da feedback_top_daily
+        monkeypatch.setattr(feedback_db, 'TOP_KEYS', ['prompt'])
+        with feedback_db.get_db_connection() as conn:
+            assert feedback_db.sync_top_keys(conn)
+        assert vote_totals(storage, 'prompt', start) == expected
+
+        storage.upsert(row('c', ts=BASE + 3 * HOUR, metadata={'prompt': 'p3'}))
+        assert vote_totals(storage, 'prompt', start) == {'p1': (0, 2), 'p3': (1, 0), 2: (1, 0)}
+
+
+def test_metadata_filters(storage, monkeypatch):
+    monkeypatch.setattr(feedback_db, 'INDEXED_KEYS', ['model', 'ctx.locale'])
+    if storage.name == 'sqlite':
+        # Partizione già creata da init: colonne aggiunte con ALTER TABLE
+        with feedback_db.get_db_connection() as conn:
+            assert feedback_db.sync_indexed_keys(conn)
+
+    storage.upsert_many([
+        row('a', ts=BASE - HOUR, metadata={'model': 'm1', 'ctx': {'locale': 'it'}}),
+        row('b', 'negative', ts=BASE + HOUR, metadata={'model': 'm1'}),
+        row('c', 'negative', ts=BASE + 2 * HOUR, metadata={'model': 'm2', 'ctx': {'locale': 'it'}}),
+        row('d', ts=BASE + 3 * HOUR, session_id='s2', metadata={'model': 5}),
+        row('e', ts=BASE + 3 * HOUR),
+    ])
+    start = BASE - 2 * HOUR
+
+    assert storage.stats(start, filters={'model': 'm1'}) == {'total': 2, 'positive': 1, 'negative': 1}
+    assert storage.stats(BASE, filters={'model': 'm1'}) == {'total': 1, 'positive': 0, 'negative': 1}
+    assert storage.stats(start, 's2', {'model': '5'}) == {'total': 1, 'positive': 1, 'negative': 0}
+    assert storage.stats(start, filters={'model': 'm1', 'ctx.locale': 'it'}) == {'total': 1, 'positive': 1, 'negative': 0}
+    assert storage.stats(start, filters={'model': 'missing'}) == {'total': 0, 'positive': 0, 'negative': 0}
+    assert [f['messageId'] for _, f in storage.iterate(filters={'ctx.locale': 'it'}, page_size=1)] == ['a', 'c']
+
+    if storage.name == 'sqlite':
+        with pytest.raises(ValueError):
+            storage.stats(start, filters={'other': 'x'})
+
+        with feedback_db.get_db_connection() as conn:
+            table = feedback_db.partition_table('2026-02')
+            plan = ' '.join(row[3] for row in conn.execute(
+                f'EXPLAIN QUERY PLAN SELECT COUNT(*) FROM {table} WHERE "meta.model" = ? AND ts >= ?', ('m1', start)
+            ))
+            assert 'meta.model' in plan
+
+            # Chiave rimossa dalla configurazione: indice e colonna eliminati
+            monkeypatch.setattr(feedback_db, 'INDEXED_KEYS', ['model'])
+            assert feedback_db.sync_indexed_keys(conn)
+            assert not feedback_db.sync_indexed_keys(conn)
+            for table in feedback_db.router.tables(conn):
+                columns = {row[1] for row in conn.execute(f'PRAGMA table_xinfo({table})')}
+                assert 'meta.model' in columns and 'meta.ctx.locale' not in columns
+
+        assert storage.stats(start, filters={'model': 'm1'})['total'] == 2
+
+
+def test_iterate_order_and_keyset(storage):
+    # Ordine di scrittura diverso dall'ordine per ts, a cavallo di due mesi
+    timestamps = [BASE + offset * HOUR for offset in (5, -3, 0, 1, 7, 2)]
+    storage.upsert_many([row(f'm{i}', ts=ts) for i, ts in enumerate(timestamps)])
+
+    keys = [key for key, _ in storage.iterate(page_size=2)]
+    assert [key[0] for key in keys] == sorted(timestamps)
+
+    resumed = [key for key, _ in storage.iterate(after=keys[2], page_size=2)]
+    assert resumed == keys[3:]
+
+
+def test_iterate_filters(storage):
+    storage.upsert_many([
+        row('a', ts=BASE, session_id='s1'),
+        row('b', ts=BASE + HOUR, session_id='s2'),
+        row('c', ts=BASE + 3 * HOUR, session_id='s1'),
+        row('d', ts=BASE + 5 * HOUR, session_id='s1'),
+    ])
+
+    window = [f['messageId'] for _, f in storage.iterate(start_ms=BASE + HOUR, end_ms=BASE + 5 * HOUR)]
+    assert window == ['b', 'c']
+
+    session = [f['messageId'] for _, f in storage.iterate(session_id='s1', page_size=1)]
+    assert session == ['a', 'c', 'd']
+
+
+def test_health(storage):
+    assert isinstance(storage.health(), dict)
+
+
+def test_pool_timeout_is_a_storage_error(storage, monkeypatch):
+    if storage.name != 'sqlite':
+        pytest.skip('solo SQLite usa il pool')
+
+    def exhausted():
+        raise feedback_db.PoolTimeout('pool exhausted')
+
+    monkeypatch.setattr(feedback_storage, 'get_db_connection', exhausted)
+    with pytest.raises(feedback_storage.StorageError, match='pool exhausted'):
+        storage.upsert_many([row('m1')])
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def timed(label, storage, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{storage.name:>8} {label:<24} {count / elapsed:>12,.0f} op/s  ({elapsed * 1000:.1f} ms)')
+
+
+@bench
+def test_bench(storage):
+    total = int(os.getenv('FEEDBACK_BENCH_ROWS', 20000))
+    rows = [
+        row(f'msg_{i}', 'positive' if i % 3 else 'negative', f'session_{i % 100}', BASE - i * 60000)
+        for i in range(total)
+    ]
+    ids = [r[0] for r in rows]
+
+    def upsert_chunks():
+        for offset in range(0, total, 250):
+            storage.upsert_many(rows[offset:offset + 250])
+
+    def single_gets():
+        for message_id in ids[:2000]:
+            storage.get(message_id)
+
+    def multi_gets():
+        for offset in range(0, total, 500):
+            storage.get_many(ids[offset:offset + 500])
+
+    def stats():
+        for days in range(1, 101):
+            storage.stats(BASE - days * 86400000)
+
+    timed('upsert_many (250)', storage, total, upsert_chunks)
+    timed('upsert (single)', storage, 500, lambda: [storage.upsert(r) for r in rows[:500]])
+    timed('get', storage, 2000, single_gets)
+    timed('get_many (500)', storage, total, multi_gets)
+    timed('stats', storage, 100, stats)
+    timed('iterate', storage, total, lambda: sum(1 for _ in storage.iterate()))
+"""
+
+
+# ============================================================================
+# INGEST TESTS: test_feedback_ingest.py (coda write-behind + log append-only)
+# ============================================================================
+
+FEEDBACK_INGEST_TESTS = """
+\"""
+Test delle modalità di ingestion asincrone: group commit della coda
+write-behind, compaction e recovery del log append-only
+
+Avvio:
+    pytest test_feedback_ingest.py
+\"""
+
+import os
+import time
+
+import pytest
+
+from conftest import row
+from feedback_ingest import WriteBehindQueue
+from feedback_log import AppendOnlyLog, encode_record, read_segment, segment_name
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+
+
+def stored(storage, message_ids):
+    return sorted(storage.get_many(list(message_ids)))
+
+
+# ============================================================================
+# WRITE-BEHIND QUEUE
+# ============================================================================
+
+def test_queue_group_commit_last_write_wins(storage):
+    committed = []
+    queue = WriteBehindQueue(storage, max_batch=100, max_delay=0.01, on_commit=committed.extend)
+    for r in (row('m1'), row('m2'), row('m1', 'negative')):
+        assert queue.submit(r)
+    queue.start()
+    queue.stop()
+
+    assert storage.get('m1')['feedbackType'] == 'negative'
+    assert len(committed) == 3
+    assert queue.stats()['committed'] == 3 and queue.stats()['batches'] == 1
+
+
+def test_queue_failed_group_drops_only_bad_row(storage):
+    committed = []
+    queue = WriteBehindQueue(storage, max_batch=100, max_delay=0.01, on_commit=committed.extend)
+    good = [f'm{i}' for i in range(11)]
+    rows = [row(m) for m in good[:5]] + [row(['bad'])] + [row(m) for m in good[5:]]
+    for r in rows:
+        assert queue.submit(r)
+    queue.start()
+    queue.stop()
+
+    # Il gruppo fallisce per la riga con messageId non stringa: le altre 11 arrivano
+    assert stored(storage, good) == sorted(good)
+    assert queue.stats()['committed'] == 11 and queue.stats()['failed'] == 1
+    assert sorted(r[0] for r in committed) == sorted(good)
+
+
+def test_queue_survives_failing_on_commit(storage):
+    calls = []
+
+    def on_commit(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise RuntimeError('subscriber gone')
+
+    queue = WriteBehindQueue(storage, max_batch=100, max_delay=0.01, on_commit=on_commit)
+    queue.start()
+    assert queue.submit(row('m1'))
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Il writer è ancora vivo dopo l'errore del callback
+    assert queue.submit(row('m2'))
+    queue.stop()
+    assert stored(storage, ['m1', 'm2']) == ['m1', 'm2']
+    assert len(calls) == 2
+
+
+# ============================================================================
+# APPEND-ONLY LOG
+# ============================================================================
+
+def dead_process_dir(directory, *records):
+    \"""Directory di un processo terminato (lock libero) con un segmento di records\"""
+    path = directory / '99999'
+    path.mkdir(parents=True)
+    (path / 'lock').touch()
+    (path / segment_name(1)).write_bytes(b''.join(records))
+    return path
+
+
+def test_log_compaction_last_write_wins(storage, tmp_path):
+    log = AppendOnlyLog(storage, str(tmp_path / 'log'), max_delay=0.01)
+    log.start()
+    assert log.append([row('m1'), row('m2')])
+    assert log.append([row('m1', 'negative')])
+    log.stop()
+
+    # flush_on_shutdown: tutto riversato, la directory del processo rimossa
+    assert storage.get('m1')['feedbackType'] == 'negative'
+    assert stored(storage, ['m1', 'm2']) == ['m1', 'm2']
+    stats = log.stats()
+    assert stats['compactedRows'] == 3 and stats['writtenRows'] == 2
+    assert not os.path.exists(log.path)
+
+
+def test_log_recovery_survives_failing_on_commit(storage, tmp_path):
+    def on_commit(batch):
+        raise RuntimeError('subscriber gone')
+
+    dead_process_dir(tmp_path / 'log', encode_record([row('m1')]))
+
+    # Recovery all'avvio e compaction: righe scritte, errore del callback solo loggato
+    log = AppendOnlyLog(storage, str(tmp_path / 'log'), max_delay=0.01, on_commit=on_commit)
+    log.start()
+    assert log.append([row('m2')])
+    log.stop()
+    assert stored(storage, ['m1', 'm2']) == ['m1', 'm2']
+    assert log.stats()['failedRows'] == 0
+
+
+def test_log_recovery_ignores_truncated_tail(storage, tmp_path):
+    # Crash a metà scrittura: l'ultimo record è troncato
+    partial = encode_record([row('m3')])[:-4]
+    path = dead_process_dir(tmp_path / 'log', encode_record([row('m1')]), encode_record([row('m2')]), partial)
+
+    log = AppendOnlyLog(storage, str(tmp_path / 'log'))
+    log.start()
+    log.stop()
+
+    assert stored(storage, ['m1', 'm2', 'm3']) == ['m1', 'm2']
+    assert log.stats()['recoveredRows'] == 2 and log.stats()['corruptSegments'] == 1
+    assert not path.exists()
+
+
+def test_log_recovery_quarantines_only_bad_rows(storage, tmp_path, monkeypatch):
+    upsert_many = storage.upsert_many
+
+    def failing_upsert(rows):
+        if any(r[0] == 'poison' for r in rows):
+            raise RuntimeError('constraint failed')
+        return upsert_many(rows)
+
+    monkeypatch.setattr(storage, 'upsert_many', failing_upsert)
+    good = [f'm{i}' for i in range(10)]
+    records = [encode_record([row(m)]) for m in good[:5]]
+    records += [encode_record([row(['bad']), row('poison')])]
+    records += [encode_record([row(m)]) for m in good[5:]]
+    path = dead_process_dir(tmp_path / 'log', *records)
+
+    # La recovery non solleva e non blocca l'avvio: scarta solo le due righe
+    log = AppendOnlyLog(storage, str(tmp_path / 'log'), max_batch=4)
+    log.start()
+    log.stop()
+
+    assert stored(storage, good) == sorted(good)
+    assert log.stats()['failedRows'] == 2 and log.stats()['writtenRows'] == 10
+    quarantined, intact = read_segment(str(path / segment_name(1)) + '.failed')
+    assert intact and sorted(r[0] for r in quarantined if isinstance(r[0], str)) == ['poison']
+    assert len(quarantined) == 2
+    # La directory resta per l'analisi del file .failed
+    assert path.exists()
+"""
+
+
+# ============================================================================
+# STREAM TESTS: test_feedback_stream.py (broadcaster SSE)
+# ============================================================================
+
+FEEDBACK_STREAM_TESTS = """
+\"""
+Test del broadcaster SSE: buffer limitato per subscriber, evento
+dropped per i client lenti, contatori aggiornati in memoria
+
+Avvio:
+    pytest test_feedback_stream.py
+\"""
+
+import json
+
+from conftest import row
+from feedback_db import now_ms
+from feedback_stream import Broadcaster
+
+
+class Counters:
+    \"""storage.stats finto: conta le query\"""
+
+    def __init__(self, total=0, positive=0, negative=0):
+        self.totals = {'total': total, 'positive': positive, 'negative': negative}
+        self.calls = 0
+
+    def __call__(self, day_start):
+        self.calls += 1
+        return dict(self.totals)
+
+
+def counters_of(event):
+    return json.loads(event.split(b'data: ', 1)[1])
+
+
+def test_stream_drops_oldest_per_subscriber():
+    counters = Counters()
+    broadcaster = Broadcaster(buffer_size=3, max_subscribers=2, counters=counters)
+    slow = broadcaster.subscribe()
+    other = broadcaster.subscribe('s2')
+    assert broadcaster.subscribe() is None
+    assert slow.drain()[0].startswith(b'event: counters')
+    other.drain()
+
+    broadcaster.publish([row(f'm{i}', ts=now_ms()) for i in range(5)])
+
+    # 5 feedback + counters in un buffer da 3: restano i più recenti
+    events = slow.drain()
+    assert events[0] == b'event: dropped\\ndata: {"count":3}\\n\\n'
+    assert b'"messageId":"m3"' in events[1] and b'"messageId":"m4"' in events[2]
+    assert b'"delta":{"total":5,"positive":5,"negative":0}' in events[3]
+    assert other.drain() == [events[3]]
+
+    broadcaster.unsubscribe(slow)
+    assert slow.closed
+    assert broadcaster.stats()['subscribers'] == 1 and broadcaster.stats()['dropped'] == 3
+    # Totali letti una sola volta, alla prima sottoscrizione
+    assert counters.calls == 1
+
+
+def test_counters_track_revotes_without_queries():
+    counters = Counters(total=10, positive=6, negative=4)
+    broadcaster = Broadcaster(counters=counters)
+    subscription = broadcaster.subscribe()
+    assert counters_of(subscription.drain()[0])['total'] == 10
+
+    broadcaster.publish([row('m1', ts=now_ms())])
+    broadcaster.publish([row('m1', 'negative', ts=now_ms())])
+    # Voto di un altro giorno: nessun cambio dei contatori di oggi
+    broadcaster.publish([row('m2', ts=now_ms() - 2 * 86400000)])
+
+    events = [counters_of(e) for e in subscription.drain() if e.startswith(b'event: counters')]
+    assert [e['delta'] for e in events] == [
+        {'total': 1, 'positive': 1, 'negative': 0},
+        {'total': 0, 'positive': -1, 'negative': 1},
+    ]
+    assert (events[-1]['total'], events[-1]['positive'], events[-1]['negative']) == (11, 6, 5)
+    assert counters.calls == 1
+
+
+def test_refresh_realigns_with_storage():
+    counters = Counters(total=1, positive=1)
+    broadcaster = Broadcaster(counters=counters, resync=0)
+    subscription = broadcaster.subscribe()
+    subscription.drain()
+
+    # Scritture di altri worker: visibili solo dal database
+    counters.totals.update(total=3, positive=2, negative=1)
+    broadcaster.refresh()
+    event = counters_of(subscription.drain()[0])
+    assert event['total'] == 3 and event['delta'] == {'total': 2, 'positive': 1, 'negative': 1}
+    assert broadcaster.stats()['refreshes'] == 2
+"""
+
+
+# ============================================================================
+# METRICS TESTS: test_feedback_metrics.py (esposizione Prometheus)
+# ============================================================================
+
+FEEDBACK_METRICS_TESTS = """
+\"""
+Test delle metriche Prometheus: bucket cumulativi degli istogrammi,
+richieste in corso e gauge aggiuntivi
+
+Avvio:
+    pytest test_feedback_metrics.py
+\"""
+
+from feedback_metrics import Metrics
+
+
+def test_metrics_histogram_render():
+    metrics = Metrics(request_buckets=(0.01, 0.1))
+    for seconds in (0.005, 0.01, 0.05, 2.0):
+        metrics.observe_request('get_feedback', 'GET', 200, seconds)
+    metrics.request_started('get_feedback')
+
+    text = metrics.render({'feedback_stream_subscribers': ('gauge', 'Client SSE', 3)}).decode('utf-8')
+    labels = 'handler="get_feedback",method="GET",status="200"'
+    assert f'feedback_http_request_duration_seconds_bucket{{{labels},le="0.01"}} 2' in text
+    assert f'feedback_http_request_duration_seconds_bucket{{{labels},le="0.1"}} 3' in text
+    assert f'feedback_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4' in text
+    assert f'feedback_http_request_duration_seconds_count{{{labels}}} 4' in text
+    assert 'feedback_http_requests_in_flight{handler="get_feedback"} 1' in text
+    assert '# TYPE feedback_stream_subscribers gauge\\nfeedback_stream_subscribers 3' in text
+"""
+
+
+# ============================================================================
+# DB TESTS: test_feedback_db.py (retention, migrazioni, slow query log)
+# ============================================================================
+
+FEEDBACK_DB_TESTS = """
+\"""
+Test del layer SQLite: retention delle partizioni mensili, migrazione
+dello schema originale e slow query log delle connessioni strumentate
+
+Avvio:
+    pytest test_feedback_db.py
+\"""
+
+import sqlite3
+
+import pytest
+
+import feedback_db
+from conftest import close_storage, open_storage, row
+from feedback_db import encode_timestamp
+
+
+# ============================================================================
+# RETENTION
+# ============================================================================
+
+def test_expire_partitions_drops_old_months(sqlite_storage, monkeypatch):
+    sqlite_storage.upsert_many([
+        row('nov', ts='2025-11-15T10:00:00Z'),
+        row('dec', ts='2025-12-31T23:59:59Z'),
+        row('jan', ts='2026-01-01T00:00:00Z'),
+        row('feb', 'negative', ts='2026-02-10T08:00:00Z'),
+    ])
+    monkeypatch.setattr(feedback_db, 'current_month', lambda: '2026-02')
+    changes = sqlite_storage.version()[0]
+
+    # Mese corrente (febbraio) e il precedente
+    assert feedback_db.expire_partitions(2) == ['2025-11', '2025-12']
+    assert feedback_db.expire_partitions(2) == []
+    assert '2025-12' not in feedback_db.partition_months()
+    assert sorted(sqlite_storage.get_many(['nov', 'dec', 'jan', 'feb'])) == ['feb', 'jan']
+
+    # Rollup e sketch dei giorni eliminati rimossi insieme alle partizioni
+    totals = sqlite_storage.stats(encode_timestamp('2025-11-01T00:00:00Z'))
+    assert (totals['total'], totals['positive'], totals['negative']) == (2, 1, 1)
+    assert sqlite_storage.version()[0] > changes
+
+
+def test_revote_deletes_only_from_previous_partition(sqlite_storage, monkeypatch):
+    sqlite_storage.upsert_many([row('m1', ts='2025-11-15T10:00:00Z'), row('m2', ts='2025-12-01T00:00:00Z')])
+    statements = []
+    monkeypatch.setattr(feedback_db, '_observers', (lambda conn, op, sql, *_: statements.append(sql),))
+    sqlite_storage.upsert_many([row('m1', 'negative', ts='2026-01-10T00:00:00Z')])
+
+    deletes = [sql for sql in statements if sql.startswith('DELETE')]
+    assert deletes == ['DELETE FROM feedback_p202511 WHERE message_id = ?']
+    with feedback_db.get_db_connection() as conn:
+        assert feedback_db.message_months(conn, ['m1', 'm2']) == {'m1': '2026-01', 'm2': '2025-12'}
+
+    monkeypatch.setattr(feedback_db, 'current_month', lambda: '2026-01')
+    feedback_db.expire_partitions(1)
+    with feedback_db.get_db_connection() as conn:
+        assert feedback_db.message_months(conn, ['m1', 'm2']) == {'m1': '2026-01'}
+
+
+def test_expire_partitions_disabled(sqlite_storage):
+    sqlite_storage.upsert_many([row('old', ts='2020-01-01T00:00:00Z')])
+    assert feedback_db.expire_partitions(0) == []
+    assert sqlite_storage.get('old') is not None
+
+
+# ============================================================================
+# MIGRATIONS
+# ============================================================================
+
+# Schema originale: tabella unica, timestamp ISO, voto e user agent in chiaro
+LEGACY_SCHEMA = '''
+    CREATE TABLE feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id TEXT NOT NULL,
+        feedback_type TEXT NOT NULL,
+        session_id TEXT,
+        timestamp TEXT NOT NULL,
+        user_agent TEXT,
+        ip_address TEXT,
+        metadata TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(message_id)
+    )
+'''
+
+
+@pytest.fixture
+def legacy_storage(tmp_path, monkeypatch):
+    legacy = sqlite3.connect(str(tmp_path / 'feedback.db'))
+    legacy.execute(LEGACY_SCHEMA)
+    legacy.executemany(
+        'INSERT INTO feedback (id, message_id, feedback_type, session_id, timestamp, user_agent, '
+        'ip_address, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [
+            (3, 'a', 'positive', 's1', '2025-12-31T23:30:00+01:00', 'Mozilla/5.0', '10.0.0.1', '{"k": 1}'),
+            (7, 'b', 'negative', None, '2026-01-15T10:00:00Z', 'Mozilla/5.0', '::1', None),
+            (9, 'c', 'positive', 's1', 'not a date', None, None, '{}'),
+            # Valori liberi delle prime versioni: normalizzati o scartati
+            (10, 'e', ' Positive', None, '2026-01-16T10:00:00Z', None, None, None),
+            (11, 'f', '', None, '2026-01-16T11:00:00Z', None, None, None),
+        ]
+    )
+    legacy.commit()
+    legacy.close()
+
+    # init() applica le migrazioni
+    yield open_storage('sqlite', tmp_path, monkeypatch)
+    close_storage('sqlite')
+
+
+def test_legacy_database_migrates_to_current_schema(caplog, legacy_storage):
+    assert feedback_db.schema_version() == feedback_db.SCHEMA_VERSION
+    assert {'2025-12', '2026-01'} <= set(feedback_db.partition_months())
+
+    # Timestamp in UTC, voto e metadata decodificati; id originali mantenuti
+    assert legacy_storage.get('a') == {
+        'messageId': 'a', 'feedbackType': 'positive', 'sessionId': 's1',
+        'timestamp': '2025-12-31T22:30:00.000Z', 'metadata': {'k': 1},
+    }
+    assert legacy_storage.get('b')['metadata'] == {}
+    assert [feedback_id for feedback_id, _ in legacy_storage.changes(0)] == [3, 7, 9, 10]
+    assert legacy_storage.upsert(row('d', ts='2026-01-20T00:00:00Z')) > 11
+    assert legacy_storage.get('e')['feedbackType'] == 'positive'
+    assert legacy_storage.get('f') is None
+    assert any('skipped 1 legacy rows' in record.getMessage() for record in caplog.get_records('setup'))
+
+    # Timestamp non valido: vale created_at; i rollup vengono ricostruiti
+    assert legacy_storage.get('c')['timestamp'] is not None
+    totals = legacy_storage.stats(encode_timestamp('2025-12-01T00:00:00Z'))
+    assert (totals['total'], totals['positive'], totals['negative']) == (5, 4, 1)
+
+    # Seconda esecuzione: nessuna migrazione da applicare
+    with feedback_db.get_db_connection() as conn:
+        assert feedback_db.run_migrations(conn) == []
+        kind = conn.execute("SELECT type FROM sqlite_master WHERE name = 'feedback'").fetchone()[0]
+    assert kind == 'view'
+
+
+# ============================================================================
+# SLOW QUERY LOG
+# ============================================================================
+
+def test_slow_query_log_groups_shapes(tmp_path, monkeypatch):
+    slow = feedback_db.SlowQueryLog(threshold_ms=0)
+    monkeypatch.setattr(feedback_db, '_observers', (slow.observe,))
+    conn = sqlite3.connect(str(tmp_path / 'slow.db'), factory=feedback_db.InstrumentedConnection)
+    for table in ('feedback_p202601', 'feedback_p202602'):
+        conn.execute(f'CREATE TABLE {table} (id INTEGER PRIMARY KEY, message_id TEXT UNIQUE)')
+        conn.executemany(f'INSERT INTO {table} (message_id) VALUES (?)', [('a',), ('b',)])
+        conn.execute(f'SELECT id FROM {table}  WHERE message_id IN (?, ?)', ('a', 'b')).fetchall()
+    conn.execute('SELECT id FROM feedback_p202601 WHERE message_id IN (?)', ('a',)).fetchall()
+    conn.commit()
+    conn.close()
+
+    # Partizioni e liste IN diverse: una sola shape
+    top = {query['shape']: query for query in slow.top(10, 'count')}
+    select = top['SELECT id FROM feedback_p* WHERE message_id IN (...)']
+    assert select['count'] == 3 and select['slowCount'] == 3
+    assert any('message_id=?' in detail for detail in select['plan'])
+    assert top['COMMIT']['plan'] is None
+    assert slow.top(1, 'count')[0]['count'] == 3
+"""
+
+
+# ============================================================================
+# PROFILER TESTS: test_feedback_profiler.py (stack collassati)
+# ============================================================================
+
+FEEDBACK_PROFILER_TESTS = """
+\"""
+Test del profiler a campionamento: stack dei thread in richiesta
+scritti in formato collapsed per endpoint
+
+Avvio:
+    pytest test_feedback_profiler.py
+\"""
+
+import os
+import threading
+
+from feedback_profiler import SamplingProfiler
+
+
+def test_profiler_writes_collapsed_stacks(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), rate=1.0, interval=0.001, flush_interval=60)
+    inside, release = threading.Event(), threading.Event()
+
+    def handler():
+        profiler.begin('get_stats')
+        inside.set()
+        release.wait(5)
+        profiler.end()
+
+    worker = threading.Thread(target=handler)
+    worker.start()
+    inside.wait(5)
+    profiler._sample()
+    profiler._sample()
+    release.set()
+    worker.join()
+    profiler.stop()
+
+    # Radice a sinistra, frame della richiesta in cima
+    lines = (tmp_path / f'get_stats.{os.getpid()}.collapsed').read_text().splitlines()
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) >= 2
+    assert all('test_feedback_profiler.py:handler;' in line for line in lines)
+    assert profiler.stats()['active'] == 0
+"""
+
+
+# ============================================================================
+# TRACING TESTS: test_feedback_tracing.py (span ed export OTLP)
+# ============================================================================
+
+FEEDBACK_TRACING_TESTS = """
+\"""
+Test del tracing delle richieste: span annidati, statement SQL
+strumentati, traceparent W3C ed export OTLP/JSON
+
+Avvio:
+    pytest test_feedback_tracing.py
+\"""
+
+import json
+import sqlite3
+
+import feedback_db
+from feedback_tracing import Tracer, span
+
+
+def test_tracing_spans_and_otlp_export(tmp_path, monkeypatch):
+    tracer = Tracer(enabled=True, path=str(tmp_path / 'traces.jsonl'))
+    monkeypatch.setattr(feedback_db, '_observers', (tracer.observe_statement,))
+    conn = sqlite3.connect(str(tmp_path / 'trace.db'), factory=feedback_db.InstrumentedConnection)
+    conn.execute('CREATE TABLE feedback_p202601 (id INTEGER PRIMARY KEY, message_id TEXT)')
+    tracer.start()
+
+    trace = tracer.begin('POST /api/feedback', 'req-1', None, {'http.route': '/api/feedback'})
+    with span('validate'):
+        pass
+    conn.executemany('INSERT INTO feedback_p202601 (message_id) VALUES (?)', [('a',), ('b',)])
+    conn.commit()
+    tracer.end(trace, 201)
+
+    # Fuori dalla richiesta: nessuno span
+    conn.execute('SELECT 1')
+    assert [name for name, *_ in trace.spans] == ['validate', 'db.executemany', 'db.commit']
+
+    # Correlation ID esadecimale da 32 caratteri = trace id; traceparent W3C prevale
+    for request_id, traceparent in (('ab' * 16, None), (None, f'00-{"cd" * 16}-{"ef" * 8}-01')):
+        tracer.end(tracer.begin('GET /x', request_id, traceparent), 200)
+    assert tracer.recent(1, 'ab' * 16)['resourceSpans'][0]['scopeSpans'][0]['spans'][0]['traceId'] == 'ab' * 16
+    tracer.stop()
+    conn.close()
+
+    spans = tracer.recent(10, 'req-1')['resourceSpans'][0]['scopeSpans'][0]['spans']
+    root, children = spans[0], spans[1:]
+    assert root['kind'] == 2 and {'key': 'http.response.status_code', 'value': {'intValue': '201'}} in root['attributes']
+    assert all(child['parentSpanId'] == root['spanId'] and child['traceId'] == root['traceId'] for child in children)
+    assert {'key': 'db.batch_size', 'value': {'intValue': '2'}} in children[1]['attributes']
+    assert int(root['startTimeUnixNano']) <= int(children[0]['startTimeUnixNano'])
+
+    lines = (tmp_path / 'traces.jsonl').read_text().splitlines()
+    exported = [s for line in lines for s in json.loads(line)['resourceSpans'][0]['scopeSpans'][0]['spans']]
+    assert [s['traceId'] for s in exported if 'parentSpanId' not in s] == [root['traceId'], 'ab' * 16]
+    assert [s['parentSpanId'] for s in exported if s['traceId'] == 'cd' * 16] == ['ef' * 8]
+    assert tracer.stats()['exported'] == 3
+"""
+
+
+# ============================================================================
+# LOGGING TESTS: test_feedback_logging.py (handler non bloccante)
+# ============================================================================
+
+FEEDBACK_LOGGING_TESTS = """
+\"""
+Test del logging non bloccante: rate limit dei record identici,
+scarti a coda piena e correlation ID della richiesta
+
+Avvio:
+    pytest test_feedback_logging.py
+\"""
+
+import json
+import logging
+import queue
+
+from feedback_logging import JsonFormatter, NonBlockingHandler, RateLimiter
+from feedback_tracing import Tracer
+
+
+def test_log_handler_rate_limits_and_drops():
+    limiter = RateLimiter(burst=2, window=60)
+    handler = NonBlockingHandler(queue.Queue(maxsize=3), limiter)
+    logger = logging.getLogger('feedback_test_log')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        tracer = Tracer(enabled=True, sample_rate=0.0)
+        trace = tracer.begin('POST /api/feedback', 'req-7')
+        for _ in range(5):
+            logger.error('Error saving feedback: database is locked')
+        tracer.end(trace, 500)
+
+        # Finestra scaduta: il prossimo record identico riporta i soppressi
+        limiter.window = 0
+        logger.error('Error saving feedback: database is locked')
+        logger.error('Error saving feedback: disk I/O error')
+    finally:
+        logger.removeHandler(handler)
+
+    records = [handler.queue.get_nowait() for _ in range(3)]
+    assert (handler.enqueued, handler.dropped, limiter.suppressed) == (3, 1, 3)
+    assert [getattr(r, 'request_id', None) for r in records] == ['req-7', 'req-7', None]
+    entry = json.loads(JsonFormatter().format(records[2]))
+    assert entry['suppressed'] == 3 and entry['level'] == 'ERROR' and 'requestId' not in entry
+"""
+
+
+# ============================================================================
+# CACHE TESTS: test_feedback_cache.py (LRU + TTL e invalidazione)
+# ============================================================================
+
+FEEDBACK_CACHE_TESTS = """
+\"""
+Test della cache delle risposte: LRU + TTL, invalidazione dopo le
+scritture e put scartato se la lettura è superata da una scrittura
+
+Avvio:
+    pytest test_feedback_cache.py
+\"""
+
+import json
+
+import pytest
+
+import feedback_service
+from feedback_cache import ResponseCache
+from feedback_storage import create_storage
+
+
+@pytest.fixture
+def service(monkeypatch):
+    storage = create_storage('memory')
+    storage.init()
+    monkeypatch.setattr(feedback_service, 'storage', storage)
+    monkeypatch.setattr(feedback_service, 'response_cache', ResponseCache())
+    monkeypatch.setattr(feedback_service, 'ingest_queue', None)
+    monkeypatch.setattr(feedback_service, 'ingest_log', None)
+    return feedback_service
+
+
+def vote(service, message_id, feedback_type):
+    payload, status, _ = service.save_feedback(
+        {'messageId': message_id, 'feedbackType': feedback_type}, 'pytest', None)
+    assert status == 201, payload
+
+
+def cached_vote(service, message_id):
+    status, body = service.get_feedback(message_id)
+    return json.loads(body)['feedback']['feedbackType'] if status == 200 else status
+
+
+def test_lru_eviction_and_negative_ttl():
+    cache = ResponseCache(max_entries=2, ttl=30, negative_ttl=0)
+    cache.put('a', 200, b'a')
+    cache.put('b', 200, b'b')
+    assert cache.get('a') == (200, b'a')
+    cache.put('c', 200, b'c')
+
+    # 'b' è il meno usato di recente; il 404 con negative_ttl 0 scade subito
+    assert cache.get('b') is None and cache.get('c') == (200, b'c')
+    cache.put('missing', 404, b'')
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['evictions'], stats['expirations'], stats['hits']) == (2, 1, 2)
+
+
+def test_put_after_invalidation_is_discarded():
+    cache = ResponseCache()
+    generation = cache.generation()
+    cache.invalidate('m1')
+
+    # Lettura iniziata prima dell'invalidazione: il valore è superato
+    cache.put('m1', 200, b'old', generation)
+    assert cache.get('m1') is None and cache.stats()['stalePuts'] == 1
+
+    cache.put('m1', 200, b'new', cache.generation())
+    assert cache.get('m1') == (200, b'new')
+
+
+def test_write_invalidates_cached_responses(service):
+    assert cached_vote(service, 'm1') == 404
+    vote(service, 'm1', 'positive')
+    assert cached_vote(service, 'm1') == 'positive'
+    vote(service, 'm1', 'negative')
+    assert cached_vote(service, 'm1') == 'negative'
+    assert service.response_cache.stats()['invalidations'] == 2
+
+
+def test_read_racing_a_write_is_not_cached(service, monkeypatch):
+    vote(service, 'm1', 'positive')
+    get = service.storage.get
+
+    def get_then_write(message_id):
+        feedback = get(message_id)
+        vote(service, message_id, 'negative')
+        return feedback
+
+    # La lettura restituisce il valore precedente, ma non lo mette in cache
+    monkeypatch.setattr(service.storage, 'get', get_then_write)
+    assert cached_vote(service, 'm1') == 'positive'
+    monkeypatch.setattr(service.storage, 'get', get)
+    assert cached_vote(service, 'm1') == 'negative'
+
+
+def test_write_from_another_worker_flushes_cache(service, monkeypatch):
+    # Un'altra cache sullo stesso storage: le scritture passano dall'altro worker
+    cache = ResponseCache(version=lambda: service.storage.version()[0], version_interval=0)
+    monkeypatch.setattr(service, 'response_cache', cache)
+    vote(service, 'm1', 'positive')
+    assert cached_vote(service, 'm1') == 'positive'
+
+    monkeypatch.setattr(service, 'response_cache', ResponseCache())
+    vote(service, 'm1', 'negative')
+    monkeypatch.setattr(service, 'response_cache', cache)
+    assert cached_vote(service, 'm1') == 'negative'
+    assert cache.stats()['versionFlushes'] == 1
+"""
+
+
+# ============================================================================
+# INGESTION QUEUE: feedback_ingest.py (write-behind + group commit)
+# ============================================================================
+
+FEEDBACK_INGEST_QUEUE = """
+\"""
+Ingestion write-behind per feedback API
+Le richieste accodano i voti validati, un writer thread li committa in gruppo
+\"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from queue import Queue, Empty, Full
+from typing import Callable, Dict, List, Optional, Tuple
+
+from feedback_storage import FeedbackStorage
+
+logger = logging.getLogger(__name__)
+
+
+def notify_commit(on_commit: Optional[Callable[[List[Tuple]], None]], batch: List[Tuple]) -> None:
+    \"""Chiama on_commit dopo un commit: un errore viene loggato, il thread writer non muore\"""
+    if on_commit is None:
+        return
+    try:
+        on_commit(batch)
+    except Exception as e:
+        logger.error(f'on_commit failed for {len(batch)} committed rows: {str(e)}')
+
+
+class WriteBehindQueue:
+    \"""
+    Coda limitata + writer thread con group commit.
+
+    Un gruppo viene committato quando raggiunge max_batch elementi oppure
+    quando sono passati max_delay secondi dal primo elemento del gruppo:
+    un solo fsync copre tutti i voti del gruppo.
+    \"""
+
+    def __init__(self, storage: FeedbackStorage, max_size: int = 10000, max_batch: int = 500,
+                 max_delay: float = 0.05, flush_on_shutdown: bool = True,
+                 max_retries: int = 3,
+                 on_commit: Optional[Callable[[List[Tuple]], None]] = None):
+        self.storage = storage
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.flush_on_shutdown = flush_on_shutdown
+        self.max_retries = max_retries
+        # Chiamato con le righe committate (invalidazione cache, stream SSE)
+        self.on_commit = on_commit
+
+        self._queue: Queue = Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self._enqueued = 0
+        self._rejected = 0
+        self._committed = 0
+        self._failed = 0
+        self._batches = 0
+        self._peak_depth = 0
+        self._commit_time = 0.0
+        self._last_commit_ms = 0.0
+        self._max_commit_ms = 0.0
+
+    @classmethod
+    def from_env(cls, storage: FeedbackStorage,
+                 on_commit: Optional[Callable[[List[Tuple]], None]] = None) -> 'WriteBehindQueue':
+        \"""Crea coda da variabili d'ambiente FEEDBACK_QUEUE_*\"""
+        return cls(
+            storage,
+            max_size=int(os.getenv('FEEDBACK_QUEUE_MAX_SIZE', 10000)),
+            max_batch=int(os.getenv('FEEDBACK_QUEUE_MAX_BATCH', 500)),
+            max_delay=int(os.getenv('FEEDBACK_QUEUE_MAX_DELAY_MS', 50)) / 1000,
+            flush_on_shutdown=os.getenv('FEEDBACK_QUEUE_FLUSH_ON_SHUTDOWN', 'true').lower() == 'true',
+            on_commit=on_commit,
+        )
+
+    def start(self) -> None:
+        \"""Avvia writer thread e registra flush allo shutdown\"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feedback-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, row: Tuple) -> bool:
+        \"""Accoda riga; False se la coda è piena (backpressure verso il client)\"""
+        try:
+            self._queue.put_nowait(row)
+        except Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+        with self._lock:
+            self._enqueued += 1
+            self._peak_depth = max(self._peak_depth, self._queue.qsize())
+        return True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        \"""Ferma writer; con flush_on_shutdown committa prima la coda residua\"""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _collect_batch(self) -> List[Tuple]:
+        \"""Raccoglie un gruppo per dimensione o finestra temporale\"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[Tuple]:
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                batch = self._collect_batch()
+                if batch:
+                    self._commit(batch)
+            except Exception as e:
+                # Il thread non deve morire: la coda si riempirebbe senza writer
+                logger.error(f'Write-behind writer error: {str(e)}')
+
+        if self.flush_on_shutdown:
+            batch = self._drain()
+            while batch:
+                self._commit(batch)
+                batch = self._drain()
+        else:
+            pending = self._queue.qsize()
+            if pending:
+                logger.warning(f'Discarding {pending} queued feedback on shutdown')
+
+    def _commit(self, batch: List[Tuple], attempts: Optional[int] = None) -> None:
+        \"""
+        Scrive il gruppo in una sola transazione (ordine preservato: last-write-wins).
+
+        Un gruppo che fallisce tutti i tentativi viene diviso a metà e le
+        metà committate in ordine, fino alla singola riga: viene scartata
+        solo la riga che continua a fallire, non i voti validi del gruppo.
+        I tentativi ripetuti (errori transitori, lock) valgono per il gruppo
+        intero e per la riga singola, non per le metà intermedie.
+        \"""
+        attempts = attempts or self.max_retries
+        for attempt in range(1, attempts + 1):
+            start = time.perf_counter()
+            try:
+                self.storage.upsert_many(batch)
+            except Exception as e:
+                logger.error(f'Group commit of {len(batch)} rows failed (attempt {attempt}/{attempts}): {str(e)}')
+                if attempt < attempts:
+                    time.sleep(0.1 * attempt)
+                    continue
+                if len(batch) > 1:
+                    middle = len(batch) // 2
+                    for half in (batch[:middle], batch[middle:]):
+                        self._commit(half, attempts=None if len(half) == 1 else 1)
+                    return
+                logger.error(f'Dropping feedback {batch[0][0]!r}: commit keeps failing')
+                with self._lock:
+                    self._failed += 1
+                return
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._committed += len(batch)
+                self._batches += 1
+                self._commit_time += elapsed_ms
+                self._last_commit_ms = elapsed_ms
+                self._max_commit_ms = max(self._max_commit_ms, elapsed_ms)
+
+            notify_commit(self.on_commit, batch)
+            return
+
+    def stats(self) -> Dict:
+        \"""Profondità coda e latenza commit\"""
+        with self._lock:
+            return {
+                'mode': 'queue',
+                'depth': self._queue.qsize(),
+                'peakDepth': self._peak_depth,
+                'maxSize': self.max_size,
+                'maxBatch': self.max_batch,
+                'maxDelayMs': self.max_delay * 1000,
+                'enqueued': self._enqueued,
+                'rejected': self._rejected,
+                'committed': self._committed,
+                'failed': self._failed,
+                'batches': self._batches,
+                'avgBatchSize': round(self._committed / self._batches, 1) if self._batches else 0.0,
+                'lastCommitMs': round(self._last_commit_ms, 3),
+                'avgCommitMs': round(self._commit_time / self._batches, 3) if self._batches else 0.0,
+                'maxCommitMs': round(self._max_commit_ms, 3),
+            }
+"""
+
+
+# ============================================================================
+# APPEND-ONLY LOG: feedback_log.py (log segmentato + compactor)
+# ============================================================================
+
+FEEDBACK_APPEND_LOG = """
+\"""
+Ingestion append-only per feedback API
+Le richieste appendono record length-prefixed a un log segmentato; un
+compactor thread riversa i segmenti sigillati in SQLite (last-write-wins)
+\"""
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from feedback_db import DB_PATH
+from feedback_ingest import notify_commit
+from feedback_storage import FeedbackStorage
+
+logger = logging.getLogger(__name__)
+
+# Record: lunghezza payload (4 byte) + CRC32 payload (4 byte) + payload JSON
+# (lista di righe: una richiesta batch è un solo record, scritto atomicamente)
+RECORD_HEADER = struct.Struct('>II')
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def segment_name(number: int) -> str:
+    return f'{SEGMENT_PREFIX}{number:010d}{SEGMENT_SUFFIX}'
+
+
+def list_segments(directory: str) -> List[str]:
+    \"""Segmenti di una directory in ordine di scrittura\"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in names
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def encode_record(rows: List[Tuple]) -> bytes:
+    payload = json.dumps(rows, separators=(',', ':')).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path: str) -> Tuple[List[Tuple], bool]:
+    \"""
+    Righe di un segmento in ordine di scrittura.
+
+    La lettura si ferma al primo record troncato o con CRC errato (coda di
+    una scrittura interrotta da un crash). Ritorna (righe, integro).
+    \"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    rows = []
+    offset = 0
+    while offset < len(data):
+        if offset + RECORD_HEADER.size > len(data):
+            return rows, False
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return rows, False
+        rows.extend(tuple(row) for row in json.loads(payload))
+        offset = start + length
+    return rows, True
+
+
+def remove_drained(directory: str) -> None:
+    \"""Elimina la directory di un processo già riversata; con file .failed resta per l'analisi\"""
+    try:
+        if any(name.endswith('.failed') for name in os.listdir(directory)):
+            return
+    except OSError:
+        return
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class AppendOnlyLog:
+    \"""
+    Log segmentato per processo + compactor thread.
+
+    Ogni processo scrive nella sottodirectory del proprio pid tenendo un
+    flock sul file `lock`. All'avvio, le sottodirectory con lock libero
+    appartengono a processi terminati e vengono riversate prima di servire
+    (crash recovery). Il segmento attivo viene sigillato quando supera
+    segment_bytes o quando il suo primo record ha più di max_delay secondi;
+    il compactor riversa i segmenti sigillati in ordine e li elimina solo
+    dopo il commit. Un segmento rigiocato due volte (crash a metà) produce
+    lo stesso stato finale.
+    \"""
+
+    def __init__(self, storage: FeedbackStorage, directory: str, segment_bytes: int = 4 * 1024 * 1024,
+                 max_delay: float = 0.2, max_batch: int = 1000,
+                 max_pending_bytes: int = 512 * 1024 * 1024, fsync: bool = False,
+                 flush_on_shutdown: bool = True, max_retries: int = 3,
+                 on_commit: Optional[Callable[[List[Tuple]], None]] = None):
+        self.storage = storage
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.max_pending_bytes = max_pending_bytes
+        # fsync a ogni append: sopravvive anche al crash del sistema operativo
+        self.fsync = fsync
+        self.flush_on_shutdown = flush_on_shutdown
+        self.max_retries = max_retries
+        # Chiamato con le righe committate (invalidazione cache, stream SSE)
+        self.on_commit = on_commit
+
+        self.path: Optional[str] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_file = None
+
+        # Segmento attivo e segmenti sigillati in attesa del compactor
+        self._file = None
+        self._segment_number = 0
+        self._active: Dict = {}
+        self._sealed: List[Dict] = []
+
+        self._appended_records = 0
+        self._appended_rows = 0
+        self._appended_bytes = 0
+        self._rejected = 0
+        self._compacted_rows = 0
+        self._compacted_segments = 0
+        self._written_rows = 0
+        self._recovered_rows = 0
+        self._failed_segments = 0
+        self._failed_rows = 0
+        self._corrupt_segments = 0
+        self._compact_time = 0.0
+        self._last_compact_ms = 0.0
+
+    @classmethod
+    def from_env(cls, storage: FeedbackStorage,
+                 on_commit: Optional[Callable[[List[Tuple]], None]] = None) -> 'AppendOnlyLog':
+        \"""Crea log da variabili d'ambiente FEEDBACK_LOG_*\"""
+        default_dir = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'feedback_log')
+        return cls(
+            storage,
+            directory=os.getenv('FEEDBACK_LOG_DIR', default_dir),
+            segment_bytes=int(os.getenv('FEEDBACK_LOG_SEGMENT_KB', 4096)) * 1024,
+            max_delay=int(os.getenv('FEEDBACK_LOG_MAX_DELAY_MS', 200)) / 1000,
+            max_batch=int(os.getenv('FEEDBACK_LOG_MAX_BATCH', 1000)),
+            max_pending_bytes=int(os.getenv('FEEDBACK_LOG_MAX_PENDING_MB', 512)) * 1024 * 1024,
+            fsync=os.getenv('FEEDBACK_LOG_FSYNC', 'false').lower() == 'true',
+            flush_on_shutdown=os.getenv('FEEDBACK_LOG_FLUSH_ON_SHUTDOWN', 'true').lower() == 'true',
+            on_commit=on_commit,
+        )
+
+    def start(self) -> None:
+        \"""Recupera i log di processi terminati, apre il segmento attivo e avvia il compactor\"""
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Prima del segmento attivo (append rifiutati fino ad allora): i voti
+        # dei processi terminati sono più vecchi di quelli che arriveranno
+        recovered = self.recover()
+        if recovered:
+            logger.info(f'Recovered {recovered} feedback rows from uncompacted log segments')
+
+        self.path = os.path.join(self.directory, str(os.getpid()))
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, 'lock'), 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        with self._lock:
+            self._open_segment()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feedback-compactor', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def append(self, rows: List[Tuple]) -> bool:
+        \"""Appende un record con le righe; False se il log è pieno o non scrivibile\"""
+        record = encode_record(rows)
+
+        with self._lock:
+            pending = self._active.get('bytes', 0) + sum(s['bytes'] for s in self._sealed)
+            if self._file is None or pending + len(record) > self.max_pending_bytes:
+                self._rejected += 1
+                return False
+
+            try:
+                self._file.write(record)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                logger.error(f'Log append failed: {str(e)}')
+                self._rejected += 1
+                # Un eventuale record parziale chiude il segmento (letto fino al
+                # record precedente): gli append successivi vanno in uno nuovo
+                self._seal_segment()
+                return False
+
+            if self._active['firstAppend'] is None:
+                self._active['firstAppend'] = time.monotonic()
+            self._active['bytes'] += len(record)
+            self._active['rows'] += len(rows)
+            self._appended_records += 1
+            self._appended_rows += len(rows)
+            self._appended_bytes += len(record)
+            full = self._active['bytes'] >= self.segment_bytes
+
+        if full:
+            self._wakeup.set()
+        return True
+
+    def stop(self, timeout: float = 30.0) -> None:
+        \"""Ferma il compactor; con flush_on_shutdown riversa prima tutto il log\"""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+        if self._lock_file and not list_segments(self.path):
+            # Tutto riversato: la directory del processo non serve più
+            remove_drained(self.path)
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def recover(self) -> int:
+        \"""
+        Riversa i segmenti di processi terminati (lock libero); ritorna le righe lette.
+
+        Come il compactor mette in quarantena le righe che non riesce a
+        scrivere: una riga non valida non deve impedire l'avvio del processo.
+        \"""
+        recovered = 0
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path) or path == self.path:
+                continue
+            try:
+                lock_file = open(os.path.join(path, 'lock'), 'a')
+            except OSError:
+                continue
+
+            try:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # processo ancora attivo (o recovery in corso altrove)
+
+                complete = True
+                for segment in list_segments(path):
+                    rows = self._compact_segment(segment)
+                    if rows is None:
+                        complete = False
+                        break
+                    recovered += rows
+                if complete:
+                    remove_drained(path)
+            finally:
+                lock_file.close()
+
+        with self._lock:
+            self._recovered_rows += recovered
+        return recovered
+
+    def _open_segment(self) -> None:
+        self._segment_number += 1
+        path = os.path.join(self.path, segment_name(self._segment_number))
+        self._file = open(path, 'ab')
+        self._active = {'path': path, 'firstAppend': None, 'bytes': 0, 'rows': 0}
+
+    def _seal_segment(self, reopen: bool = True) -> None:
+        \"""Chiude il segmento attivo e, se contiene record, lo passa al compactor\"""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+
+        if self._active['bytes']:
+            self._sealed.append(self._active)
+        else:
+            try:
+                os.remove(self._active['path'])
+            except OSError:
+                pass
+
+        if reopen:
+            try:
+                self._open_segment()
+            except OSError as e:
+                logger.error(f'Cannot open log segment: {str(e)}')
+
+    def _seal_if_due(self) -> None:
+        with self._lock:
+            if self._file is None:
+                # Segmento non riaperto dopo un errore di I/O: nuovo tentativo
+                try:
+                    self._open_segment()
+                except OSError:
+                    pass
+                return
+
+            first = self._active['firstAppend']
+            if first is None:
+                return
+            if self._active['bytes'] >= self.segment_bytes or time.monotonic() - first >= self.max_delay:
+                self._seal_segment()
+
+    def _compact_sealed(self) -> None:
+        \"""Riversa i segmenti sigillati nell'ordine di scrittura\"""
+        while True:
+            with self._lock:
+                if not self._sealed:
+                    return
+                segment = self._sealed[0]
+
+            # In chiusura un segmento che non si riesce a scrivere resta per la recovery
+            if self._compact_segment(segment['path'], quarantine=not self._stop.is_set()) is None:
+                return  # riprova al prossimo ciclo, senza saltare avanti
+
+            with self._lock:
+                self._sealed.pop(0)
+
+    def _compact_segment(self, path: str, quarantine: bool = True) -> Optional[int]:
+        \"""
+        Riversa un segmento in SQLite e lo elimina; None se resta da riversare.
+
+        Le righe vengono deduplicate per message_id (vince l'ultima) e scritte
+        a blocchi di max_batch righe, un commit per blocco. Con quarantine, le
+        righe non valide o che continuano a fallire (vedi _commit) vengono
+        scritte in <segmento>.failed per l'analisi e le altre committate;
+        senza quarantine (chiusura) il segmento con errori resta intero per
+        la recovery. Un segmento che non si riesce a leggere finisce sempre
+        in .failed: ritentarlo darebbe lo stesso errore.
+        \"""
+        try:
+            return self._replay_segment(path, quarantine)
+        except Exception as e:
+            logger.error(f'Unreadable log segment {path}, kept as {path}.failed: {str(e)}')
+            try:
+                os.replace(path, path + '.failed')
+            except OSError:
+                pass
+            with self._lock:
+                self._failed_segments += 1
+            return 0
+
+    def _replay_segment(self, path: str, quarantine: bool) -> Optional[int]:
+        start = time.perf_counter()
+        rows, intact = read_segment(path)
+        if not intact:
+            logger.warning(f'Truncated record at the end of {path}: ignored')
+            with self._lock:
+                self._corrupt_segments += 1
+
+        latest: Dict[str, Tuple] = {}
+        malformed: List[Tuple] = []
+        for row in rows:
+            if not row or not isinstance(row[0], str):
+                malformed.append(row)
+                continue
+            latest.pop(row[0], None)
+            latest[row[0]] = row
+        unique = list(latest.values())
+        if malformed and not quarantine:
+            return None
+
+        rejected: List[Tuple] = []
+        for offset in range(0, len(unique), self.max_batch):
+            failed = self._commit(unique[offset:offset + self.max_batch], split=quarantine)
+            if failed and not quarantine:
+                return None
+            rejected.extend(failed)
+
+        if malformed or rejected:
+            self._quarantine(path, malformed + rejected)
+        os.remove(path)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._compacted_rows += len(rows)
+            self._written_rows += len(unique) - len(rejected)
+            self._compacted_segments += 1
+            self._compact_time += elapsed_ms
+            self._last_compact_ms = elapsed_ms
+        return len(rows)
+
+    def _commit(self, batch: List[Tuple], attempts: Optional[int] = None, split: bool = True) -> List[Tuple]:
+        \"""
+        Scrive un blocco in una transazione; ritorna le righe non scritte.
+
+        Come nella coda write-behind, con split un blocco che fallisce tutti
+        i tentativi viene diviso a metà fino alla singola riga (un tentativo
+        per le metà intermedie): restano fuori solo le righe che continuano
+        a fallire. Senza split il blocco fallito viene ritornato intero.
+        \"""
+        attempts = attempts or self.max_retries
+        for attempt in range(1, attempts + 1):
+            try:
+                self.storage.upsert_many(batch)
+            except Exception as e:
+                logger.error(f'Log compaction commit of {len(batch)} rows failed (attempt {attempt}/{attempts}): {str(e)}')
+                if attempt < attempts:
+                    time.sleep(0.1 * attempt)
+                    continue
+                if not split or len(batch) == 1:
+                    return batch
+                middle = len(batch) // 2
+                rejected = []
+                for half in (batch[:middle], batch[middle:]):
+                    rejected.extend(self._commit(half, attempts=None if len(half) == 1 else 1))
+                return rejected
+
+            notify_commit(self.on_commit, batch)
+            return []
+
+    def _quarantine(self, path: str, rows: List[Tuple]) -> None:
+        \"""Scrive le righe scartate in <segmento>.failed, nello stesso formato (read_segment)\"""
+        with open(path + '.failed', 'ab') as f:
+            f.write(encode_record(rows))
+        logger.error(f'Compaction skipped {len(rows)} feedback rows, kept in {path}.failed')
+        with self._lock:
+            self._failed_rows += len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.max_delay / 2)
+            self._wakeup.clear()
+            try:
+                self._seal_if_due()
+                self._compact_sealed()
+            except Exception as e:
+                # Il thread non deve morire: il log continuerebbe a crescere senza compactor
+                logger.error(f'Log compactor error: {str(e)}')
+
+        with self._lock:
+            self._seal_segment(reopen=False)
+
+        if self.flush_on_shutdown:
+            self._compact_sealed()
+        elif self._sealed:
+            logger.info(f'Leaving {len(self._sealed)} log segments for recovery at next startup')
+
+    def stats(self) -> Dict:
+        \"""Volumi del log e ritardo del compactor\"""
+        with self._lock:
+            pending = self._sealed + ([self._active] if self._active.get('bytes') else [])
+            firsts = [s['firstAppend'] for s in pending if s['firstAppend'] is not None]
+            return {
+                'mode': 'log',
+                'directory': self.path,
+                'segmentBytes': self.segment_bytes,
+                'maxDelayMs': self.max_delay * 1000,
+                'fsync': self.fsync,
+                'appendedRecords': self._appended_records,
+                'appendedRows': self._appended_rows,
+                'appendedBytes': self._appended_bytes,
+                'rejected': self._rejected,
+                'pendingSegments': len(pending),
+                'pendingRows': sum(s['rows'] for s in pending),
+                'pendingBytes': sum(s['bytes'] for s in pending),
+                # Età del record più vecchio non ancora in SQLite
+                'lagMs': round((time.monotonic() - min(firsts)) * 1000, 1) if firsts else 0.0,
+                'compactedSegments': self._compacted_segments,
+                'compactedRows': self._compacted_rows,
+                'writtenRows': self._written_rows,
+                'recoveredRows': self._recovered_rows,
+                'failedSegments': self._failed_segments,
+                'failedRows': self._failed_rows,
+                'corruptSegments': self._corrupt_segments,
+                'lastCompactMs': round(self._last_compact_ms, 3),
+                'avgCompactMs': round(self._compact_time / self._compacted_segments, 3) if self._compacted_segments else 0.0,
+            }
+"""
+
+
+# ============================================================================
+# RESPONSE CACHE: feedback_cache.py (LRU + TTL)
+# ============================================================================
+
+FEEDBACK_CACHE = """
+\"""
+Cache risposte serializzate per GET /api/feedback/<message_id>
+LRU limitata con TTL, invalidata dalle scritture del processo e svuotata
+quando il contatore di scritture condiviso segnala scritture di altri worker
+\"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class ResponseCache:
+    \"""
+    Cache LRU + TTL di risposte già serializzate (status, body).
+
+    I 404 usano negative_ttl, più breve. La cache è per processo: le
+    scritture invalidano le chiavi solo nel worker che le riceve. Con
+    version (contatore di scritture condiviso, storage.version()) la cache
+    viene svuotata quando il contatore cambia, controllato al più ogni
+    version_interval secondi: le risposte superate da scritture di altri
+    worker durano al più version_interval, non il TTL.
+    \"""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 30.0,
+                 negative_ttl: float = 5.0, version: Optional[Callable[[], int]] = None,
+                 version_interval: float = 1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.version = version
+        self.version_interval = version_interval
+        self._version: Optional[int] = None
+        self._version_checked = 0.0
+        self._version_lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Incrementato a ogni invalidazione: una lettura iniziata prima di
+        # un'invalidazione non può reinserire in cache un valore superato
+        self._generation = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._stale_puts = 0
+        self._version_flushes = 0
+
+    @classmethod
+    def from_env(cls, version: Optional[Callable[[], int]] = None) -> 'ResponseCache':
+        \"""Crea cache da variabili d'ambiente FEEDBACK_CACHE_*\"""
+        return cls(
+            max_entries=int(os.getenv('FEEDBACK_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('FEEDBACK_CACHE_TTL', 30)),
+            negative_ttl=float(os.getenv('FEEDBACK_CACHE_NEGATIVE_TTL', 5)),
+            version=version,
+            version_interval=float(os.getenv('FEEDBACK_CACHE_VERSION_INTERVAL', 1)),
+        )
+
+    def version_due(self) -> bool:
+        \"""True se check_version() deve rileggere il contatore condiviso\"""
+        return (self.version is not None
+                and time.monotonic() - self._version_checked >= self.version_interval)
+
+    def check_version(self) -> None:
+        \"""
+        Svuota la cache se il contatore condiviso è cambiato dall'ultimo controllo.
+
+        Da chiamare prima di get(), fuori dall'event loop: legge il DB. Un solo
+        thread alla volta rilegge il contatore, gli altri proseguono. Anche le
+        scritture del processo fanno avanzare il contatore: con scritture
+        continue la cache vale al più version_interval secondi.
+        \"""
+        if not self.version_due() or not self._version_lock.acquire(blocking=False):
+            return
+        try:
+            if not self.version_due():
+                return
+            self._version_checked = time.monotonic()
+            version = self.version()
+        finally:
+            self._version_lock.release()
+
+        with self._lock:
+            if self._version is not None and version != self._version:
+                # Come un'invalidazione: le letture in corso non reinseriscono valori superati
+                self._generation += 1
+                self._entries.clear()
+                self._version_flushes += 1
+            self._version = version
+
+    def get(self, key: str) -> Optional[Tuple[int, bytes]]:
+        \"""Restituisce (status, body) se presente e non scaduto\"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            status, body, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return status, body
+
+    def generation(self) -> int:
+        \"""Token da passare a put() per scartare letture superate\"""
+        return self._generation
+
+    def put(self, key: str, status: int, body: bytes,
+            generation: Optional[int] = None) -> None:
+        \"""Memorizza risposta, evict LRU oltre max_entries\"""
+        if self.max_entries <= 0:
+            return
+
+        ttl = self.negative_ttl if status == 404 else self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self._stale_puts += 1
+                return
+
+            self._entries[key] = (status, body, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        \"""Rimuove una chiave (chiamato dopo ogni scrittura)\"""
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def invalidate_many(self, keys: Iterable[str]) -> None:
+        \"""Rimuove più chiavi con un solo lock\"""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        \"""Contatori per tuning dimensione/TTL\"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttl': self.ttl,
+                'negativeTtl': self.negative_ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRatio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+                'stalePuts': self._stale_puts,
+                'versionInterval': self.version_interval if self.version is not None else None,
+                'versionFlushes': self._version_flushes,
+            }
+"""
+
+
+# ============================================================================
+# LIVE STREAM: feedback_stream.py (fan-out SSE)
+# ============================================================================
+
+FEEDBACK_STREAM = """
+\"""
+Fan-out in processo per GET /api/feedback/stream (Server-Sent Events)
+Il write path pubblica le righe committate; ogni sottoscrittore ha un buffer
+limitato che scarta gli eventi più vecchi, così un client lento non frena le scritture
+\"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from feedback_db import format_timestamp, now_ms
+
+logger = logging.getLogger(__name__)
+
+DAY_MS = 86400000
+COUNTER_KEYS = ('total', 'positive', 'negative')
+
+# Commento SSE inviato in assenza di eventi: tiene aperti proxy e load balancer
+KEEPALIVE = b': keep-alive\\n\\n'
+
+
+def format_event(event: str, data: Dict, event_id: Optional[int] = None) -> bytes:
+    \"""Evento SSE serializzato (JSON compatto su una sola riga data:)\"""
+    head = f'id: {event_id}\\n' if event_id is not None else ''
+    body = json.dumps(data, separators=(',', ':'))
+    return f'{head}event: {event}\\ndata: {body}\\n\\n'.encode('utf-8')
+
+
+def feedback_event(row: Tuple) -> Dict:
+    \"""Payload dell'evento feedback (senza user agent e IP)\"""
+    message_id, feedback_type, session_id, ts, _, _, metadata = row
+    return {
+        'messageId': message_id,
+        'feedbackType': feedback_type,
+        'sessionId': session_id,
+        'timestamp': format_timestamp(ts),
+        'metadata': json.loads(metadata) if metadata else {}
+    }
+
+
+class Subscription:
+    \"""
+    Buffer eventi di un client SSE: deque limitata, drop-oldest quando è piena.
+
+    push() non blocca mai (è chiamato dal write path). get() attende nuovi
+    eventi per i thread WSGI; drain() non blocca e l'event loop ASGI si fa
+    svegliare da wakeup, invocato dal thread che pubblica.
+    \"""
+
+    def __init__(self, buffer_size: int, session_id: Optional[str] = None):
+        self.session_id = session_id
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.closed = False
+        self.wakeup: Optional[Callable[[], None]] = None
+        self._reported = 0
+        self._cond = threading.Condition()
+
+    def push(self, events: List[bytes]) -> None:
+        with self._cond:
+            self.dropped += max(0, len(self.buffer) + len(events) - self.buffer.maxlen)
+            self.buffer.extend(events)
+            self._cond.notify()
+        self._wake()
+
+    def get(self, timeout: float) -> List[bytes]:
+        \"""Eventi in attesa, aspettando al più timeout secondi (lista vuota: keep-alive)\"""
+        with self._cond:
+            if not self.buffer and not self.closed:
+                self._cond.wait(timeout)
+            return self._take()
+
+    def drain(self) -> List[bytes]:
+        with self._cond:
+            return self._take()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+        self._wake()
+
+    def _take(self) -> List[bytes]:
+        events = []
+        if self.dropped > self._reported:
+            # Il client ha perso eventi: deve riallinearsi (changes/stats)
+            events.append(format_event('dropped', {'count': self.dropped - self._reported}))
+            self._reported = self.dropped
+        events.extend(self.buffer)
+        self.buffer.clear()
+        return events
+
+    def _wake(self) -> None:
+        if self.wakeup is None:
+            return
+        try:
+            self.wakeup()
+        except Exception as e:
+            # Event loop chiuso o simili: il write path non deve fallire per un client
+            logger.debug(f'Stream wakeup failed: {str(e)}')
+
+
+class Broadcaster:
+    \"""
+    Fan-out di feedback e contatori ai sottoscrittori SSE del processo.
+
+    Dopo ogni commit publish() serializza ogni evento una sola volta e lo
+    accoda nei buffer: costo O(sottoscrittori), nessun I/O sul write path.
+    Senza sottoscrittori ritorna subito. Gli eventi counters portano i totali
+    del giorno UTC e il delta rispetto all'evento counters precedente.
+
+    I totali vengono letti da counters (tipicamente storage.stats) solo in
+    refresh(), fuori dal lock: alla prima sottoscrizione e poi al più ogni
+    resync secondi, dai thread degli stream. publish() li aggiorna in memoria
+    con le righe committate; un voto ripetuto toglie il voto precedente se è
+    stato visto dall'ultimo refresh (altrimenti lo conta come nuovo fino al
+    refresh successivo, che riallinea anche le scritture degli altri worker).
+    \"""
+
+    def __init__(self, buffer_size: int = 256, max_subscribers: int = 100,
+                 counters: Optional[Callable[[int], Dict]] = None, resync: float = 60.0):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.counters = counters
+        self.resync = resync
+        # Tupla sostituita a ogni (dis)iscrizione: publish la legge senza copie
+        self._subscribers: Tuple[Subscription, ...] = ()
+        # Serializza publish e subscribe: ordine degli eventi e delta coerenti
+        self._lock = threading.Lock()
+        # Un solo refresh alla volta (query fuori da _lock)
+        self._refresh_lock = threading.Lock()
+        self._sequence = 0
+        # (inizio giorno, totali) correnti, None finché non c'è un refresh
+        self._totals: Optional[Tuple[int, Dict]] = None
+        # Voto per message_id delle righe del giorno viste dall'ultimo refresh
+        self._votes: Dict[str, str] = {}
+        self._refreshed_at = 0.0
+
+        self._published = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._refreshes = 0
+
+    @classmethod
+    def from_env(cls, counters: Optional[Callable[[int], Dict]] = None) -> 'Broadcaster':
+        \"""Crea broadcaster da variabili d'ambiente FEEDBACK_STREAM_*\"""
+        return cls(
+            buffer_size=int(os.getenv('FEEDBACK_STREAM_BUFFER', 256)),
+            max_subscribers=int(os.getenv('FEEDBACK_STREAM_MAX_SUBSCRIBERS', 100)),
+            counters=counters,
+            resync=float(os.getenv('FEEDBACK_STREAM_RESYNC', 60)),
+        )
+
+    def subscribe(self, session_id: Optional[str] = None) -> Optional[Subscription]:
+        \"""Nuova sottoscrittura con i contatori correnti come primo evento; None se al limite\"""
+        if len(self._subscribers) >= self.max_subscribers:
+            with self._lock:
+                self._rejected += 1
+            return None
+        self.refresh()
+
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self._rejected += 1
+                return None
+
+            subscription = Subscription(self.buffer_size, session_id)
+            if self._totals is not None:
+                subscription.push([format_event('counters', self._counters_payload(*self._totals))])
+            self._subscribers += (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers = tuple(s for s in self._subscribers if s is not subscription)
+                self._dropped += subscription.dropped
+        subscription.close()
+
+    def refresh(self) -> None:
+        \"""
+        Rilegge i totali del giorno se mancano, è cambiato giorno o sono più
+        vecchi di resync secondi. Chiamato da subscribe e dai keep-alive degli
+        stream, mai dal write path; con un cambio pubblica un evento counters.
+        \"""
+        if self.counters is None or not self._refresh_due():
+            return
+        with self._refresh_lock:
+            if not self._refresh_due():
+                return
+            day_start = now_ms() // DAY_MS * DAY_MS
+            try:
+                totals = self.counters(day_start)
+            except Exception as e:
+                logger.warning(f'Stream counters unavailable: {str(e)}')
+                return
+            totals = {key: totals[key] for key in COUNTER_KEYS}
+
+            with self._lock:
+                previous = self._totals
+                self._totals = (day_start, totals)
+                self._votes.clear()
+                self._refreshed_at = time.monotonic()
+                self._refreshes += 1
+                if previous is not None and previous[0] == day_start and previous[1] != totals:
+                    event = format_event('counters', self._counters_payload(day_start, totals, previous[1]))
+                    for subscription in self._subscribers:
+                        subscription.push([event])
+
+    def publish(self, rows: List[Tuple]) -> None:
+        \"""Accoda le righe committate (formato upsert_many) e i contatori aggiornati\"""
+        with self._lock:
+            if not self._subscribers:
+                # Nessuno ascolta: i totali non vengono più aggiornati
+                self._totals = None
+                return
+            if not rows:
+                return
+
+            events = []
+            for row in rows:
+                self._sequence += 1
+                events.append((row[2], format_event('feedback', feedback_event(row), self._sequence)))
+            counters = self._count(rows)
+            self._published += len(events)
+
+            for subscription in self._subscribers:
+                batch = [event for session_id, event in events
+                         if not subscription.session_id or session_id == subscription.session_id]
+                if counters:
+                    batch.append(counters)
+                if batch:
+                    subscription.push(batch)
+
+    def close(self) -> None:
+        \"""Chiude tutte le sottoscrizioni (shutdown): gli stream aperti terminano\"""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, ()
+        for subscription in subscribers:
+            subscription.close()
+
+    def _refresh_due(self) -> bool:
+        totals = self._totals
+        return (totals is None or totals[0] != now_ms() // DAY_MS * DAY_MS
+                or time.monotonic() - self._refreshed_at >= self.resync)
+
+    def _count(self, rows: List[Tuple]) -> Optional[bytes]:
+        \"""Applica le righe ai totali in memoria (sotto _lock); evento counters se cambiano\"""
+        if self._totals is None:
+            return None
+        day_start = now_ms() // DAY_MS * DAY_MS
+        if self._totals[0] != day_start:
+            # Nuovo giorno: si riparte da zero (il prossimo refresh riallinea)
+            self._totals = (day_start, dict.fromkeys(COUNTER_KEYS, 0))
+            self._votes.clear()
+
+        previous = self._totals[1]
+        totals = dict(previous)
+        for message_id, feedback_type, _, ts, *_ in rows:
+            replaced = self._votes.pop(message_id, None)
+            if replaced is not None:
+                totals['total'] -= 1
+                totals[replaced] -= 1
+            if day_start <= ts < day_start + DAY_MS:
+                totals['total'] += 1
+                totals[feedback_type] += 1
+                self._votes[message_id] = feedback_type
+
+        if totals == previous:
+            return None
+        self._totals = (day_start, totals)
+        return format_event('counters', self._counters_payload(day_start, totals, previous))
+
+    @staticmethod
+    def _counters_payload(day_start: int, totals: Dict, previous: Optional[Dict] = None) -> Dict:
+        previous = previous or totals
+        return {
+            'day': format_timestamp(day_start)[:10],
+            **totals,
+            'delta': {key: totals[key] - previous[key] for key in COUNTER_KEYS}
+        }
+
+    def stats(self) -> Dict:
+        \"""Sottoscrittori, eventi pubblicati ed eventi scartati dai buffer pieni\"""
+        subscribers = self._subscribers
+        return {
+            'subscribers': len(subscribers),
+            'maxSubscribers': self.max_subscribers,
+            'bufferSize': self.buffer_size,
+            'published': self._published,
+            'dropped': self._dropped + sum(s.dropped for s in subscribers),
+            'rejected': self._rejected,
+            'refreshes': self._refreshes,
+        }
+"""
+
+
+# ============================================================================
+# METRICS: feedback_metrics.py (istogrammi + formato Prometheus)
+# ============================================================================
+
+FEEDBACK_METRICS = """
+\"""
+Metriche di processo per la feedback API
+Istogrammi a bucket fissi per route/status e per statement SQLite, gauge delle
+richieste in corso; esposizione in formato testo Prometheus su /metrics
+\"""
+
+import os
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Bucket in secondi: richieste HTTP e singoli statement SQLite
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def parse_buckets(value: Optional[str], default: Tuple[float, ...]) -> Tuple[float, ...]:
+    \"""Bucket da lista separata da virgole (secondi), ordinati; default se vuota\"""
+    if not value:
+        return default
+    return tuple(sorted(float(bound) for bound in value.split(',') if bound.strip()))
+
+
+class Histogram:
+    \"""
+    Istogramma a bucket fissi (limiti superiori inclusivi, come i bucket le di Prometheus).
+
+    Ogni thread incrementa un proprio shard [conteggi..., +Inf, somma]:
+    observe() è una bisect e due incrementi senza lock, qualche centinaio di
+    nanosecondi. Lo scrape somma gli shard; una lettura concorrente può
+    mancare l'osservazione in corso, mai perderla.
+    \"""
+
+    __slots__ = ('bounds', '_local', '_shards', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self._local = threading.local()
+        self._shards: List[List] = []
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    def _new_shard(self) -> List:
+        shard = [0] * (len(self.bounds) + 1) + [0.0]
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        \"""(conteggi cumulativi per bucket, +Inf incluso; somma)\"""
+        with self._lock:
+            shards = list(self._shards)
+        totals = [sum(column) for column in zip(*shards)] if shards else [0] * (len(self.bounds) + 1) + [0.0]
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ','.join(
+        f'{name}=\"' + str(value).replace('\\\\', '\\\\\\\\').replace('\"', '\\\\\"').replace('\\n', '\\\\n') + '\"'
+        for name, value in labels
+    )
+    return '{' + pairs + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    \"""
+    Registro metriche del processo worker.
+
+    Le serie sono create al primo uso, una per combinazione di label. Con
+    più worker gunicorn ogni processo ha le proprie metriche: uno scrape
+    vede quelle del worker che risponde.
+    \"""
+
+    def __init__(self, request_buckets: Tuple[float, ...] = REQUEST_BUCKETS,
+                 db_buckets: Tuple[float, ...] = DB_BUCKETS, enabled: bool = True):
+        self.enabled = enabled
+        self.request_buckets = request_buckets
+        self.db_buckets = db_buckets
+        # (handler, method, status) -> Histogram
+        self._requests: Dict[Tuple[str, str, int], Histogram] = {}
+        # operazione SQLite (execute, executemany, commit) -> Histogram
+        self._statements: Dict[str, Histogram] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'Metrics':
+        \"""Crea registro da variabili d'ambiente FEEDBACK_METRICS*\"""
+        return cls(
+            request_buckets=parse_buckets(os.getenv('FEEDBACK_METRICS_REQUEST_BUCKETS'), REQUEST_BUCKETS),
+            db_buckets=parse_buckets(os.getenv('FEEDBACK_METRICS_DB_BUCKETS'), DB_BUCKETS),
+            enabled=os.getenv('FEEDBACK_METRICS', 'true').lower() == 'true',
+        )
+
+    def _histogram(self, series: Dict, key, bounds: Tuple[float, ...]) -> Histogram:
+        \"""Crea la serie al primo uso (le successive la trovano nel dizionario senza lock)\"""
+        with self._lock:
+            return series.setdefault(key, Histogram(bounds))
+
+    def request_started(self, handler: str) -> None:
+        with self._lock:
+            self._in_flight[handler] = self._in_flight.get(handler, 0) + 1
+
+    def request_finished(self, handler: str) -> None:
+        with self._lock:
+            self._in_flight[handler] -= 1
+
+    def observe_request(self, handler: str, method: str, status: int, seconds: float) -> None:
+        key = (handler, method, status)
+        histogram = self._requests.get(key) or self._histogram(self._requests, key, self.request_buckets)
+        histogram.observe(seconds)
+
+    def observe_statement(self, operation: str, seconds: float) -> None:
+        histogram = self._statements.get(operation) or self._histogram(self._statements, operation, self.db_buckets)
+        histogram.observe(seconds)
+
+    def render(self, gauges: Optional[Dict[str, Tuple[str, str, float]]] = None) -> bytes:
+        \"""
+        Esposizione testo Prometheus. gauges: {nome: (tipo, help, valore)} di
+        altri componenti (pool, coda, stream) letti al momento dello scrape.
+        \"""
+        lines: List[str] = []
+
+        def histograms(name: str, help_text: str, label_names: Tuple[str, ...], series: Dict) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in sorted(series.items()):
+                labels = list(zip(label_names, key if isinstance(key, tuple) else (key,)))
+                cumulative, total = histogram.snapshot()
+                for bound, count in zip(histogram.bounds + (float('inf'),), cumulative):
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    lines.append(f'{name}_bucket{format_labels(labels + [("le", le)])} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative[-1]}')
+
+        histograms('feedback_http_request_duration_seconds',
+                   'Tempo fino agli header di risposta, per handler/metodo/status',
+                   ('handler', 'method', 'status'), dict(self._requests))
+        histograms('feedback_db_statement_duration_seconds',
+                   'Durata di execute/executemany/commit SQLite (per execute fino alla prima riga)',
+                   ('operation',), dict(self._statements))
+
+        with self._lock:
+            in_flight = dict(self._in_flight)
+        lines.append('# HELP feedback_http_requests_in_flight Richieste in corso per handler')
+        lines.append('# TYPE feedback_http_requests_in_flight gauge')
+        for handler, count in sorted(in_flight.items()):
+            lines.append(f'feedback_http_requests_in_flight{format_labels([("handler", handler)])} {count}')
+
+        for name, (kind, help_text, value) in (gauges or {}).items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {format_value(value)}')
+
+        return ('\\n'.join(lines) + '\\n').encode('utf-8')
+"""
+
+
+# ============================================================================
+# SAMPLING PROFILER: feedback_profiler.py (collapsed stacks per route)
+# ============================================================================
+
+FEEDBACK_PROFILER = """
+\"""
+Profiler a campionamento on-demand per le richieste della feedback API
+Un thread campiona lo stack dei thread che servono richieste profilate e
+aggrega gli stack per route in file collapsed (flamegraph.pl, speedscope)
+\"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Frame massimi per stack campionato (dalla cima)
+MAX_DEPTH = 128
+
+
+def frame_label(code) -> str:
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'.replace(';', ',').replace(' ', '_')
+
+
+class SamplingProfiler:
+    \"""
+    Campionamento degli stack dei soli thread con una richiesta profilata.
+
+    begin()/end() registrano il thread corrente con la sua route: il thread
+    di campionamento parte alla prima richiesta profilata e, senza richieste
+    registrate, resta fermo su un Event. A profiler disattivato il costo per
+    richiesta è il controllo di enabled. Gli stack vengono scritti ogni
+    flush_interval secondi in <directory>/<route>.<pid>.collapsed
+    (\"frame;frame;frame conteggio\", radice a sinistra).
+    \"""
+
+    def __init__(self, directory: str, rate: float = 0.0, interval: float = 0.005,
+                 flush_interval: float = 10.0, on_demand: bool = False):
+        self.directory = directory
+        # Frazione di richieste campionate (0 = solo su richiesta admin)
+        self.rate = rate
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.on_demand = on_demand
+        self.enabled = rate > 0 or on_demand
+
+        # thread id -> route della richiesta profilata in corso
+        self._active: Dict[int, str] = {}
+        self._stacks: Dict[str, Counter] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._requests = 0
+        self._samples = 0
+
+    @classmethod
+    def from_env(cls, on_demand: bool = False) -> 'SamplingProfiler':
+        \"""Crea profiler da variabili d'ambiente FEEDBACK_PROFILE_*\"""
+        return cls(
+            directory=os.getenv('FEEDBACK_PROFILE_DIR', 'profiles'),
+            rate=float(os.getenv('FEEDBACK_PROFILE_RATE', 0)),
+            interval=float(os.getenv('FEEDBACK_PROFILE_INTERVAL_MS', 5)) / 1000,
+            flush_interval=float(os.getenv('FEEDBACK_PROFILE_FLUSH_INTERVAL', 10)),
+            on_demand=on_demand,
+        )
+
+    def begin(self, route: str) -> None:
+        \"""Inizia a campionare il thread corrente per la route\"""
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            self._requests += 1
+        self._active[threading.get_ident()] = route
+        self._wakeup.set()
+
+    def end(self) -> None:
+        self._active.pop(threading.get_ident(), None)
+
+    def stop(self) -> None:
+        \"""Ferma il campionamento e scrive gli stack raccolti\"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name='feedback-profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            if not self._active:
+                # Nessuna richiesta profilata: attesa senza campionare
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+            else:
+                self._sample()
+                time.sleep(self.interval)
+
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        samples = []
+        for thread_id, route in list(self._active.items()):
+            frame = frames.get(thread_id)
+            labels = []
+            while frame is not None and len(labels) < MAX_DEPTH:
+                labels.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                samples.append((route, ';'.join(reversed(labels))))
+
+        with self._lock:
+            for route, stack in samples:
+                self._stacks.setdefault(route, Counter())[stack] += 1
+            self._samples += len(samples)
+            self._dirty = self._dirty or bool(samples)
+
+    def flush(self) -> None:
+        \"""Riscrive i file collapsed delle route (totali dall'avvio del processo)\"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {route: dict(stacks) for route, stacks in self._stacks.items()}
+            self._dirty = False
+
+        pid = os.getpid()
+        for route, stacks in snapshot.items():
+            path = os.path.join(self.directory, f'{route}.{pid}.collapsed')
+            try:
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    for stack, count in sorted(stacks.items()):
+                        f.write(f'{stack} {count}\\n')
+                os.replace(path + '.tmp', path)
+            except OSError as e:
+                logger.warning(f'Profile write failed for {path}: {str(e)}')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rate': self.rate,
+                'onDemand': self.on_demand,
+                'intervalMs': self.interval * 1000,
+                'directory': self.directory,
+                'active': len(self._active),
+                'profiledRequests': self._requests,
+                'samples': self._samples,
+                'routes': sorted(self._stacks),
+            }
+"""
+
+
+# ============================================================================
+# TRACING: feedback_tracing.py (correlation ID + span OTLP/JSON)
+# ============================================================================
+
+FEEDBACK_TRACING = """
+\"""
+Tracing per richiesta della feedback API
+Correlation ID (header X-Request-ID o generato), span per le fasi della
+richiesta e per gli statement SQLite, export in JSON compatibile
+OpenTelemetry (OTLP/JSON) su ring buffer in memoria e/o file JSON Lines
+\"""
+
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from random import getrandbits, random
+from typing import Dict, Iterable, List, Optional
+
+from feedback_db import statement_shape
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Correlation ID accettati dal client; altrimenti se ne genera uno (= trace id)
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:/+=-]{1,128}')
+_TRACE_ID = re.compile(r'[0-9a-f]{32}')
+# W3C traceparent: versione-traceid-parentid-flags
+_TRACEPARENT = re.compile(r'00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})')
+
+# Valori OTLP di SpanKind e StatusCode
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# Span figli massimi per traccia (una stats su molte partizioni resta limitata)
+MAX_SPANS = 256
+
+# Tracce per riga del file (un ExportTraceServiceRequest per riga)
+EXPORT_BATCH = 256
+
+_current: ContextVar[Optional['Trace']] = ContextVar('feedback_trace', default=None)
+_NOOP = nullcontext()
+
+
+def new_trace_id() -> str:
+    return f'{getrandbits(128):032x}'
+
+
+def new_span_id() -> str:
+    return f'{getrandbits(64):016x}'
+
+
+class Trace:
+    \"""
+    Traccia di una richiesta: span radice (SERVER) e span figli come tuple
+    (nome, kind, span id, inizio, fine, attributi), tempi Unix in ns.
+    \"""
+
+    __slots__ = ('name', 'request_id', 'trace_id', 'span_id', 'parent_span_id', 'sampled',
+                 'attributes', 'spans', 'dropped', 'status', 'start_ns', 'end_ns', '_origin')
+
+    def __init__(self, name: str, request_id: str, trace_id: str, parent_span_id: Optional[str],
+                 sampled: bool, attributes: Optional[Dict] = None):
+        self.name = name
+        self.request_id = request_id
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.spans: List[tuple] = []
+        self.dropped = 0
+        self.status = 0
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self._origin = time.perf_counter_ns()
+
+    def now(self) -> int:
+        \"""Tempo Unix in ns, monotono dentro la traccia\"""
+        return self.start_ns + time.perf_counter_ns() - self._origin
+
+    def add(self, name: str, start_ns: int, end_ns: int, kind: int = SPAN_KIND_INTERNAL,
+            attributes: Optional[Dict] = None) -> None:
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, kind, new_span_id(), start_ns, end_ns, attributes))
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self) -> '_Span':
+        self.start = self.trace.now()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        attributes = {'error.type': exc_type.__name__} if exc_type is not None else None
+        self.trace.add(self.name, self.start, self.trace.now(), SPAN_KIND_INTERNAL, attributes)
+        return False
+
+
+def span(name: str):
+    \"""Span di una fase (parse, validate, serialize...) della richiesta corrente; no-op se non campionata\"""
+    trace = _current.get()
+    return _NOOP if trace is None or not trace.sampled else _Span(trace, name)
+
+
+def current_request_id() -> Optional[str]:
+    \"""Correlation ID della richiesta corrente (None fuori da una richiesta tracciata)\"""
+    trace = _current.get()
+    return trace.request_id if trace is not None else None
+
+
+def otlp_attributes(attributes: Optional[Dict]) -> List[Dict]:
+    result = []
+    for key, value in (attributes or {}).items():
+        if isinstance(value, bool):
+            typed = {'boolValue': value}
+        elif isinstance(value, int):
+            typed = {'intValue': str(value)}
+        elif isinstance(value, float):
+            typed = {'doubleValue': value}
+        else:
+            typed = {'stringValue': str(value)}
+        result.append({'key': key, 'value': typed})
+    return result
+
+
+def otlp_spans(trace: Trace) -> List[Dict]:
+    \"""Span della traccia in formato OTLP/JSON (id esadecimali, tempi come stringhe)\"""
+    root = {
+        'traceId': trace.trace_id,
+        'spanId': trace.span_id,
+        'name': trace.name,
+        'kind': SPAN_KIND_SERVER,
+        'startTimeUnixNano': str(trace.start_ns),
+        'endTimeUnixNano': str(trace.end_ns),
+        'attributes': otlp_attributes({
+            **trace.attributes,
+            'http.response.status_code': trace.status,
+            'feedback.request_id': trace.request_id,
+            **({'feedback.spans_dropped': trace.dropped} if trace.dropped else {}),
+        }),
+        'status': {'code': STATUS_ERROR if trace.status >= 500 else STATUS_UNSET},
+    }
+    if trace.parent_span_id:
+        root['parentSpanId'] = trace.parent_span_id
+
+    spans = [root]
+    for name, kind, span_id, start_ns, end_ns, attributes in trace.spans:
+        spans.append({
+            'traceId': trace.trace_id,
+            'spanId': span_id,
+            'parentSpanId': trace.span_id,
+            'name': name,
+            'kind': kind,
+            'startTimeUnixNano': str(start_ns),
+            'endTimeUnixNano': str(end_ns),
+            'attributes': otlp_attributes(attributes),
+            'status': {'code': STATUS_ERROR if attributes and 'error.type' in attributes else STATUS_UNSET},
+        })
+    return spans
+
+
+def otlp_document(traces: Iterable[Trace], service_name: str) -> Dict:
+    \"""ExportTraceServiceRequest OTLP/JSON (come il file exporter del Collector)\"""
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': otlp_attributes({'service.name': service_name, 'process.pid': os.getpid()})},
+            'scopeSpans': [{
+                'scope': {'name': 'feedback_tracing'},
+                'spans': [span for trace in traces for span in otlp_spans(trace)],
+            }],
+        }]
+    }
+
+
+class Tracer:
+    \"""
+    Tracce delle richieste del processo worker.
+
+    begin() crea la traccia e la rende corrente nel contesto (thread WSGI
+    o task ASGI): span(), observe_statement e i log la trovano senza
+    passarla tra le funzioni; solo quelle campionate registrano span.
+    end() mette quelle campionate nel ring buffer e nella coda del file;
+    la serializzazione JSON avviene nel thread di export o alla lettura,
+    mai nella richiesta. Coda piena: la traccia resta solo in memoria e
+    viene contata come scartata.
+    \"""
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 1.0, buffer_size: int = 1000,
+                 path: Optional[str] = None, service_name: str = 'feedback-api'):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.path = path
+        self.service_name = service_name
+        self._recent: deque = deque(maxlen=buffer_size)
+        self._queue: Optional[queue.Queue] = queue.Queue(maxsize=buffer_size) if path else None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+        self._traces = 0
+        self._spans_dropped = 0
+        self._exported = 0
+        self._export_dropped = 0
+
+    @classmethod
+    def from_env(cls) -> 'Tracer':
+        \"""Crea tracer da variabili d'ambiente FEEDBACK_TRACING / FEEDBACK_TRACE_*\"""
+        return cls(
+            enabled=os.getenv('FEEDBACK_TRACING', 'false').lower() == 'true',
+            sample_rate=float(os.getenv('FEEDBACK_TRACE_SAMPLE_RATE', 1.0)),
+            buffer_size=int(os.getenv('FEEDBACK_TRACE_BUFFER', 1000)),
+            path=os.getenv('FEEDBACK_TRACE_FILE') or None,
+            service_name=os.getenv('OTEL_SERVICE_NAME', 'feedback-api'),
+        )
+
+    def start(self) -> None:
+        \"""Avvia il thread di export su file (se FEEDBACK_TRACE_FILE è impostato)\"""
+        if self._queue is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='feedback-trace-export', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        \"""Scrive le tracce in coda e ferma il thread di export\"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def begin(self, name: str, request_id: Optional[str] = None, traceparent: Optional[str] = None,
+              attributes: Optional[Dict] = None) -> Trace:
+        \"""
+        Traccia della richiesta. Correlation ID: X-Request-ID del client se
+        valido, altrimenti il trace id. Con un traceparent W3C valido la
+        traccia continua quella del chiamante (e il suo flag sampled vale
+        come campionamento).
+        \"""
+        trace_id, parent_span_id, forced = None, None, False
+        match = _TRACEPARENT.fullmatch(traceparent) if traceparent else None
+        if match:
+            trace_id, parent_span_id, flags = match.groups()
+            forced = bool(int(flags, 16) & 1)
+
+        if request_id and not _REQUEST_ID.fullmatch(request_id):
+            request_id = None
+        if trace_id is None:
+            trace_id = request_id if request_id and _TRACE_ID.fullmatch(request_id) else new_trace_id()
+
+        sampled = forced or random() < self.sample_rate
+        trace = Trace(name, request_id or trace_id, trace_id, parent_span_id, sampled, attributes)
+        _current.set(trace)
+        return trace
+
+    def end(self, trace: Trace, status: int) -> None:
+        \"""Chiude lo span radice ed esporta la traccia (idempotente)\"""
+        _current.set(None)
+        if trace.end_ns:
+            return
+        trace.end_ns = trace.now()
+        trace.status = status
+        if not trace.sampled:
+            return
+
+        self._recent.append(trace)
+        exported = True
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(trace)
+            except queue.Full:
+                exported = False
+        with self._lock:
+            self._traces += 1
+            self._spans_dropped += trace.dropped
+            if not exported:
+                self._export_dropped += 1
+
+    def observe_statement(self, conn, operation: str, sql: str, parameters, seconds: float) -> None:
+        \"""Observer feedback_db: span db.* per gli statement della richiesta tracciata corrente\"""
+        trace = _current.get()
+        if trace is None or not trace.sampled:
+            return
+        end_ns = trace.now()
+        attributes = {'db.system': 'sqlite'}
+        if operation != 'commit':
+            attributes['db.statement'] = statement_shape(sql)
+        if operation == 'executemany' and isinstance(parameters, (list, tuple)):
+            attributes['db.batch_size'] = len(parameters)
+        trace.add(f'db.{operation}', end_ns - int(seconds * 1e9), end_ns, SPAN_KIND_CLIENT, attributes)
+
+    def recent(self, limit: int, request_id: Optional[str] = None) -> Dict:
+        \"""Ultime tracce del ring buffer (più recenti prima), filtrabili per correlation ID\"""
+        traces = [trace for trace in reversed(list(self._recent))
+                  if request_id is None or trace.request_id == request_id]
+        return otlp_document(traces[:limit], self.service_name)
+
+    def _run(self) -> None:
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.error(f'Trace export disabled, cannot open {self.path}: {str(e)}')
+            return
+
+        try:
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=0.5)]
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+                    continue
+                while len(batch) < EXPORT_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._write(fd, batch)
+        finally:
+            os.close(fd)
+
+    def _write(self, fd: int, batch: List[Trace]) -> None:
+        # Una riga per batch con una sola write in O_APPEND: le righe di più worker non si mescolano
+        line = (json.dumps(otlp_document(batch, self.service_name), separators=(',', ':')) + '\\n').encode('utf-8')
+        try:
+            view = memoryview(line)
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError as e:
+            logger.warning(f'Trace export failed: {str(e)}')
+            with self._lock:
+                self._export_dropped += len(batch)
+            return
+        with self._lock:
+            self._exported += len(batch)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sampleRate': self.sample_rate,
+                'buffered': len(self._recent),
+                'traces': self._traces,
+                'spansDropped': self._spans_dropped,
+                'file': self.path,
+                'exported': self._exported,
+                'exportDropped': self._export_dropped,
+            }
+"""
+
+
+# ============================================================================
+# LOGGING: feedback_logging.py (coda + listener thread)
+# ============================================================================
+
+FEEDBACK_LOGGING = """
+\"""
+Logging non bloccante per la feedback API
+I thread delle richieste accodano i record (con il correlation ID della
+richiesta) senza formattarli; un listener thread li formatta e li scrive.
+Errori identici ripetuti vengono limitati, i record scartati contati
+\"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from feedback_tracing import current_request_id
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s %(request_id)s: %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    \"""Un oggetto JSON per riga: ts, level, logger, message e campi di contesto\"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['requestId'] = request_id
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    \"""Formato testo con correlation ID ('-' fuori dalle richieste) e conteggio dei soppressi\"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, defaults={'request_id': '-'})
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f'{text} [{suppressed} identical records suppressed]' if suppressed else text
+
+
+class RateLimiter:
+    \"""
+    Al più burst record identici (logger, livello, messaggio) per finestra.
+
+    I record in eccesso vengono contati; il primo record identico della
+    finestra successiva riporta quanti ne sono stati soppressi. Oltre
+    max_keys messaggi distinti la tabella viene azzerata.
+    \"""
+
+    def __init__(self, burst: int = 5, window: float = 60.0, max_keys: int = 1000):
+        self.burst = burst
+        self.window = window
+        self.max_keys = max_keys
+        # chiave -> [inizio finestra, record emessi, record soppressi]
+        self._seen: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def allow(self, record: logging.LogRecord) -> Tuple[bool, int]:
+        \"""(record da emettere, soppressi della finestra precedente da riportare)\"""
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is None and len(self._seen) >= self.max_keys:
+                    self._seen.clear()
+                self._seen[key] = [now, 1, 0]
+                return True, entry[2] if entry else 0
+            if entry[1] < self.burst:
+                entry[1] += 1
+                return True, 0
+            entry[2] += 1
+            self.suppressed += 1
+            return False, 0
+
+
+class NonBlockingHandler(logging.handlers.QueueHandler):
+    \"""
+    QueueHandler che non blocca mai il thread chiamante.
+
+    Coda piena: il record viene scartato e contato. prepare() non formatta
+    il messaggio (lo fa il listener), aggiunge solo il correlation ID della
+    richiesta corrente, leggibile solo da questo thread. Il rate limit vale
+    da WARNING in su.
+    \"""
+
+    def __init__(self, log_queue: queue.Queue, limiter: Optional[RateLimiter] = None):
+        super().__init__(log_queue)
+        self.limiter = limiter
+        # emit è serializzato dal lock dell'handler (Handler.handle)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        request_id = current_request_id()
+        if request_id:
+            record.request_id = request_id
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if self.limiter is not None and record.levelno >= logging.WARNING:
+                allowed, suppressed = self.limiter.allow(record)
+                if not allowed:
+                    return
+                if suppressed:
+                    record.suppressed = suppressed
+            self.queue.put_nowait(self.prepare(record))
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Con la coda piena put_nowait fallirebbe e stop() resterebbe in attesa
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    \"""
+    Logging del processo worker: root logger -> NonBlockingHandler -> coda
+    limitata -> listener thread -> handler di output.
+
+    start() sposta sul listener gli handler già presenti sul root logger
+    (o uno StreamHandler su stderr con formato json/text) e lascia al root
+    solo l'handler di coda: app.logger di Flask e i logger dei moduli vi
+    arrivano per propagazione.
+    \"""
+
+    def __init__(self, enabled: bool = True, queue_size: int = 10000, fmt: str = 'json',
+                 level: str = 'WARNING', burst: int = 5, window: float = 60.0):
+        self.enabled = enabled
+        self.queue_size = queue_size
+        self.format = fmt
+        self.level = level.upper()
+        self.limiter = RateLimiter(burst, window) if burst > 0 else None
+        self.handler: Optional[NonBlockingHandler] = None
+        self._targets: List[logging.Handler] = []
+        self._listener: Optional[_Listener] = None
+
+    @classmethod
+    def from_env(cls) -> 'LogPipeline':
+        \"""Crea pipeline da variabili d'ambiente FEEDBACK_LOG_*\"""
+        return cls(
+            enabled=os.getenv('FEEDBACK_LOG_ASYNC', 'true').lower() == 'true',
+            queue_size=int(os.getenv('FEEDBACK_LOG_QUEUE', 10000)),
+            fmt=os.getenv('FEEDBACK_LOG_FORMAT', 'json'),
+            level=os.getenv('FEEDBACK_LOG_LEVEL', 'WARNING'),
+            burst=int(os.getenv('FEEDBACK_LOG_RATE_BURST', 5)),
+            window=float(os.getenv('FEEDBACK_LOG_RATE_WINDOW', 60)),
+        )
+
+    def start(self) -> None:
+        if not self.enabled or self._listener is not None:
+            return
+        root = logging.getLogger()
+        self._targets = list(root.handlers)
+        if not self._targets:
+            output = logging.StreamHandler(sys.stderr)
+            output.setFormatter(JsonFormatter() if self.format == 'json' else TextFormatter())
+            self._targets = [output]
+        for target in self._targets:
+            root.removeHandler(target)
+
+        log_queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self.handler = NonBlockingHandler(log_queue, self.limiter)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+
+        self._listener = _Listener(log_queue, *self._targets, respect_handler_level=True)
+        self._listener.start()
+
+    def stop(self) -> None:
+        \"""Scrive i record in coda e ripristina gli handler originali del root logger\"""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self._listener = None
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        for target in self._targets:
+            root.addHandler(target)
+
+    def stats(self) -> Dict:
+        handler = self.handler
+        return {
+            'enabled': self.enabled,
+            'format': self.format,
+            'queueSize': self.queue_size,
+            'depth': handler.queue.qsize() if handler else 0,
+            'enqueued': handler.enqueued if handler else 0,
+            'dropped': handler.dropped if handler else 0,
+            'suppressed': self.limiter.suppressed if self.limiter else 0,
+        }
+"""
+
+
+# ============================================================================
+# PRODUCTION LAUNCHER: feedback_server.py (gunicorn pre-fork)
+# ============================================================================
+
+FEEDBACK_SERVER_LAUNCHER = """
+\"""
+Launcher di produzione per la feedback API
+Avvia gunicorn (pre-fork) con worker e thread calcolati da CPU e modalità
+SQLite, keep-alive configurabile, reload graduale e riciclo dei worker
+
+Avvio:
+    python feedback_server.py                  # variante Flask (gthread)
+    python feedback_server.py --variant asgi   # variante ASGI (uvicorn worker)
+    python feedback_server.py --print-config   # mostra la configurazione calcolata
+
+Reload graduale: kill -HUP <pid master> (i worker vengono sostituiti uno alla volta)
+\"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Dict
+
+from gunicorn.app.base import BaseApplication
+
+import feedback_db
+
+# Limite worker: SQLite ha un solo writer, oltre questa soglia aumenta
+# solo la contesa sul lock
+MAX_WORKERS = 8
+
 
-        if not data or 'feedbacks' not in data or not isinstance(data['feedbacks'], list):
-            return jsonify({
-                'success': False,
-                'error': 'Invalid request body. Expected {"feedbacks": [...]}'
-            }), 400
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
 
-        feedbacks = data['feedbacks']
-        saved_count = 0
-        errors = []
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+def storage_backend() -> str:
+    return os.getenv('FEEDBACK_STORAGE', 'sqlite')
 
-        for idx, feedback in enumerate(feedbacks):
-            try:
-                message_id = feedback.get('messageId')
-                feedback_type = feedback.get('feedbackType')
-
-                if not message_id or not validate_feedback_type(feedback_type):
-                    errors.append({
-                        'index': idx,
-                        'error': 'Invalid feedback data'
-                    })
-                    continue
 
-                cursor.execute('''
-                    INSERT OR REPLACE INTO feedback
-                    (message_id, feedback_type, session_id, timestamp, metadata)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    message_id,
-                    feedback_type,
-                    feedback.get('sessionId'),
-                    feedback.get('timestamp', datetime.utcnow().isoformat()),
-                    json.dumps(feedback.get('metadata', {}))
-                ))
+def autotune(cpu_count: int, journal_mode: str, ingest_mode: str) -> Dict:
+    \"""
+    Calcola worker e thread per CPU disponibili e modalità SQLite.
+
+    - Rollback journal (profilo 'legacy'): i lettori bloccano il writer,
+      un solo processo con pochi thread evita 'database is locked'.
+    - WAL: letture concorrenti tra processi, un worker per CPU.
+    - Ingestion 'queue'/'log': le richieste di scrittura non attendono il
+      commit SQLite, bastano meno thread per worker.
+    - Ingestion 'log': un solo worker (vedi build_config), thread al posto
+      dei processi.
+    \"""
+    if journal_mode.upper() != 'WAL':
+        workers = 1
+        threads = min(4, 2 * cpu_count)
+    elif ingest_mode == 'log':
+        workers = 1
+        threads = min(32, 4 * cpu_count)
+    else:
+        workers = max(1, min(cpu_count, MAX_WORKERS))
+        threads = 2 if ingest_mode in ('queue', 'log') else 4
+
+    # Una connessione per thread + writer thread della coda o compactor
+    pool_size = threads + (1 if ingest_mode in ('queue', 'log') else 0)
+
+    return {'workers': workers, 'threads': threads, 'pool_size': pool_size}
+
+
+def build_config(variant: str) -> Dict:
+    \"""Configurazione gunicorn: autotuning + override da variabili d'ambiente (senza effetti collaterali)\"""
+    profile = feedback_db.get_profile(feedback_db.DB_PROFILE)
+    ingest_mode = os.getenv('FEEDBACK_INGEST_MODE', 'sync')
+    tuned = autotune(os.cpu_count() or 1, profile['journal_mode'], ingest_mode)
+
+    # Storage in memoria: i dati sono per processo, un solo worker
+    if storage_backend() == 'memory':
+        tuned['workers'] = 1
+
+    workers = env_int('FEEDBACK_WORKERS', tuned['workers'])
+    threads = env_int('FEEDBACK_THREADS', tuned['threads'])
+
+    # Log append-only: last-write-wins segue l'ordine di compattazione, che è
+    # quello di scrittura solo con un processo (ogni worker riversa il proprio
+    # log per conto suo). Vale anche contro FEEDBACK_WORKERS
+    if ingest_mode == 'log' and workers > 1:
+        print(f'FEEDBACK_INGEST_MODE=log requires a single worker, ignoring FEEDBACK_WORKERS={workers}',
+              file=sys.stderr)
+        workers = 1
+    pool_size = env_int('FEEDBACK_DB_POOL_SIZE', tuned['pool_size'])
+
+    config = {
+        'bind': f"0.0.0.0:{os.getenv('PORT', 5000)}",
+        'workers': workers,
+        # Keep-alive più lungo dell'idle timeout del load balancer (tipicamente
+        # 60s): altrimenti il server chiude connessioni che il proxy riusa (ECONNRESET)
+        'keepalive': env_int('FEEDBACK_KEEPALIVE', 75),
+        'timeout': env_int('FEEDBACK_TIMEOUT', 30),
+        'graceful_timeout': env_int('FEEDBACK_GRACEFUL_TIMEOUT', 30),
+        # Riciclo worker dopo N richieste (jitter: non si riavviano tutti insieme)
+        'max_requests': env_int('FEEDBACK_MAX_REQUESTS', 10000),
+        'max_requests_jitter': env_int('FEEDBACK_MAX_REQUESTS_JITTER', 1000),
+        'backlog': env_int('FEEDBACK_BACKLOG', 2048),
+        # Niente preload: la coda write-behind avvia thread che non sopravvivono al fork
+        'preload_app': False,
+        'accesslog': os.getenv('FEEDBACK_ACCESS_LOG') or None,
+        'errorlog': '-',
+        'on_starting': on_starting,
+        'worker_exit': worker_exit,
+    }
 
-                saved_count += 1
+    if variant == 'asgi':
+        config['worker_class'] = 'uvicorn.workers.UvicornWorker'
+    else:
+        config['worker_class'] = 'gthread'
+        config['threads'] = threads
+        # Connessioni keep-alive massime per worker gthread
+        config['worker_connections'] = env_int('FEEDBACK_WORKER_CONNECTIONS', 1000)
+
+    config['_tuning'] = {
+        'cpuCount': os.cpu_count(),
+        'profile': feedback_db.DB_PROFILE,
+        'journalMode': profile['journal_mode'],
+        'ingestMode': ingest_mode,
+        'storage': storage_backend(),
+        'poolSize': pool_size,
+    }
+    return config
 
-            except Exception as e:
-                errors.append({
-                    'index': idx,
-                    'error': str(e)
-                })
 
-        conn.commit()
-        conn.close()
+def apply_pool_size(pool_size: int) -> None:
+    \"""Dimensione del pool calcolata, da applicare prima di avviare gunicorn\"""
+    # Il master ha già importato feedback_db: i worker ereditano il pool via fork
+    os.environ['FEEDBACK_DB_POOL_SIZE'] = str(pool_size)
+    feedback_db.POOL_SIZE = pool_size
+    feedback_db.pool.max_size = pool_size
 
-        return jsonify({
-            'success': True,
-            'savedCount': saved_count,
-            'totalCount': len(feedbacks),
-            'errors': errors
-        }), 200
 
-    except Exception as e:
-        app.logger.error(f'Error saving batch feedback: {str(e)}')
-        return jsonify({
-            'success': False,
-            'error': 'Internal server error'
-        }), 500
+# ============================================================================
+# SERVER HOOKS
+# ============================================================================
 
+def on_starting(server) -> None:
+    \"""Schema e rollup creati una sola volta nel master, prima del fork\"""
+    if storage_backend() != 'sqlite':
+        return
+    feedback_db.init_db()
+    feedback_db.pool.close_all()
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    \"""Health check endpoint\"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat()
-    }), 200
+
+def worker_exit(server, worker) -> None:
+    \"""Flush della coda write-behind quando un worker termina o viene riciclato\"""
+    service = sys.modules.get('feedback_service')
+    if service is not None:
+        service.stop()
 
 
 # ============================================================================
-# MAIN
+# APPLICATION
 # ============================================================================
 
+class FeedbackServer(BaseApplication):
+    \"""Gunicorn embedded: configurazione da dict invece che da file\"""
+
+    def __init__(self, app_uri: str, options: Dict):
+        self.app_uri = app_uri
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        if self.app_uri == 'feedback_api_async:app':
+            from feedback_api_async import app
+        else:
+            from feedback_api import app
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Feedback API production server')
+    parser.add_argument('--variant', choices=['flask', 'asgi'],
+                        default=os.getenv('FEEDBACK_API_VARIANT', 'flask'))
+    parser.add_argument('--print-config', action='store_true',
+                        help='mostra la configurazione calcolata ed esce')
+    args = parser.parse_args()
+
+    config = build_config(args.variant)
+    tuning = config.pop('_tuning')
+
+    if args.print_config:
+        printable = {k: v for k, v in config.items() if not callable(v)}
+        print(json.dumps({'variant': args.variant, 'tuning': tuning, 'gunicorn': printable}, indent=2))
+        return
+
+    apply_pool_size(tuning['poolSize'])
+    app_uri = 'feedback_api_async:app' if args.variant == 'asgi' else 'feedback_api:app'
+    FeedbackServer(app_uri, config).run()
+
+
 if __name__ == '__main__':
-    port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    main()
 """
 
 
@@ -619,6 +8381,9 @@ export interface SyncConfig {
   syncInterval?: number; // milliseconds
   retryAttempts?: number;
   retryDelay?: number; // milliseconds
+  maxBatchSize?: number; // feedback per richiesta batch (limite server)
+  sessionId?: string; // sessione dell'utente: senza, il pull delle modifiche è disattivato
+  pullChanges?: boolean; // scarica le modifiche della sessione a ogni sync
 }
 
 export class FeedbackSyncService {
@@ -631,6 +8396,8 @@ export class FeedbackSyncService {
       syncInterval: 60000, // 1 minuto default
       retryAttempts: 3,
       retryDelay: 2000,
+      maxBatchSize: 500,
+      pullChanges: true,
       ...config,
     };
   }
@@ -678,22 +8445,37 @@ export class FeedbackSyncService {
 
       if (unsyncedFeedback.length === 0) {
         console.log('No unsynced feedback to sync');
-        return;
+      } else {
+        console.log('Syncing', unsyncedFeedback.length, 'feedback items');
       }
 
-      console.log('Syncing', unsyncedFeedback.length, 'feedback items');
+      // Backlog grandi vengono inviati a blocchi entro il limite del server
+      const batchSize = this.config.maxBatchSize || 500;
+
+      for (let offset = 0; offset < unsyncedFeedback.length; offset += batchSize) {
+        const batch = unsyncedFeedback.slice(offset, offset + batchSize);
+        const response = await this.sendBatchFeedback(batch);
 
-      const response = await this.sendBatchFeedback(unsyncedFeedback);
+        if (!response.success) {
+          console.error('Failed to sync feedback:', response.error);
+          break;
+        }
 
-      if (response.success) {
-        // Marca tutti come sincronizzati
-        unsyncedFeedback.forEach((feedback) => {
-          feedbackStorage.markAsSynced(feedback.messageId);
+        // Marca come sincronizzati solo quelli salvati dal server
+        const failed = new Set<number>((response.errors || []).map((e: any) => e.index));
+        batch.forEach((feedback, index) => {
+          if (!failed.has(index)) {
+            feedbackStorage.markAsSynced(feedback.messageId);
+          }
         });
 
         console.log('Successfully synced', response.savedCount, 'feedback items');
-      } else {
-        console.error('Failed to sync feedback:', response.error);
+      }
+
+      // Dopo il push: le modifiche fatte da altri dispositivi/schede. Solo con
+      // una sessione: il feed globale contiene i voti di tutti gli utenti
+      if (this.config.pullChanges && this.config.sessionId) {
+        await this.pullChanges(this.config.sessionId);
       }
     } catch (error) {
       console.error('Error during feedback sync:', error);
@@ -702,6 +8484,48 @@ export class FeedbackSyncService {
     }
   }
 
+  /**
+   * Scarica le modifiche della sessione dopo l'ultimo cursore (sync incrementale)
+   * Una richiesta per pagina invece di una per messaggio; ritorna i feedback applicati
+   */
+  async pullChanges(sessionId: string): Promise<number> {
+    let applied = 0;
+    let hasMore = true;
+
+    while (hasMore) {
+      const params = new URLSearchParams();
+      const cursor = feedbackStorage.getSyncCursor(sessionId);
+      if (cursor) params.set('since', cursor);
+      params.set('sessionId', sessionId);
+
+      // { changes: [...], cursor: "...", hasMore: boolean }
+      const page = await this.retryOperation(async () => {
+        const response = await fetch(this.config.apiUrl + '/api/feedback/changes?' + params.toString());
+
+        if (!response.ok) {
+          throw new Error('HTTP error! status: ' + response.status);
+        }
+
+        return response.json();
+      });
+
+      applied += feedbackStorage.applyRemoteFeedback(page.changes.map((f: any) => ({
+        type: f.feedbackType,
+        timestamp: f.timestamp,
+        messageId: f.messageId,
+        sessionId: f.sessionId || undefined,
+      })));
+      // Cursore salvato solo dopo aver applicato la pagina: un errore la fa riscaricare
+      feedbackStorage.setSyncCursor(page.cursor, sessionId);
+      hasMore = page.hasMore;
+    }
+
+    if (applied > 0) {
+      console.log('Pulled', applied, 'feedback changes from server');
+    }
+    return applied;
+  }
+
   /**
    * Invia singolo feedback al server
    */
@@ -757,7 +8581,7 @@ export class FeedbackSyncService {
   }
 
   /**
-   * Ottieni feedback dal server
+   * Ottieni feedback dal server (per sincronizzare più messaggi usare pullChanges)
    */
   async getFeedbackFromServer(messageId: string): Promise<any> {
     return this.retryOperation(async () => {
@@ -774,6 +8598,28 @@ export class FeedbackSyncService {
     });
   }
 
+  /**
+   * Ottieni feedback di più messaggi con una sola richiesta
+   */
+  async getFeedbackManyFromServer(messageIds: string[]): Promise<any> {
+    return this.retryOperation(async () => {
+      const response = await fetch(this.config.apiUrl + '/api/feedback/lookup', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ messageIds }),
+      });
+
+      if (!response.ok) {
+        throw new Error('HTTP error! status: ' + response.status);
+      }
+
+      // { feedbacks: { [messageId]: {...} }, missing: [...] }
+      return response.json();
+    });
+  }
+
   /**
    * Ottieni statistiche dal server
    */
@@ -978,21 +8824,24 @@ WORKDIR /app
 COPY requirements.txt .
 RUN pip install --no-cache-dir -r requirements.txt
 
-# Copy application
-COPY feedback_api.py .
+# Copy application (feedback_api.py / feedback_api_async.py + moduli condivisi)
+COPY feedback_*.py ./
 
 # Create data directory
 RUN mkdir -p /app/data
 
 # Environment variables
 ENV FEEDBACK_DB_PATH=/app/data/feedback.db
+ENV FEEDBACK_DB_PROFILE=balanced
+# FEEDBACK_DB_POOL_SIZE non impostata: il launcher la calcola da thread e ingestion
 ENV PORT=5000
 
 # Expose port
 EXPOSE 5000
 
-# Run application
-CMD ["python", "feedback_api.py"]
+# Run application (gunicorn pre-fork, worker/thread calcolati all'avvio)
+# Variante ASGI: CMD ["python", "feedback_server.py", "--variant", "asgi"]
+CMD ["python", "feedback_server.py"]
 
 
 # ============================================================================
@@ -1001,6 +8850,22 @@ CMD ["python", "feedback_api.py"]
 
 flask==3.0.0
 flask-cors==4.0.0
+gunicorn==22.0.0
+
+# Variante ASGI (feedback_api_async.py)
+starlette==0.37.2
+uvicorn[standard]==0.29.0
+
+# Opzionale: Content-Encoding br per le risposte JSON (senza, solo gzip)
+brotli==1.1.0
+
+
+# ============================================================================
+# DEV REQUIREMENTS: requirements-dev.txt (test, non installato nell'immagine)
+# ============================================================================
+
+-r requirements.txt
+pytest==8.2.0
 
 
 # ============================================================================
@@ -1020,16 +8885,41 @@ services:
       - feedback-data:/app/data
     environment:
       - FEEDBACK_DB_PATH=/app/data/feedback.db
+      - FEEDBACK_DB_PROFILE=balanced
+      - FEEDBACK_INGEST_MODE=sync
+      - FEEDBACK_KEEPALIVE=75
+      - FEEDBACK_MAX_REQUESTS=10000
       - PORT=5000
     restart: unless-stopped
+    # Allineato a FEEDBACK_GRACEFUL_TIMEOUT: le richieste in corso terminano
+    stop_grace_period: 30s
     healthcheck:
       test: ["CMD", "curl", "-f", "http://localhost:5000/api/health"]
       interval: 30s
       timeout: 10s
       retries: 3
 
+  # Variante ASGI per benchmark affiancato: docker compose --profile benchmark up
+  feedback-api-async:
+    profiles: ["benchmark"]
+    build:
+      context: .
+      dockerfile: Dockerfile.feedback-api
+    command: ["python", "feedback_server.py", "--variant", "asgi"]
+    ports:
+      - "5001:5000"
+    volumes:
+      - feedback-data-async:/app/data
+    environment:
+      - FEEDBACK_DB_PATH=/app/data/feedback.db
+      - FEEDBACK_DB_PROFILE=balanced
+      - FEEDBACK_INGEST_MODE=sync
+      - PORT=5000
+    restart: unless-stopped
+
 volumes:
   feedback-data:
+  feedback-data-async:
 
 
 # ============================================================================
@@ -1041,10 +8931,12 @@ services:
     name: vantyx-feedback-api
     env: python
     buildCommand: pip install -r requirements.txt
-    startCommand: python feedback_api.py
+    startCommand: python feedback_server.py
     envVars:
       - key: FEEDBACK_DB_PATH
         value: /opt/render/project/data/feedback.db
+      - key: FEEDBACK_DB_PROFILE
+        value: balanced
       - key: PORT
         value: 5000
     disk:
@@ -1060,8 +8952,140 @@ services:
 # API Configuration
 REACT_APP_API_URL=http://localhost:5000
 
+# Storage (sqlite | memory); memory: nessuna persistenza, un solo worker
+FEEDBACK_STORAGE=sqlite
+
 # Database
 FEEDBACK_DB_PATH=./feedback.db
+FEEDBACK_DB_PROFILE=balanced          # durable | balanced | throughput | legacy
+# Override della dimensione del pool: senza, feedback_server.py la calcola
+# (thread per worker + writer di coda/log); default 8 fuori dal launcher
+# FEEDBACK_DB_POOL_SIZE=8
+FEEDBACK_DB_POOL_TIMEOUT=5
+
+# Retention: mesi di partizioni da conservare (0 = nessuna scadenza)
+FEEDBACK_RETENTION_MONTHS=0
+
+# Ingestion (sync | queue | log)
+FEEDBACK_INGEST_MODE=sync
+FEEDBACK_QUEUE_MAX_SIZE=10000
+FEEDBACK_QUEUE_MAX_BATCH=500
+FEEDBACK_QUEUE_MAX_DELAY_MS=50
+FEEDBACK_QUEUE_FLUSH_ON_SHUTDOWN=true
+
+# Append-only log (FEEDBACK_INGEST_MODE=log); LOG_DIR vuoto = accanto al DB
+FEEDBACK_LOG_DIR=
+FEEDBACK_LOG_SEGMENT_KB=4096
+FEEDBACK_LOG_MAX_DELAY_MS=200
+FEEDBACK_LOG_MAX_BATCH=1000
+FEEDBACK_LOG_MAX_PENDING_MB=512
+FEEDBACK_LOG_FSYNC=false
+FEEDBACK_LOG_FLUSH_ON_SHUTDOWN=true
+
+# Batch
+FEEDBACK_BATCH_MAX_ITEMS=5000
+FEEDBACK_BATCH_CHUNK_SIZE=250
+
+# Lookup multiplo
+FEEDBACK_LOOKUP_MAX_IDS=1000
+
+# Export in streaming: righe per pagina keyset
+FEEDBACK_EXPORT_PAGE_SIZE=1000
+
+# Distinti approssimati in stats (?approxDistinct=true): errore relativo HyperLogLog
+FEEDBACK_HLL_ERROR=0.02
+
+# Top-N per valore metadata (/api/feedback/top): chiavi materializzate da
+# trigger (separate da virgola, es. prompt,context.model), n massimo, z Wilson
+FEEDBACK_TOP_KEYS=
+FEEDBACK_TOP_MAX_N=100
+FEEDBACK_TOP_Z=1.96
+
+# Sync incrementale (/api/feedback/changes): righe massime per pagina
+FEEDBACK_CHANGES_PAGE_SIZE=500
+
+# Stream SSE (/api/feedback/stream): eventi in buffer per client (oltre: si
+# scartano i più vecchi), client massimi per worker, secondi tra keep-alive,
+# attesa di riconnessione suggerita al browser (ms)
+FEEDBACK_STREAM_BUFFER=256
+FEEDBACK_STREAM_MAX_SUBSCRIBERS=100
+FEEDBACK_STREAM_KEEPALIVE=15
+FEEDBACK_STREAM_RETRY_MS=3000
+FEEDBACK_STREAM_RESYNC=60
+
+# Metriche Prometheus (/metrics): attivazione e bucket in secondi (vuoti = default)
+FEEDBACK_METRICS=true
+FEEDBACK_METRICS_REQUEST_BUCKETS=
+FEEDBACK_METRICS_DB_BUCKETS=
+
+# Token delle route /api/admin/* (Authorization: Bearer ...); vuoto = disattivate
+FEEDBACK_ADMIN_TOKEN=
+
+# Slow query log: soglia (ms) per log + EXPLAIN QUERY PLAN, finestra (s) della
+# classifica per shape, shape massime tracciate
+FEEDBACK_SLOW_QUERY_LOG=true
+FEEDBACK_SLOW_QUERY_MS=100
+FEEDBACK_SLOW_QUERY_WINDOW=300
+FEEDBACK_SLOW_QUERY_MAX_SHAPES=500
+
+# Profiler a campionamento (solo variante Flask): frazione di richieste
+# profilate (0 = solo header X-Feedback-Profile da admin), intervallo di
+# campionamento, directory e intervallo (s) di scrittura dei file collapsed
+FEEDBACK_PROFILE_RATE=0
+FEEDBACK_PROFILE_INTERVAL_MS=5
+FEEDBACK_PROFILE_DIR=profiles
+FEEDBACK_PROFILE_FLUSH_INTERVAL=10
+
+# Tracing /api/feedback*: frazione di richieste tracciate, tracce nel ring
+# buffer (e in coda verso il file), file JSON Lines OTLP (vuoto = solo memoria)
+FEEDBACK_TRACING=false
+FEEDBACK_TRACE_SAMPLE_RATE=1.0
+FEEDBACK_TRACE_BUFFER=1000
+FEEDBACK_TRACE_FILE=
+OTEL_SERVICE_NAME=feedback-api
+
+# Log su coda (listener thread): formato json|text, livello del root logger,
+# record in coda prima di scartare, record identici per finestra (s)
+FEEDBACK_LOG_ASYNC=true
+FEEDBACK_LOG_FORMAT=json
+FEEDBACK_LOG_LEVEL=WARNING
+FEEDBACK_LOG_QUEUE=10000
+FEEDBACK_LOG_RATE_BURST=5
+FEEDBACK_LOG_RATE_WINDOW=60
+
+# Compressione risposte di lettura (gzip, br con brotli installato) oltre la soglia in byte
+FEEDBACK_COMPRESS_MIN_BYTES=1024
+FEEDBACK_COMPRESS_GZIP_LEVEL=6
+FEEDBACK_COMPRESS_BROTLI_QUALITY=4
+
+# Validità (secondi) dell'ETag di stats in assenza di scritture
+FEEDBACK_STATS_ETAG_WINDOW=300
+
+# Chiavi metadata filtrabili in stats ed export (?meta.<chiave>=): colonna
+# generata + indice per partizione, separate da virgola (es. model,context.locale)
+FEEDBACK_INDEXED_KEYS=
+
+# Serie temporali stats: cache (TTL in secondi) e bucket massimi per risposta
+FEEDBACK_TIMESERIES_CACHE_SIZE=256
+FEEDBACK_TIMESERIES_CACHE_TTL=10
+FEEDBACK_TIMESERIES_MAX_BUCKETS=2000
+
+# Server di produzione (feedback_server.py); WORKERS/THREADS vuoti = autotuning
+FEEDBACK_API_VARIANT=flask
+FEEDBACK_WORKERS=
+FEEDBACK_THREADS=
+FEEDBACK_KEEPALIVE=75
+FEEDBACK_TIMEOUT=30
+FEEDBACK_GRACEFUL_TIMEOUT=30
+FEEDBACK_MAX_REQUESTS=10000
+FEEDBACK_MAX_REQUESTS_JITTER=1000
+
+# Response cache (GET /api/feedback/:messageId), TTL in secondi
+FEEDBACK_CACHE_SIZE=10000
+FEEDBACK_CACHE_TTL=30
+FEEDBACK_CACHE_NEGATIVE_TTL=5
+# Controllo scritture degli altri worker (secondi)
+FEEDBACK_CACHE_VERSION_INTERVAL=1
 
 # Sync Configuration
 FEEDBACK_SYNC_INTERVAL=60000
@@ -1148,20 +9172,110 @@ File: `src/hooks/useFeedbackWithSync.ts`
 ### 2. Backend Setup
 
 #### a) Create Flask API
+Generare i file backend (variante Flask, ASGI o entrambe):
+```bash
+python feedback_persistence.py --emit ./backend --variant both
+```
+
 File: `feedback_api.py`
 ```bash
 # Copy FEEDBACK_API_BACKEND content
 ```
 
+File: `feedback_api_async.py` (variante ASGI/Starlette, stesse route)
+```bash
+# Copy FEEDBACK_API_ASYNC content
+```
+
+File: `feedback_service.py` (logica route condivisa)
+```bash
+# Copy FEEDBACK_SERVICE content
+```
+
+File: `feedback_db.py` (connection pool SQLite)
+```bash
+# Copy FEEDBACK_DB_LAYER content
+```
+
+File: `feedback_storage.py` (backend di storage: SQLite e in memoria)
+```bash
+# Copy FEEDBACK_STORAGE_BACKENDS content
+```
+
+File: `feedback_ingest.py` (coda write-behind)
+```bash
+# Copy FEEDBACK_INGEST_QUEUE content
+```
+
+File: `feedback_log.py` (append-only log + compactor)
+```bash
+# Copy FEEDBACK_APPEND_LOG content
+```
+
+File: `feedback_cache.py` (cache risposte LRU + TTL)
+```bash
+# Copy FEEDBACK_CACHE content
+```
+
+File: `feedback_stream.py` (fan-out SSE per /api/feedback/stream)
+```bash
+# Copy FEEDBACK_STREAM content
+```
+
+File: `feedback_metrics.py` (istogrammi e /metrics Prometheus)
+```bash
+# Copy FEEDBACK_METRICS content
+```
+
+File: `feedback_profiler.py` (profiler a campionamento, stack collapsed per route)
+```bash
+# Copy FEEDBACK_PROFILER content
+```
+
+File: `feedback_tracing.py` (correlation ID e span OTLP/JSON)
+```bash
+# Copy FEEDBACK_TRACING content
+```
+
+File: `feedback_logging.py` (log su coda con listener thread)
+```bash
+# Copy FEEDBACK_LOGGING content
+```
+
 #### b) Install Dependencies
 ```bash
 pip install flask flask-cors
+# variante ASGI
+pip install starlette "uvicorn[standard]"
 ```
 
 #### c) Run API
 ```bash
 python feedback_api.py
+# variante ASGI
+uvicorn feedback_api_async:app --host 0.0.0.0 --port 5001
+```
+
+Le due varianti espongono gli stessi contratti: per un benchmark affiancato
+puntare lo stesso scenario Artillery a `:5000` (Flask) e `:5001` (ASGI).
+
+#### d) Run in Production
+`python feedback_api.py` usa il dev server Werkzeug (un solo processo).
+In produzione usare il launcher gunicorn:
+```bash
+python feedback_server.py --print-config   # worker/thread calcolati
+python feedback_server.py                  # Flask, worker gthread
+python feedback_server.py --variant asgi   # ASGI, worker uvicorn
+kill -HUP <master-pid>                     # reload graduale dei worker
 ```
+Autotuning: con WAL un worker per CPU (max 8) e 4 thread (2 in modalità
+`queue`); con rollback journal (`legacy`) un solo worker. In modalità `log` un
+solo worker con 4 thread per CPU (max 32), anche con `FEEDBACK_WORKERS`: i voti
+ripetuti devono essere riversati nell'ordine in cui sono arrivati. Per lo stesso
+motivo in modalità `log` riavviare il server invece del reload con `HUP`, che
+sovrappone vecchio e nuovo worker. Keep-alive 75s (più
+dell'idle timeout del load balancer) e riciclo worker ogni
+`FEEDBACK_MAX_REQUESTS` richieste (± jitter).
 
 ### 3. Integration
 
@@ -1197,6 +9311,27 @@ Save single feedback
 }
 ```
 
+Con `FEEDBACK_INGEST_MODE=queue` risponde `202 {"success": true, "queued": true}`
+dopo la validazione; il voto viene committato in gruppo dal writer thread
+(max `FEEDBACK_QUEUE_MAX_BATCH` voti o `FEEDBACK_QUEUE_MAX_DELAY_MS` ms).
+Con coda piena risponde `503` con `Retry-After`.
+
+Con `FEEDBACK_INGEST_MODE=log` la risposta è la stessa `202`, ma il voto viene
+appeso a un log segmentato su disco (`FEEDBACK_LOG_DIR`) invece che a una coda
+in memoria: la richiesta non attende mai il lock SQLite. Un compactor thread
+riversa i segmenti sigillati (ogni `FEEDBACK_LOG_SEGMENT_KB` KB o
+`FEEDBACK_LOG_MAX_DELAY_MS` ms) nella tabella `feedback`, con last-write-wins
+per `messageId`. Fino alla compattazione il voto non è visibile in lettura.
+All'avvio i segmenti non ancora compattati (crash, kill -9) vengono riversati
+prima di servire. Il launcher usa un solo worker in questa modalità: con più
+processi i log verrebbero riversati in ordine diverso da quello di arrivo e un
+voto vecchio potrebbe sovrascriverne uno nuovo. Con `FEEDBACK_LOG_FSYNC=true` ogni append fa fsync
+(sopravvive anche al crash del sistema operativo, a costo di latenza).
+
+`timestamp` (opzionale, default ora del server) deve essere ISO 8601, altrimenti
+`400`; senza fuso orario è UTC. Le letture lo restituiscono normalizzato in UTC
+con millisecondi (`2025-10-07T10:00:00.000Z`, formato di `Date.toISOString()`).
+
 ### POST /api/feedback/batch
 Save multiple feedbacks
 ```json
@@ -1211,12 +9346,238 @@ Save multiple feedbacks
 }
 ```
 
+Tutti gli elementi vengono validati prima della scrittura; quelli validi sono
+scritti con `executemany` a blocchi di `FEEDBACK_BATCH_CHUNK_SIZE`, ognuno con
+il proprio commit. Oltre `FEEDBACK_BATCH_MAX_ITEMS` elementi risponde `413`.
+La risposta include i tempi per blocco:
+```json
+{
+  "success": true, "savedCount": 600, "totalCount": 601,
+  "errors": [{ "index": 17, "error": "Invalid feedback data" }],
+  "chunkSize": 250,
+  "chunks": [{ "offset": 0, "size": 250, "ms": 3.1 }, ...]
+}
+```
+
 ### GET /api/feedback/:messageId
 Get feedback for specific message
 
+Le risposte (inclusi i 404) sono servite da una cache LRU + TTL per processo,
+invalidata da `POST /api/feedback` e `POST /api/feedback/batch`. Le scritture
+ricevute da altri worker sono rilevate dal contatore modifiche nel DB, riletto
+al più ogni `FEEDBACK_CACHE_VERSION_INTERVAL` secondi (default 1): se è
+cambiato la cache del worker viene svuotata. I contatori (`hits`, `misses`,
+`evictions`, `expirations`, `versionFlushes`, ...) sono in `/api/health` sotto `"cache"`.
+
+#### Conditional GET e compressione
+`GET /api/feedback/:messageId`, `/stats` e `/stats/timeseries` rispondono con
+`ETag` (debole) e `Cache-Control: no-cache`: il browser conserva la risposta e
+a ogni poll la rivalida con `If-None-Match`; se nulla è cambiato riceve `304`
+senza body (la cache HTTP è condivisa tra le schede, quindi anche il polling
+di `feedbackSync` da più tab). Per `/stats` l'ETag (e `Last-Modified`) deriva
+da un contatore modifiche nel DB (`feedback_sequence`, avanzato in ogni
+transazione di scrittura e dalla retention) ed è confrontato prima delle
+aggregazioni: un 304 costa una lettura di due righe. Senza scritture l'ETag
+resta valido `FEEDBACK_STATS_ETAG_WINDOW` secondi, perché le righe escono
+dalla finestra `days` anche senza modifiche. Per gli altri due l'ETag è un
+digest del body già in cache.
+
+Le risposte da `FEEDBACK_COMPRESS_MIN_BYTES` byte in su sono compresse secondo
+`Accept-Encoding`: `br` se il pacchetto `brotli` è installato, altrimenti
+`gzip` (con `Vary: Accept-Encoding`).
+```bash
+curl -si -H 'If-None-Match: W/"42-5867-0c1f..."' 'http://localhost:5000/api/feedback/stats?days=7'
+# HTTP/1.1 304 NOT MODIFIED
+```
+
+### GET /api/feedback/changes?since=<cursore>&sessionId=...&limit=500
+Sync incrementale: i feedback scritti dopo il cursore, in ordine di scrittura,
+e il cursore da usare alla richiesta successiva. Senza `since` parte
+dall'inizio. Ogni scrittura (anche un cambio voto) assegna alla riga un id
+nuovo dalla sequenza globale, nella stessa transazione: il cursore è quell'id
+in base 36 e ogni pagina è una query per partizione sulla chiave primaria
+(con `sessionId`, sull'indice di sessione), unite nello stesso snapshot.
+`hasMore: true` indica che un'altra pagina è già disponibile
+(`FEEDBACK_CHANGES_PAGE_SIZE` righe al massimo). Le righe eliminate dalla
+retention non vengono segnalate.
+```json
+{"success": true, "cursor": "2n9c", "hasMore": false,
+ "changes": [{"messageId": "msg_1", "feedbackType": "negative", "sessionId": "session_abc",
+              "timestamp": "2025-10-07T10:00:00.000Z", "metadata": {}}]}
+```
+`FeedbackSyncService` lo usa dopo ogni push (`pullChanges`, disattivabile con
+`pullChanges: false`) solo se la config ha un `sessionId`: senza, il feed
+conterrebbe i voti di tutti gli utenti. Applica le modifiche della sessione al
+localStorage (le modifiche locali non ancora inviate hanno la precedenza) e
+salva il cursore per sessione, così un dispositivo che si riconnette
+scarica solo ciò che è cambiato invece di interrogare un messaggio alla volta.
+
+### GET /api/feedback/stream?sessionId=...
+Server-Sent Events per le dashboard, al posto del polling di stats: ogni
+commit (sync, coda write-behind o compactor del log) pubblica le righe su un
+fan-out in processo che le accoda a tutti i client connessi.
+- `event: feedback` — un feedback scritto (`id:` progressivo del worker;
+  con `sessionId` solo quelli della sessione)
+- `event: counters` — totali del giorno UTC e `delta` rispetto al
+  `counters` precedente; il primo evento di ogni stream è lo snapshot
+- `event: dropped` — il client era troppo lento e ha perso `count` eventi:
+  riallinearsi con `/api/feedback/changes` o stats
+```
+event: counters
+data: {"day":"2025-10-07","total":1250,"positive":1100,"negative":150,"delta":{"total":1,"positive":0,"negative":1}}
+```
+Ogni client ha un buffer di `FEEDBACK_STREAM_BUFFER` eventi: quando è pieno
+si scartano i più vecchi, quindi un client lento non rallenta le scritture
+(la pubblicazione è un append in memoria, senza I/O di rete). Oltre
+`FEEDBACK_STREAM_MAX_SUBSCRIBERS` client il worker risponde 503. Un commento
+`: keep-alive` ogni `FEEDBACK_STREAM_KEEPALIVE` secondi tiene aperta la
+connessione attraverso i proxy (`X-Accel-Buffering: no` per nginx).
+
+I totali vengono letti dai rollup solo alla prima sottoscrizione e poi al più
+ogni `FEEDBACK_STREAM_RESYNC` secondi (dal thread di uno stream, al keep-alive);
+tra una lettura e l'altra ogni commit li aggiorna in memoria, senza query né
+attese sul write path.
+
+Il fan-out è per processo: con più worker ogni stream riceve i feedback
+scritti dal proprio worker, e i `counters` includono le scritture degli altri
+worker solo dal riallineamento successivo. Con la variante Flask (gthread) ogni stream
+aperto occupa un thread del worker: per molte dashboard usare la variante
+ASGI, dove uno stream è solo una coroutine in attesa.
+
+### POST /api/feedback/lookup
+Get feedback for many messages in one request (max `FEEDBACK_LOOKUP_MAX_IDS`)
+```json
+{ "messageIds": ["msg_1", "msg_2", "msg_3"] }
+```
+Risposta (stessa serializzazione di `GET /api/feedback/:messageId`):
+```json
+{
+  "success": true,
+  "feedbacks": { "msg_1": { "messageId": "msg_1", "feedbackType": "positive", ... } },
+  "missing": ["msg_2", "msg_3"]
+}
+```
+Disponibile anche come `GET /api/feedback/lookup?messageIds=msg_1,msg_2`.
+
 ### GET /api/feedback/stats?days=30
 Get aggregate statistics
 
+Le statistiche sommano le tabelle rollup `feedback_daily` e
+`feedback_session_daily` (aggiornate dai trigger nella stessa transazione di
+ogni scrittura, cambi voto inclusi); solo il giorno di inizio finestra viene
+letto dalla partizione raw del suo mese. Per ricalcolare i rollup:
+```bash
+flask --app feedback_api rebuild-rollups
+```
+
+Con `?approxDistinct=true` (e senza `sessionId`) la risposta include
+`approxDistinct: {sessions, messages, relativeError}`: sessioni e messaggi
+distinti stimati con sketch HyperLogLog giornalieri, aggiornati a ogni
+scrittura nella stessa transazione e uniti al momento della query, invece di
+`COUNT(DISTINCT ...)` sulla finestra. Ogni sketch occupa una quantità fissa
+di memoria (`FEEDBACK_HLL_ERROR=0.02` → 4 KiB, errore tipico 2%). La
+granularità è giornaliera: il giorno di inizio finestra è contato per intero.
+Cambiando `FEEDBACK_HLL_ERROR` gli sketch vengono ricalcolati all'avvio.
+
+#### Filtri metadata (`?meta.<chiave>=<valore>`)
+Stats ed export accettano filtri sulle chiavi metadata elencate in
+`FEEDBACK_INDEXED_KEYS` (anche annidate, es. `meta.context.locale=it`; più
+filtri in AND). Per ognuna le partizioni hanno una colonna generata
+`VIRTUAL` (`json_extract(metadata, '$.chiave')`, calcolata solo per
+l'indice) e un indice `(colonna, ts)`, aggiornato nella stessa scrittura:
+il filtro è un range scan invece di un parse JSON per ogni riga. I valori
+sono confrontati come testo (`5` → `"5"`, `true` → `"1"`). Chiavi non
+indicizzate → 400. Con filtri, stats interroga le partizioni invece dei
+rollup e non include `approxDistinct`. Cambiando `FEEDBACK_INDEXED_KEYS`
+colonne e indici vengono aggiunti o rimossi all'avvio.
+```bash
+curl -s 'http://localhost:5000/api/feedback/stats?days=7&meta.model=gpt-4o'
+```
+
+### GET /api/feedback/stats/timeseries?interval=hour|day&days=7
+Serie temporale per i grafici della dashboard, al posto di più chiamate a
+`/stats` con finestre diverse. I bucket sono allineati all'intervallo (UTC),
+dal bucket che contiene `ora - days` a quello corrente incluso; i bucket
+vuoti sono presenti con conteggi a zero. `day` legge solo i rollup
+giornalieri, `hour` esegue una GROUP BY per partizione. `sessionId`
+opzionale.
+```json
+{"success": true, "interval": "hour", "days": 1, "sessionId": null,
+ "buckets": [{"start": "2025-10-07T10:00:00.000Z", "total": 4, "positive": 3, "negative": 1}, ...]}
+```
+Le risposte sono in cache per (interval, days, sessionId, bucket corrente)
+per `FEEDBACK_TIMESERIES_CACHE_TTL` secondi, senza invalidazione alle
+scritture: il bucket corrente può essere indietro al più di quel TTL.
+
+### GET /api/feedback/top?by=prompt&order=negative_ratio&n=20&days=30&minVotes=1
+I valori della chiave metadata `by` (anche annidata: `context.model`) con
+il peggior rapporto di voti, per trovare prompt o risposte problematiche.
+`order`: `negative_ratio` (default) e `positive_ratio` ordinano per limite
+inferiore di Wilson (`FEEDBACK_TOP_Z`), che penalizza i valori con pochi
+voti; `negative` e `total` per conteggio. `minVotes` esclude i valori con
+meno voti, `n` è al massimo `FEEDBACK_TOP_MAX_N`.
+```json
+{"success": true, "by": "prompt", "order": "negative_ratio", "days": 30, "n": 20, "groups": 412,
+ "items": [{"value": "p17", "total": 40, "positive": 6, "negative": 34, "negativeRatio": 0.85, "score": 0.709}, ...]}
+```
+Le chiavi elencate in `FEEDBACK_TOP_KEYS` sono materializzate nella tabella
+`feedback_top_daily` (voti per chiave, giorno e valore) da trigger sulle
+partizioni, come i rollup: la query somma i giorni interi e legge dalla
+partizione solo il giorno di inizio finestra. Le altre chiavi vengono
+aggregate al momento con `json_extract` (una GROUP BY per partizione). In
+entrambi i casi la selezione dei primi `n` usa un heap, senza ordinare
+tutti i valori. Cambiando `FEEDBACK_TOP_KEYS` trigger e tabella vengono
+ricreati all'avvio.
+
+### GET /api/feedback/export?format=ndjson|csv&from=...&to=...&sessionId=...
+Export dei feedback grezzi in streaming, ordinati per `(timestamp, id)`.
+`from` (incluso) e `to` (escluso) sono ISO 8601, tutti i filtri opzionali.
+Le righe vengono lette con paginazione keyset (`WHERE (ts, id) > (?, ?)`,
+costo costante per pagina, a differenza di `OFFSET`) e serializzate una
+pagina alla volta (`FEEDBACK_EXPORT_PAGE_SIZE` righe): la memoria usata non
+dipende dalla dimensione dell'export. Il body è compresso al volo con la
+codifica negoziata come per le altre risposte (`br` se `brotli` è installato,
+altrimenti `gzip`; `q=0` rispettato). User agent e IP non vengono esportati.
+```bash
+curl -s --compressed 'http://localhost:5000/api/feedback/export?format=csv&from=2025-10-01' > feedback.csv
+```
+
+### Partizioni mensili e retention
+I feedback sono salvati in una tabella per mese (`feedback_p202610`, ...),
+scelta dal mese del `timestamp`; il registro è `feedback_partitions`. Lookup e
+statistiche toccano solo le partizioni necessarie (dalla più recente); una
+scrittura tocca la partizione del suo mese e, per un voto ripetuto in un altro
+mese, solo la partizione del voto precedente (indice `feedback_locations`,
+`message_id` → mese). La view `feedback` (UNION ALL) resta disponibile per query ad hoc. Un database
+esistente con la tabella `feedback` viene migrato al primo avvio.
+
+La retention elimina mesi interi con `DROP TABLE`, senza DELETE riga per riga:
+```bash
+FEEDBACK_RETENTION_MONTHS=12          # applicata all'avvio di ogni worker
+flask --app feedback_api list-partitions
+flask --app feedback_api expire-partitions --keep 12   # da cron, es. mensile
+flask --app feedback_api expire-partitions --before 2025-01
+```
+
+### Migrazioni e formato di storage
+La versione dello schema è in `PRAGMA user_version` (`schemaVersion` in
+`/api/health`); `init_db()` applica all'avvio le migrazioni mancanti di
+`MIGRATIONS`, una transazione breve per partizione, riprendendo da dove si
+era fermata dopo un'interruzione:
+
+| Versione | Migrazione |
+|----------|------------|
+| 1 | tabella `feedback` unica → partizioni mensili, a blocchi da 1000 righe |
+| 2 | layout compatto: `ts` INTEGER (ms epoch UTC), `vote` 1/2, `user_agent_id` → `feedback_user_agents`, `ip` BLOB 4/16 byte |
+| 3 | indice `feedback_locations` (`message_id` → mese della partizione) |
+
+I voti del layout testuale vengono normalizzati (`' Positive'` → `positive`);
+le righe con un voto sconosciuto vengono scartate e contate in un warning.
+
+Le statistiche scansionano l'indice intero su `ts` invece di confrontare
+stringhe ISO. La view `feedback` decodifica le colonne per le query ad hoc.
+Nuove migrazioni vanno solo aggiunte in coda a `MIGRATIONS`.
+
 ## Features
 
 ✅ **Client-Side**
@@ -1227,7 +9588,10 @@ Get aggregate statistics
 - Gestione sincronizzazione
 
 ✅ **Server-Side**
-- SQLite database
+- SQLite database (WAL mode, pool di connessioni per worker)
+- Profili prestazioni PRAGMA (`FEEDBACK_DB_PROFILE`)
+- Rollup giornalieri/per sessione per statistiche a costo costante
+- Partizioni mensili con retention via DROP TABLE
 - Batch insert support
 - Query ottimizzate con indici
 - Rate limiting ready
@@ -1248,6 +9612,34 @@ Get aggregate statistics
 
 ## Testing
 
+### Storage Backends
+Le route usano solo l'interfaccia `FeedbackStorage` (`upsert`, `upsert_many`,
+`get`, `get_many`, `stats`, `iterate`); `FEEDBACK_STORAGE` sceglie
+l'implementazione (`sqlite` o `memory`). La stessa suite gira su ogni backend
+registrato in `BACKENDS`:
+```bash
+pytest test_feedback_storage.py                               # conformance
+FEEDBACK_BENCH=1 pytest test_feedback_storage.py -s -k bench  # op/s per backend
+```
+Un nuovo backend va aggiunto a `BACKENDS` e deve passare la conformance.
+Le dipendenze di test sono in `requirements-dev.txt`
+(`pip install -r requirements-dev.txt`), non nell'immagine di produzione.
+
+### Moduli
+Ogni componente ha il suo modulo di test, tutti eseguibili con `pytest`.
+La fixture `storage` (un database nuovo per test, su ogni backend di
+`BACKENDS`), `sqlite_storage` e l'helper `row()` sono in `conftest.py`:
+```bash
+pytest test_feedback_ingest.py        # group commit della coda, compaction e recovery del log
+pytest test_feedback_stream.py        # buffer per subscriber ed eventi dropped dello stream SSE
+pytest test_feedback_metrics.py       # istogrammi e formato di esposizione di /metrics
+pytest test_feedback_db.py            # retention delle partizioni, migrazione dello schema, slow query log
+pytest test_feedback_profiler.py      # stack collassati del profiler a campionamento
+pytest test_feedback_tracing.py       # span, traceparent ed export OTLP del tracing
+pytest test_feedback_logging.py       # rate limit e scarti del logging non bloccante
+pytest test_feedback_cache.py         # LRU/TTL, invalidazione e put con generation della cache
+```
+
 ### Local Testing
 ```bash
 # Start API
@@ -1288,6 +9680,144 @@ console.log(stats);
 curl http://localhost:5000/api/feedback/stats?days=30
 ```
 
+### Connection Pool
+```bash
+curl http://localhost:5000/api/health
+# "db": { "profile": "balanced", "size": 4, "inUse": 1, "peakInUse": 6,
+#         "waits": 12, "avgWaitMs": 0.8, "timeouts": 0, ... }
+```
+Se `timeouts` > 0 o `waits` cresce rapidamente, aumentare `FEEDBACK_DB_POOL_SIZE`.
+
+### Ingestion Queue
+In modalità `queue`, `/api/health` espone `"ingest"` con `depth`, `peakDepth`,
+`rejected`, `avgBatchSize`, `lastCommitMs`, `avgCommitMs`, `maxCommitMs`.
+
+In modalità `log`, `"ingest"` espone `lagMs` (età del record più vecchio non
+ancora in SQLite), `pendingSegments`, `pendingRows`, `pendingBytes`,
+`compactedRows`, `recoveredRows`, `failedRows` (righe che continuano a fallire
+il commit, salvate in `<segmento>.failed` senza bloccare le altre) e
+`failedSegments` (segmenti illeggibili rinominati in `.failed`). I file
+`.failed` hanno il formato dei segmenti. Un `lagMs` che cresce oltre
+`FEEDBACK_LOG_MAX_DELAY_MS` indica un compactor più lento del traffico.
+
+### Metriche Prometheus (`GET /metrics`)
+```bash
+curl http://localhost:5000/metrics
+# feedback_http_request_duration_seconds_bucket{handler="save_feedback",method="POST",status="201",le="0.005"} 1840
+# feedback_db_statement_duration_seconds_bucket{operation="commit",le="0.001"} 912
+# feedback_http_requests_in_flight{handler="stream_feedback"} 3
+```
+- `feedback_http_request_duration_seconds` — istogramma per handler (nome
+  della funzione di route, uguale in Flask e ASGI), metodo e status, fino
+  agli header di risposta (per export e stream: fino all'inizio del body)
+- `feedback_db_statement_duration_seconds` — `execute`, `executemany` e
+  `commit` SQLite (le attese del write lock compaiono in `BEGIN IMMEDIATE`)
+- `feedback_http_requests_in_flight` — richieste in corso, stream aperti inclusi
+- gauge di pool, coda/log di ingestione e stream
+
+I bucket sono fissi (`FEEDBACK_METRICS_REQUEST_BUCKETS`,
+`FEEDBACK_METRICS_DB_BUCKETS`) e ogni thread aggiorna un proprio shard
+senza lock: un'osservazione costa qualche centinaio di nanosecondi. Le
+metriche sono per processo: con più worker gunicorn ogni scrape vede il
+worker che risponde (per la vista completa, un worker per container o uno
+scrape per porta). `FEEDBACK_METRICS=false` le disattiva.
+
+### Slow query log (`GET /api/admin/slow-queries`)
+Ogni statement SQLite (execute, executemany, commit) viene cronometrato e
+sommato per shape: testo normalizzato con le partizioni unificate
+(`feedback_p*`) e le liste `IN (...)` ridotte. Gli statement da
+`FEEDBACK_SLOW_QUERY_MS` in su vengono loggati con il loro `EXPLAIN QUERY
+PLAN` (calcolato una volta per shape e finestra), per vedere subito se una
+stats o un batch ha usato l'indice atteso:
+```
+Slow query: 184.2 ms (execute) SELECT COUNT(*), SUM(vote = 1), SUM(vote = 2) FROM feedback_p* WHERE ts >= ? AND ts < ? AND session_id = ? | plan: SEARCH feedback_p202510 USING INDEX idx_feedback_p202510_session_id (session_id=?)
+```
+La classifica delle shape più costose delle ultime una-due finestre
+(`FEEDBACK_SLOW_QUERY_WINDOW` secondi) è sulla route admin, abilitata solo
+se `FEEDBACK_ADMIN_TOKEN` è impostato:
+```bash
+curl -H "Authorization: Bearer $FEEDBACK_ADMIN_TOKEN" 'http://localhost:5000/api/admin/slow-queries?order=max&limit=10'
+# {"success": true, "thresholdMs": 100.0, "windowSeconds": 300.0, "slow": 3,
+#  "queries": [{"shape": "...", "count": 812, "totalMs": 950.1, "avgMs": 1.17,
+#               "maxMs": 184.2, "slowCount": 3, "plan": ["SEARCH ..."]}]}
+```
+`order`: `total` (default), `max`, `avg`, `count`. Come le metriche, i dati
+sono del worker che risponde.
+
+### Profiler a campionamento
+Disattivato di default (`FEEDBACK_PROFILE_RATE=0` e nessun token admin):
+il costo per richiesta è un solo controllo. Con `FEEDBACK_PROFILE_RATE=0.01`
+viene profilato l'1% delle richieste; con `FEEDBACK_ADMIN_TOKEN` impostato
+si profila una singola richiesta con l'header `X-Feedback-Profile: 1`:
+```bash
+curl -H "Authorization: Bearer $FEEDBACK_ADMIN_TOKEN" -H 'X-Feedback-Profile: 1' 'http://localhost:5000/api/feedback/stats?days=90'
+```
+Un thread campiona ogni `FEEDBACK_PROFILE_INTERVAL_MS` ms lo stack dei soli
+thread con una richiesta profilata e aggrega per route in
+`$FEEDBACK_PROFILE_DIR/<endpoint>.<pid>.collapsed` (una riga
+`frame;frame;... conteggio` per stack), riscritti ogni
+`FEEDBACK_PROFILE_FLUSH_INTERVAL` secondi e allo shutdown:
+```bash
+flamegraph.pl profiles/get_stats.*.collapsed > stats.svg   # o speedscope
+```
+Nella variante ASGI gli handler sono coroutine sullo stesso event loop, il
+cui stack non è attribuibile a una richiesta: `ProfilingMiddleware`
+campiona il thread dell'executor SQLite mentre esegue il lavoro della
+richiesta (`run_db`: query e serializzazione). Il tempo speso sull'event
+loop (parsing, compressione delle risposte) non compare nei file collapsed:
+per quello usare py-spy sul processo.
+
+### Tracing delle richieste (`GET /api/admin/traces`)
+Con `FEEDBACK_TRACING=true` ogni risposta di `/api/feedback*` porta
+`X-Request-ID`: quello inviato dal client se valido, altrimenti il trace id
+generato (con un `traceparent` W3C la traccia continua quella del
+chiamante). Le richieste campionate (`FEEDBACK_TRACE_SAMPLE_RATE`) hanno
+uno span radice `POST /api/feedback` e gli span figli:
+
+| Span | Cosa misura |
+|------|-------------|
+| `parse` | lettura e decodifica del body JSON |
+| `validate` | validazione dei campi e costruzione delle righe |
+| `db.execute` / `db.executemany` | singolo statement SQLite (`db.statement` è la shape dello slow query log) |
+| `db.commit` | commit (fsync del WAL secondo il profilo) |
+| `serialize` | serializzazione JSON della risposta |
+
+Un `db.execute` di `BEGIN IMMEDIATE` lungo o un `db.commit` lungo sono
+attesa del lock di scrittura SQLite (busy timeout); il tempo della radice
+non coperto dagli span figli è overhead Python o attesa di una connessione
+libera (`pool.avgWaitMs` in `/api/health`). La radice si chiude con gli
+header della risposta: il body di export e stream non è incluso, lo stream
+SSE non è tracciato.
+
+Le tracce restano in un ring buffer per worker (`FEEDBACK_TRACE_BUFFER`),
+leggibile come `ExportTraceServiceRequest` OTLP/JSON:
+```bash
+curl -H "Authorization: Bearer $FEEDBACK_ADMIN_TOKEN" 'http://localhost:5000/api/admin/traces?requestId=3f2a...&limit=5'
+```
+Con `FEEDBACK_TRACE_FILE=traces.jsonl` un thread accoda le tracce al file,
+una riga OTLP/JSON per gruppo (lo stesso formato del file exporter
+dell'OpenTelemetry Collector, quindi rileggibile con il suo otlpjsonfile
+receiver). Se il file non tiene il passo, le tracce restano solo in
+memoria e vengono contate in `tracing.exportDropped` di `/api/health`.
+
+### Log non bloccanti
+I log dell'applicazione (`app.logger`, logger dei moduli) passano da una
+coda limitata (`FEEDBACK_LOG_QUEUE`): il thread della richiesta accoda il
+record con il suo correlation ID e prosegue, un listener thread lo
+formatta (JSON per riga, o `FEEDBACK_LOG_FORMAT=text`) e lo scrive su
+stderr. Con stderr o disco lenti la coda si riempie e i record in più
+vengono scartati invece di rallentare le richieste:
+```json
+{"ts": "2026-01-15T10:00:00.123+00:00", "level": "ERROR", "logger": "feedback_api", "message": "Error saving feedback: database is locked", "pid": 41, "thread": "ThreadPoolExecutor-0_3", "requestId": "3f2a...", "suppressed": 212}
+```
+Da WARNING in su, oltre `FEEDBACK_LOG_RATE_BURST` record identici per
+finestra di `FEEDBACK_LOG_RATE_WINDOW` secondi vengono soppressi; il
+primo della finestra successiva riporta quanti (`suppressed`). Contatori
+in `logging` di `/api/health` e su `/metrics` (`feedback_log_dropped_total`,
+`feedback_log_suppressed_total`, `feedback_log_queue_depth`). I log di
+gunicorn e uvicorn restano sui loro handler. `FEEDBACK_LOG_ASYNC=false`
+ripristina il logging sincrono.
+
 ## Deployment
 
 ### Docker
@@ -1332,18 +9862,77 @@ FEEDBACK_DB_PATH=/path/to/feedback.db
 - Check file permissions
 - Verify disk space
 - Run migrations if needed
+- "database is locked": verificare che il profilo usi WAL (`legacy` usa rollback journal)
 
 ## Next Steps
 
 1. Add authentication/authorization
 2. Implement rate limiting
-3. Add database migrations
-4. Set up monitoring/alerts
-5. Add analytics dashboard
-6. Implement feedback comments
+3. Set up monitoring/alerts
+4. Add analytics dashboard
+5. Implement feedback comments
 """
 
 
+# ============================================================================
+# BACKEND FILES
+# ============================================================================
+
+# Moduli condivisi da entrambe le varianti backend
+BACKEND_COMMON_FILES: Dict[str, str] = {
+    'feedback_service.py': FEEDBACK_SERVICE,
+    'feedback_db.py': FEEDBACK_DB_LAYER,
+    'test_feedback_db.py': FEEDBACK_DB_TESTS,
+    'feedback_sketch.py': FEEDBACK_SKETCH,
+    'feedback_storage.py': FEEDBACK_STORAGE_BACKENDS,
+    'conftest.py': FEEDBACK_CONFTEST,
+    'test_feedback_storage.py': FEEDBACK_STORAGE_TESTS,
+    'test_feedback_ingest.py': FEEDBACK_INGEST_TESTS,
+    'feedback_ingest.py': FEEDBACK_INGEST_QUEUE,
+    'feedback_log.py': FEEDBACK_APPEND_LOG,
+    'feedback_cache.py': FEEDBACK_CACHE,
+    'test_feedback_cache.py': FEEDBACK_CACHE_TESTS,
+    'feedback_stream.py': FEEDBACK_STREAM,
+    'test_feedback_stream.py': FEEDBACK_STREAM_TESTS,
+    'feedback_metrics.py': FEEDBACK_METRICS,
+    'test_feedback_metrics.py': FEEDBACK_METRICS_TESTS,
+    'feedback_profiler.py': FEEDBACK_PROFILER,
+    'test_feedback_profiler.py': FEEDBACK_PROFILER_TESTS,
+    'feedback_tracing.py': FEEDBACK_TRACING,
+    'test_feedback_tracing.py': FEEDBACK_TRACING_TESTS,
+    'feedback_logging.py': FEEDBACK_LOGGING,
+    'test_feedback_logging.py': FEEDBACK_LOGGING_TESTS,
+    'feedback_server.py': FEEDBACK_SERVER_LAUNCHER,
+}
+
+# Entry point per variante: Flask (WSGI) o Starlette (ASGI)
+BACKEND_VARIANTS: Dict[str, Dict[str, str]] = {
+    'flask': {'feedback_api.py': FEEDBACK_API_BACKEND},
+    'asgi': {'feedback_api_async.py': FEEDBACK_API_ASYNC},
+}
+
+
+def write_backend_files(output_dir: str, variant: str = 'flask') -> List[str]:
+    """Scrive i file backend per variante ('flask', 'asgi' o 'both')"""
+    variants = list(BACKEND_VARIANTS) if variant == 'both' else [variant]
+    if any(v not in BACKEND_VARIANTS for v in variants):
+        raise ValueError(f"Unknown variant: {variant}")
+
+    files = dict(BACKEND_COMMON_FILES)
+    for v in variants:
+        files.update(BACKEND_VARIANTS[v])
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for filename, content in files.items():
+        path = os.path.join(output_dir, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content.lstrip('\n'))
+        written.append(path)
+
+    return written
+
+
 # ============================================================================
 # MAIN
 # ============================================================================
@@ -1351,6 +9940,18 @@ FEEDBACK_DB_PATH=/path/to/feedback.db
 def main():
     """Genera documentazione implementazione persistenza feedback"""
 
+    parser = argparse.ArgumentParser(description='Feedback persistence templates')
+    parser.add_argument('--emit', metavar='DIR',
+                        help='scrive i file backend in DIR invece di stampare i template')
+    parser.add_argument('--variant', choices=['flask', 'asgi', 'both'], default='flask',
+                        help='variante backend da generare (default: flask)')
+    args = parser.parse_args()
+
+    if args.emit:
+        for path in write_backend_files(args.emit, args.variant):
+            print(f"- {path}")
+        return
+
     print("=" * 80)
     print("FEEDBACK PERSISTENCE IMPLEMENTATION")
     print("=" * 80)
@@ -1366,22 +9967,87 @@ def main():
     print(FEEDBACK_API_BACKEND)
     print()
 
-    print("3. SYNC SERVICE")
+    print("3. BACKEND API (ASGI/Starlette + SQLite)")
+    print("-" * 80)
+    print(FEEDBACK_API_ASYNC)
+    print()
+
+    print("4. ROUTE LOGIC (shared)")
+    print("-" * 80)
+    print(FEEDBACK_SERVICE)
+    print()
+
+    print("5. DATABASE LAYER (SQLite pool)")
+    print("-" * 80)
+    print(FEEDBACK_DB_LAYER)
+    print()
+
+    print("6. STORAGE BACKENDS (SQLite / in-memory)")
+    print("-" * 80)
+    print(FEEDBACK_STORAGE_BACKENDS)
+    print()
+
+    print("7. INGESTION QUEUE (write-behind)")
+    print("-" * 80)
+    print(FEEDBACK_INGEST_QUEUE)
+    print()
+
+    print("8. APPEND-ONLY LOG (compactor)")
+    print("-" * 80)
+    print(FEEDBACK_APPEND_LOG)
+    print()
+
+    print("9. RESPONSE CACHE (LRU + TTL)")
+    print("-" * 80)
+    print(FEEDBACK_CACHE)
+    print()
+
+    print("10. LIVE STREAM (SSE fan-out)")
+    print("-" * 80)
+    print(FEEDBACK_STREAM)
+    print()
+
+    print("11. METRICS (Prometheus)")
+    print("-" * 80)
+    print(FEEDBACK_METRICS)
+    print()
+
+    print("12. SAMPLING PROFILER (collapsed stacks)")
+    print("-" * 80)
+    print(FEEDBACK_PROFILER)
+    print()
+
+    print("13. TRACING (OTLP/JSON spans)")
+    print("-" * 80)
+    print(FEEDBACK_TRACING)
+    print()
+
+    print("14. LOGGING (queue + listener)")
+    print("-" * 80)
+    print(FEEDBACK_LOGGING)
+    print()
+
+    print("15. PRODUCTION LAUNCHER (gunicorn)")
+    print("-" * 80)
+    print(FEEDBACK_SERVER_LAUNCHER)
+    print()
+
+    print("16. SYNC SERVICE")
     print("-" * 80)
     print(FEEDBACK_SYNC_SERVICE)
     print()
 
-    print("4. HOOK WITH SYNC")
+    print("17. HOOK WITH SYNC")
     print("-" * 80)
     print(FEEDBACK_HOOK_WITH_SYNC)
     print()
 
-    print("5. DEPLOYMENT CONFIGURATION")
+    print("18. DEPLOYMENT CONFIGURATION")
     print("-" * 80)
     print(DEPLOYMENT_CONFIG)
     print()
 
-    print("6. IMPLEMENTATION GUIDE")
+    print("19. IMPLEMENTATION GUIDE")
     print("-" * 80)
     print(IMPLEMENTATION_GUIDE)
     print()
@@ -1395,9 +10061,33 @@ def main():
     print("- feedbackSync.ts (sync service)")
     print("- useFeedbackWithSync.ts (React hook)")
     print("- feedback_api.py (Flask backend)")
+    print("- feedback_api_async.py (ASGI backend)")
+    print("- feedback_service.py (shared route logic)")
+    print("- feedback_db.py (SQLite connection pool)")
+    print("- test_feedback_db.py (retention/migration/slow query log tests)")
+    print("- feedback_storage.py (storage backends)")
+    print("- conftest.py (shared test fixtures)")
+    print("- test_feedback_storage.py (backend conformance/benchmark)")
+    print("- test_feedback_ingest.py (queue/log ingestion tests)")
+    print("- feedback_ingest.py (write-behind queue)")
+    print("- feedback_log.py (append-only log)")
+    print("- feedback_cache.py (response cache)")
+    print("- test_feedback_cache.py (response cache tests)")
+    print("- feedback_stream.py (SSE fan-out)")
+    print("- test_feedback_stream.py (SSE broadcaster tests)")
+    print("- feedback_metrics.py (Prometheus metrics)")
+    print("- test_feedback_metrics.py (Prometheus metrics tests)")
+    print("- feedback_profiler.py (sampling profiler)")
+    print("- test_feedback_profiler.py (sampling profiler tests)")
+    print("- feedback_tracing.py (request tracing)")
+    print("- test_feedback_tracing.py (request tracing tests)")
+    print("- feedback_logging.py (non-blocking logging)")
+    print("- test_feedback_logging.py (non-blocking logging tests)")
+    print("- feedback_server.py (production launcher)")
     print("- Dockerfile.feedback-api")
     print("- docker-compose.yml")
     print("- requirements.txt")
+    print("- requirements-dev.txt")
     print()
 
 